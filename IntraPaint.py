@@ -6,8 +6,9 @@ from edit_ui.main_window import MainWindow
 from PyQt5 import QtCore
 from PyQt5.QtWidgets import QInputDialog
 from PIL import Image
-import requests
 import io
+from functools import partial
+from startup.http_transport import HttpTransport
 
 # argument parsing:
 parser = argparse.ArgumentParser()
@@ -23,13 +24,31 @@ parser.add_argument('--server_url', type = str, required = False, default = '',
                     help='Image generation server URL. If not provided, you will be prompted for a URL on launch.')
 parser.add_argument('--fast_ngrok_connection', type = str, required = False, default = '',
                     help='If true, connection rates will not be limited when using ngrok. This may cause rate limiting if you do not have a paid account.')
+parser.add_argument('--extra_server_url', type = str, required = False, action = 'append', default = [],
+                    help='Additional image generation server URL, may be repeated. Inpainting requests are distributed across all servers, so multiple requests can run at once.')
+parser.add_argument('--max_concurrent_jobs', type = int, required = False, default = None,
+                    help='Maximum number of inpainting requests that may run at once. Each server handles one request at a time, so by default one request runs per server.')
+
+parser.add_argument('--timeout', type = float, required = False, default = 30,
+                    help='Seconds to wait for a server response before retrying.')
+parser.add_argument('--max_retries', type = int, required = False, default = 3,
+                    help='Number of times failed server requests are retried before giving up.')
+parser.add_argument('--long_poll', type = float, required = False, default = 20,
+                    help='Seconds the server may hold each sample request open while waiting for new samples. Set to 0 to disable long-polling.')
+parser.add_argument('--seed', type = int, required = False, default = -1,
+                    help='If set, inpainting requests use this seed so that repeated requests produce the same results, allowing servers to return cached results.')
 
 args = parser.parse_args()
+# All server requests share one pool of keep-alive connections:
+transport = HttpTransport(readTimeout=args.timeout, maxRetries=args.max_retries)
 app = QApplication(sys.argv)
 screen = app.primaryScreen()
 size = screen.availableGeometry()
 global window
-def inpaint(selection, mask, prompt, batchSize, batchCount, showSample, negative="", guidanceScale=5, skipSteps=0):
+def inpaint(selection, mask, prompt, batchSize, batchCount, showSample, negative="", guidanceScale=5, skipSteps=0,
+        serverUrl=None):
+    if serverUrl is None:
+        serverUrl = args.server_url
     body = {
         'batch_size': batchSize,
         'num_batches': batchCount,
@@ -42,6 +61,8 @@ def inpaint(selection, mask, prompt, batchSize, batchCount, showSample, negative
         'width': selection.width,
         'height': selection.height
     }
+    if args.seed >= 0:
+        body['seed'] = args.seed
 
     def errorCheck(serverResponse, contextStr):
         if serverResponse.status_code != 200:
@@ -52,10 +73,10 @@ def inpaint(selection, mask, prompt, batchSize, batchCount, showSample, negative
                 print("RES")
                 print(serverResponse.content)
                 raise Exception(f"{serverResponse.status_code} response to {contextStr}: unknown error")
-    res = requests.post(args.server_url, json=body, timeout=30)
+    res = transport.post(serverUrl, json=body)
     errorCheck(res, 'New inpainting request')
         
-    # POST to args.server_url, check response
+    # POST to serverUrl, check response
     # If invalid or error response, throw Exception
     samples = {}
     in_progress = True
@@ -64,18 +85,29 @@ def inpaint(selection, mask, prompt, batchSize, batchCount, showSample, negative
     # refresh times in microseconds:
     minRefresh = 300000
     maxRefresh = 60000000
-    if('.ngrok.io' in args.server_url and not args.fast_ngrok_connection):
+    if('.ngrok.io' in serverUrl and not args.fast_ngrok_connection):
         # Free ngrok accounts only allow 20 connections per minute, lower the refresh rate to avoid failures:
         minRefresh = 3000000
+    # When long-polling, the server waits until new samples are available before responding, so the next request can
+    # be sent immediately after receiving samples. Empty responses mean either the wait expired or the server doesn't
+    # support long-polling, so the normal refresh rate is used after those.
+    longPollWait = max(args.long_poll, 0)
+    sampleTimeout = (transport.timeout[0], transport.timeout[1] + longPollWait)
+    receivedSamples = False
 
     while in_progress:
-        sleepTime = min(minRefresh * pow(2, errorCount), maxRefresh)
+        if longPollWait > 0 and receivedSamples and errorCount == 0:
+            sleepTime = 0
+        else:
+            sleepTime = min(minRefresh * pow(2, errorCount), maxRefresh)
         print(f"Checking for response in {sleepTime//1000} ms...")
         QtCore.QThread.usleep(sleepTime)
         # GET server_url/sample, sending previous samples:
         res = None
+        receivedSamples = False
         try:
-            res = requests.get(f'{args.server_url}/sample', json={'samples': samples}, timeout=30)
+            res = transport.get(f'{serverUrl}/sample', json={'samples': samples, 'wait': longPollWait},
+                    timeout=sampleTimeout)
             errorCheck(res, 'sample update request')
         except Exception as err:
             errorCount += 1
@@ -92,6 +124,7 @@ def inpaint(selection, mask, prompt, batchSize, batchCount, showSample, negative
         jsonBody = res.json()
         if 'samples' not in jsonBody:
             continue
+        receivedSamples = len(jsonBody['samples']) > 0
         for sampleName in jsonBody['samples'].keys():
             try:
                 sampleImage = loadImageFromBase64(jsonBody['samples'][sampleName]['image'])
@@ -105,7 +138,9 @@ def inpaint(selection, mask, prompt, batchSize, batchCount, showSample, negative
                 continue
         in_progress = jsonBody['in_progress']
 
-window = MainWindow(size.width(), size.height(), None, inpaint)
+# Each server handles one inpainting request at a time:
+backends = [inpaint] + [partial(inpaint, serverUrl=url) for url in args.extra_server_url]
+window = MainWindow(size.width(), size.height(), None, backends, args.max_concurrent_jobs)
 window.applyArgs(args)
 window.setGeometry(0, 0, size.width(), size.height())
 window.show()
@@ -124,7 +159,7 @@ while args.server_url == '':
 # Check connection:
 def healthCheckPasses():
     try:
-        res = requests.get(args.server_url, timeout=30)
+        res = transport.get(args.server_url)
         return res.status_code == 200 and ('application/json' in res.headers['content-type']) \
             and 'success' in res.json() and res.json()['success'] == True
     except Exception as err:
@@ -133,4 +168,5 @@ def healthCheckPasses():
 while not healthCheckPasses():
     promptForURL('Server connection failed, enter a new URL or click "OK" to retry')
 app.exec_()
+transport.close()
 sys.exit()
@@ -0,0 +1,398 @@
+# Benchmarks the inpainting pipeline on CPU, using miniature models with random weights.
+#
+# None of the real model checkpoints or a GPU are needed, so this can run anywhere to catch performance regressions.
+# Absolute timings say little about real-world performance, but relative changes between commits are meaningful.
+# Results are printed as JSON, and appended as a single JSON line to --output if provided.
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+parser = argparse.ArgumentParser(description="Benchmark IntraPaint on CPU with tiny random-weight models.")
+parser.add_argument('--output', type = str, default = None, required = False,
+                    help='Append results to this file as a single JSON line.')
+parser.add_argument('--repeats', type = int, default = 3, required = False,
+                    help='Number of timed runs for each benchmark.')
+parser.add_argument('--warmup', type = int, default = 1, required = False,
+                    help='Number of untimed runs before each benchmark.')
+parser.add_argument('--steps', type = int, default = 10, required = False,
+                    help='Number of diffusion steps used by sampling benchmarks.')
+parser.add_argument('--width', type = int, default = 256, required = False,
+                    help='Image width in pixels, must be a multiple of 64.')
+parser.add_argument('--height', type = int, default = 256, required = False,
+                    help='Image height in pixels, must be a multiple of 64.')
+parser.add_argument('--batch_size', type = int, default = 1, required = False,
+                    help='Number of images generated in each batch.')
+parser.add_argument('--threads', type = int, default = None, required = False,
+                    help='Number of CPU threads used by torch, by default torch chooses.')
+parser.add_argument('--seed', type = int, default = 0, required = False,
+                    help='Random seed used for model weights and inputs.')
+parser.add_argument('--only', type = str, default = None, required = False,
+                    help='Comma-separated benchmark groups to run: sampling,pipeline,attention,conversion,server,dataset,determinism')
+args = parser.parse_args()
+
+import torch
+from torch import nn
+from PIL import Image, ImageDraw
+from torchvision import transforms
+import clip
+
+from guided_diffusion.script_util import create_model_and_diffusion, model_and_diffusion_defaults, \
+        create_gaussian_diffusion
+from guided_diffusion.unet import AttentionBlock, CrossAttention
+from guided_diffusion.profiler import Profiler, use_profiler
+from encoders.modules import BERTEmbedder
+from clip_custom.model import CLIP
+from clip_custom.clip import _transform
+from startup.create_sample_function import createSampleFunction
+from startup.generate_samples import generateSamples
+from startup.utils import imageToBase64, loadImageFromBase64
+from startup.ml_utils import imageFromNumpyData, foreachImageInSample
+from edit_ui.sample_compositor import SampleCompositor
+
+CONTEXT_DIM = 64
+CLIP_EMBED_DIM = 64
+
+class RandomBERTEmbedder(BERTEmbedder):
+    """BERTEmbedder that tokenizes with CLIP's bundled tokenizer, so the BERT tokenizer doesn't need to be downloaded."""
+    def __init__(self, n_embed, n_layer):
+        super().__init__(n_embed, n_layer, vocab_size=49408, device='cpu', use_tokenizer=False)
+
+    def forward(self, text):
+        return super().forward(clip.tokenize(text, truncate=True))
+
+class LatentDistribution:
+    """Minimal stand-in for the diagonal gaussian distribution returned by the latent diffusion VAE encoder."""
+    def __init__(self, parameters):
+        self.mean, logvar = torch.chunk(parameters, 2, dim=1)
+        self.std = torch.exp(0.5 * logvar.clamp(-30.0, 20.0))
+
+    def sample(self):
+        return self.mean + self.std * torch.randn_like(self.mean)
+
+class RandomVAE(nn.Module):
+    """
+    Stand-in for the kl-f8 VAE, with the same interface and 8x latent downscaling but only a few layers.
+    """
+    def __init__(self, channels=32, latentChannels=4):
+        super().__init__()
+        self.encoder = nn.Sequential(
+            nn.Conv2d(3, channels, 3, stride=2, padding=1), nn.SiLU(),
+            nn.Conv2d(channels, channels, 3, stride=2, padding=1), nn.SiLU(),
+            nn.Conv2d(channels, 2 * latentChannels, 3, stride=2, padding=1))
+        self.decoder = nn.Sequential(
+            nn.Conv2d(latentChannels, channels, 3, padding=1), nn.SiLU(),
+            nn.Upsample(scale_factor=2), nn.Conv2d(channels, channels, 3, padding=1), nn.SiLU(),
+            nn.Upsample(scale_factor=2), nn.Conv2d(channels, channels, 3, padding=1), nn.SiLU(),
+            nn.Upsample(scale_factor=2), nn.Conv2d(channels, 3, 3, padding=1), nn.Tanh())
+
+    def encode(self, x):
+        return LatentDistribution(self.encoder(x))
+
+    def decode(self, z):
+        return self.decoder(z)
+
+def createModels(steps, ddim=False):
+    """
+    Creates tiny random-weight versions of all models, returned in the same order as startup.load_models.loadModels.
+    """
+    model_params = {
+        'attention_resolutions': '32,16,8',
+        'class_cond': False,
+        'diffusion_steps': 1000,
+        'rescale_timesteps': True,
+        'timestep_respacing': f'ddim{steps}' if ddim else str(steps),
+        'image_size': 32,
+        'learn_sigma': False,
+        'noise_schedule': 'linear',
+        'num_channels': 32,
+        'num_heads': 2,
+        'num_res_blocks': 1,
+        'resblock_updown': False,
+        'use_fp16': False,
+        'use_scale_shift_norm': False,
+        'context_dim': CONTEXT_DIM,
+        'clip_embed_dim': CLIP_EMBED_DIM,
+        'image_condition': True,
+        'super_res_condition': False,
+    }
+    model_config = model_and_diffusion_defaults()
+    model_config.update(model_params)
+    model, diffusion = create_model_and_diffusion(**model_config)
+    model.requires_grad_(False).eval()
+    model.convert_to_fp32()
+
+    ldm = RandomVAE().requires_grad_(False).eval()
+    bert = RandomBERTEmbedder(CONTEXT_DIM, 1).requires_grad_(False).eval()
+    clip_model = CLIP(CLIP_EMBED_DIM,
+            image_resolution=32, vision_layers=1, vision_width=64, vision_patch_size=8,
+            context_length=77, vocab_size=49408, transformer_width=64, transformer_heads=1, transformer_layers=1)
+    clip_model.requires_grad_(False).eval()
+    clip_preprocess = _transform(clip_model.visual.input_resolution)
+    normalize = transforms.Normalize(mean=[0.48145466, 0.4578275, 0.40821073], std=[0.26862954, 0.26130258, 0.27577711])
+    return model_params, model, diffusion, ldm, bert, clip_model, clip_preprocess, normalize
+
+def createTestImages(width, height):
+    """Creates a random source image, and a mask covering its center."""
+    image = transforms.ToPILImage()(torch.rand(3, height, width))
+    mask = Image.new('L', (width, height), 255)
+    ImageDraw.Draw(mask).rectangle((width // 4, height // 4, width * 3 // 4, height * 3 // 4), fill=0)
+    return image, mask
+
+def timeFunction(fn, repeats, warmup):
+    """Runs a function warmup + repeats times, returning timing statistics for the last repeats runs."""
+    for _ in range(warmup):
+        fn()
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        durations.append((time.perf_counter() - start) * 1000.0)
+    durations.sort()
+    return {
+        "repeats": repeats,
+        "mean_ms": sum(durations) / len(durations),
+        "median_ms": durations[len(durations) // 2],
+        "min_ms": durations[0],
+        "max_ms": durations[-1],
+    }
+
+def benchmarkSampling(results):
+    """Times each sampling loop using the UNet directly, including per-step span timing."""
+    model_params, model, _, _, bert, clip_model, _, _ = createModels(args.steps)
+    latentShape = (args.batch_size * 2, 4, args.height // 8, args.width // 8)
+    with torch.no_grad():
+        text = clip.tokenize([""] * args.batch_size * 2, truncate=True)
+        model_kwargs = {
+            "context": bert.encode([""] * args.batch_size * 2).float(),
+            "clip_embed": clip_model.encode_text(text).float(),
+            "image_embed": torch.randn(*latentShape)
+        }
+    for sampler in ['plms', 'ddim', 'prk']:
+        diffusion = create_gaussian_diffusion(steps=1000, noise_schedule='linear', rescale_timesteps=True,
+                timestep_respacing=f'ddim{args.steps}' if sampler == 'ddim' else str(args.steps))
+        loop = getattr(diffusion, f'{sampler}_sample_loop_progressive')
+        profiler = Profiler(sync_cuda=False)
+        def runLoop():
+            with torch.no_grad(), use_profiler(profiler):
+                for _ in loop(model, latentShape, clip_denoised=False, model_kwargs=model_kwargs):
+                    pass
+        results[f'sampling/{sampler}'] = timeFunction(runLoop, args.repeats, args.warmup)
+        stepTiming = profiler.summary().get(f'{sampler}_step')
+        if stepTiming is not None:
+            results[f'sampling/{sampler}_step'] = stepTiming
+
+def benchmarkPipeline(results):
+    """Times complete inpainting operations through createSampleFunction and generateSamples."""
+    image, mask = createTestImages(args.width, args.height)
+    for sampler in ['plms', 'ddim']:
+        ddim = sampler == 'ddim'
+        model_params, model, diffusion, ldm, bert, clip_model, clip_preprocess, normalize = createModels(args.steps,
+                ddim=ddim)
+        def save_sample(i, sample, clip_score_fn=None):
+            foreachImageInSample(sample, args.batch_size, ldm, lambda k, img: imageToBase64(img))
+        def inpaint():
+            with torch.no_grad():
+                sample_fn, clip_score_fn = createSampleFunction('cpu', model, model_params, bert, clip_model,
+                        clip_preprocess, ldm, diffusion, normalize, image=None, mask=mask, prompt="benchmark",
+                        batch_size=args.batch_size, width=args.width, height=args.height, edit=image, ddim=ddim)
+                generateSamples('cpu', ldm, diffusion, sample_fn, save_sample, args.batch_size, 1, args.width,
+                        args.height)
+        results[f'pipeline/{sampler}'] = timeFunction(inpaint, args.repeats, args.warmup)
+
+def benchmarkAttention(results):
+    """Times the attention variants used within the UNet at each latent resolution."""
+    tokens = 77
+    for scale in [1, 2, 4]:
+        height = args.height // 8 // scale
+        width = args.width // 8 // scale
+        channels = 32 * scale
+        x = torch.randn(args.batch_size * 2, height * width, channels)
+        context = torch.randn(args.batch_size * 2, tokens, CONTEXT_DIM)
+        selfAttention = CrossAttention(channels, heads=2, dim_head=channels // 2).eval()
+        crossAttention = CrossAttention(channels, context_dim=CONTEXT_DIM, heads=2, dim_head=channels // 2).eval()
+        qkvAttention = AttentionBlock(channels, num_heads=2, use_new_attention_order=True).eval()
+        spatial = x.transpose(1, 2).reshape(args.batch_size * 2, channels, height, width)
+        label = f'{width}x{height}x{channels}'
+        with torch.no_grad():
+            results[f'attention/self_{label}'] = timeFunction(lambda: selfAttention(x), args.repeats, args.warmup)
+            results[f'attention/cross_{label}'] = timeFunction(lambda: crossAttention(x, context=context),
+                    args.repeats, args.warmup)
+            results[f'attention/qkv_{label}'] = timeFunction(lambda: qkvAttention(spatial), args.repeats,
+                    args.warmup)
+
+def benchmarkConversion(results):
+    """Times conversions between latents, PIL images and base64 strings."""
+    _, _, _, ldm, _, _, _, _ = createModels(args.steps)
+    image, mask = createTestImages(args.width, args.height)
+    latent = torch.randn(4, args.height // 8, args.width // 8)
+    encoded = imageToBase64(image)
+    compositor = SampleCompositor(image, mask)
+    with torch.no_grad():
+        results['conversion/image_from_latent'] = timeFunction(lambda: imageFromNumpyData(latent, ldm),
+                args.repeats, args.warmup)
+    results['conversion/image_to_base64'] = timeFunction(lambda: imageToBase64(image), args.repeats, args.warmup)
+    results['conversion/image_from_base64'] = timeFunction(lambda: loadImageFromBase64(encoded), args.repeats,
+            args.warmup)
+    results['conversion/composite_sample'] = timeFunction(lambda: compositor.composite(image), args.repeats,
+            args.warmup)
+
+def benchmarkServer(results):
+    """Times complete inpainting requests sent through the Flask server, and the delay before the first sample."""
+    from flask import current_app
+    from colabFiles.server import startServer
+    model_params, model, diffusion, ldm, bert, clip_model, clip_preprocess, normalize = createModels(args.steps)
+    app = startServer('cpu', model_params, model, diffusion, ldm, bert, clip_model, clip_preprocess, normalize)
+    client = app.test_client()
+    image, mask = createTestImages(args.width, args.height)
+    body = {
+        "edit": imageToBase64(image),
+        "mask": imageToBase64(mask),
+        "prompt": "benchmark",
+        "batch_size": args.batch_size,
+        "num_batches": 1,
+        "width": args.width,
+        "height": args.height
+    }
+    firstSampleTimes = []
+    def roundTrip():
+        start = time.perf_counter()
+        res = client.post('/', json=body)
+        assert res.status_code == 200, f'inpainting request failed: {res.get_data(as_text=True)}'
+        samples = {}
+        firstSample = None
+        inProgress = True
+        while inProgress:
+            res = client.get('/sample', json={"samples": samples, "wait": 30})
+            assert res.status_code == 200, f'sample request failed: {res.get_data(as_text=True)}'
+            jsonBody = res.get_json()
+            for key, sample in jsonBody["samples"].items():
+                loadImageFromBase64(sample["image"])
+                samples[key] = sample["timestamp"]
+                if firstSample is None:
+                    firstSample = time.perf_counter()
+            inProgress = jsonBody["in_progress"]
+        if firstSample is not None:
+            firstSampleTimes.append((firstSample - start) * 1000.0)
+        # Make sure the generation thread has exited before the next request starts:
+        with app.app_context():
+            current_app.thread.join()
+    results['server/round_trip'] = timeFunction(roundTrip, args.repeats, args.warmup)
+    timed = firstSampleTimes[-args.repeats:]
+    if len(timed) > 0:
+        results['server/first_sample'] = {
+            "repeats": len(timed),
+            "mean_ms": sum(timed) / len(timed),
+            "min_ms": min(timed),
+            "max_ms": max(timed),
+        }
+
+def benchmarkDataset(results):
+    """Times loading training images from large JPEGs, with and without reduced-scale decoding."""
+    from guided_diffusion.image_text_datasets import ImageDataset
+    # Smooth gradients with noise, roughly matching the size and compressibility of large web photos:
+    width, height = 3000, 2000
+    ramp = torch.linspace(0, 1, width).view(1, 1, width) * torch.linspace(0, 1, height).view(1, height, 1)
+    pixels = (torch.cat([ramp, ramp.flip(1), ramp.flip(2)]) * 0.8 + torch.rand(3, height, width) * 0.2)
+    with tempfile.TemporaryDirectory() as tempDir:
+        imagePath = os.path.join(tempDir, 'image.jpg')
+        textPath = os.path.join(tempDir, 'image.txt')
+        transforms.ToPILImage()(pixels).save(imagePath, quality=90)
+        with open(textPath, 'w') as file:
+            file.write('benchmark')
+        for randomCrop in [False, True]:
+            cropName = 'random_crop' if randomCrop else 'center_crop'
+            for fastDecode in [False, True]:
+                dataset = ImageDataset(256, [(imagePath, textPath)], random_crop=randomCrop, fast_decode=fastDecode)
+                decodeName = 'fast_decode' if fastDecode else 'full_decode'
+                results[f'dataset/{cropName}_{decodeName}'] = timeFunction(lambda: dataset[0], args.repeats,
+                        args.warmup)
+
+def checkDeterminism(results):
+    """
+    Checks that seeded samples are reproducible, with and without CLIP guidance. Each sample from a batch is compared
+    with the sample generated alone from its seed, and the whole batch is compared with a repeated run, using the final
+    latents.
+    """
+    image, mask = createTestImages(args.width, args.height)
+    batchSize = 4
+    for clipGuidance in [False, True]:
+        model_params, model, diffusion, ldm, bert, clip_model, clip_preprocess, normalize = createModels(args.steps)
+        def generate(batch_size, seed):
+            latents = []
+            def save_sample(i, sample, clip_score_fn=None):
+                latents.append(sample['pred_xstart'][:batch_size])
+            with torch.no_grad():
+                sample_fn, _ = createSampleFunction('cpu', model, model_params, bert, clip_model, clip_preprocess, ldm,
+                        diffusion, normalize, image=None, mask=mask, prompt="determinism", batch_size=batch_size,
+                        width=args.width, height=args.height, edit=image, clip_guidance=clipGuidance)
+                generateSamples('cpu', ldm, diffusion, sample_fn, save_sample, batch_size, 1, args.width,
+                        args.height, seed=seed)
+            return latents[-1]
+        batch = generate(batchSize, args.seed)
+        singleDiff = max((batch[k] - generate(1, args.seed + k)[0]).abs().max().item() for k in range(batchSize))
+        repeatDiff = (generate(batchSize, args.seed) - batch).abs().max().item()
+        reproducible = singleDiff < 1e-4 and repeatDiff == 0
+        name = 'clip_guided' if clipGuidance else 'unguided'
+        if not reproducible:
+            print(f'Seeded {name} samples are not reproducible: single sample difference {singleDiff}, '
+                    f'repeated batch difference {repeatDiff}', file=sys.stderr)
+        results[f'determinism/{name}'] = {
+            "single_sample_max_diff": singleDiff,
+            "repeat_max_diff": repeatDiff,
+            "reproducible": reproducible,
+        }
+
+def getCommit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+benchmarks = {
+    'sampling': benchmarkSampling,
+    'pipeline': benchmarkPipeline,
+    'attention': benchmarkAttention,
+    'conversion': benchmarkConversion,
+    'server': benchmarkServer,
+    'dataset': benchmarkDataset,
+    'determinism': checkDeterminism,
+}
+selected = args.only.split(',') if args.only else list(benchmarks.keys())
+for name in selected:
+    if name not in benchmarks:
+        print(f'Unknown benchmark group "{name}", expected one of {",".join(benchmarks.keys())}')
+        sys.exit(1)
+
+if args.threads:
+    torch.set_num_threads(args.threads)
+results = {}
+for name in selected:
+    print(f'Running {name} benchmarks...', file=sys.stderr)
+    torch.manual_seed(args.seed)
+    benchmarks[name](results)
+
+report = {
+    "commit": getCommit(),
+    "timestamp": datetime.now().isoformat(),
+    "torch_version": torch.__version__,
+    "threads": torch.get_num_threads(),
+    "config": {
+        "steps": args.steps,
+        "width": args.width,
+        "height": args.height,
+        "batch_size": args.batch_size,
+        "repeats": args.repeats,
+        "warmup": args.warmup,
+        "seed": args.seed,
+    },
+    "results": results,
+}
+print(json.dumps(report, indent=2))
+if args.output:
+    with open(args.output, 'a') as outfile:
+        outfile.write(json.dumps(report) + '\n')
@@ -6,6 +6,14 @@ from startup.utils import *
 parser = buildArgParser(includeGenParams=False, includeEditParams=False)
 parser.add_argument('--port', type = int, default = 5555, required = False,
                     help='Port used when running in server mode.')
+parser.add_argument('--trace_path', type = str, default = None, required = False,
+                    help='If set, write a Chrome trace of each inpainting request to this file.')
+parser.add_argument('--cache_dir', type = str, default = None, required = False,
+                    help='If set, cache the results of requests that include a seed in this directory.')
+parser.add_argument('--cache_size', type = int, default = 1024, required = False,
+                    help='Maximum size of the result cache, in megabytes.')
+parser.add_argument('--async_server', action='store_true',
+                    help='Handle requests asynchronously with an ASGI server, requires uvicorn.')
 args = parser.parse_args()
 
 import gc
@@ -36,6 +44,22 @@ model_params, model, diffusion, ldm, bert, clip_model, clip_preprocess, normaliz
         cpu = args.cpu,
         ddpm = args.ddpm,
         ddim = args.ddim)
-from colabFiles.server import startServer
-app = startServer(device, model_params, model, diffusion, ldm, bert, clip_model, clip_preprocess, normalize)
-app.run(port=args.port, host= '0.0.0.0')
+if args.async_server:
+    import uvicorn
+    from colabFiles.async_server import startAsyncServer
+    app = startAsyncServer(device, model_params, model, diffusion, ldm, bert, clip_model, clip_preprocess, normalize,
+            tile_size=args.tile_size,
+            mask_crop_margin=args.mask_crop_margin,
+            trace_path=args.trace_path,
+            cache_dir=args.cache_dir,
+            cache_max_bytes=args.cache_size * 1024 * 1024)
+    uvicorn.run(app, port=args.port, host='0.0.0.0')
+else:
+    from colabFiles.server import startServer
+    app = startServer(device, model_params, model, diffusion, ldm, bert, clip_model, clip_preprocess, normalize,
+            tile_size=args.tile_size,
+            mask_crop_margin=args.mask_crop_margin,
+            trace_path=args.trace_path,
+            cache_dir=args.cache_dir,
+            cache_max_bytes=args.cache_size * 1024 * 1024)
+    app.run(port=args.port, host= '0.0.0.0')
@@ -115,9 +115,13 @@ def inpaint(selection, mask, prompt, batch_size, num_batches, showSample,
             edit_height=selection.height,
             cutn=args.cutn,
             clip_guidance=args.clip_guidance,
+            clip_guidance_interval=args.clip_guidance_interval,
+            fused_clip_guidance=args.fused_clip_guidance,
             skip_timesteps=skipSteps,
             ddpm=args.ddpm,
-            ddim=args.ddim)
+            ddim=args.ddim,
+            tile_size=args.tile_size,
+            mask_crop_margin=args.mask_crop_margin)
     def save_sample(i, sample, clip_score=False):
         foreachImageInSample(
                 sample,
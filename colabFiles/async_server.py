@@ -0,0 +1,394 @@
+# Asynchronous ASGI version of the inpainting server, see startAsyncServer
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from startup.utils import imageToBase64, loadImageFromBase64
+from startup.ml_utils import foreachImageInSample
+from startup.create_sample_function import createSampleFunction
+from startup.generate_samples import generateSamples
+from guided_diffusion.profiler import Profiler, use_profiler
+from colabFiles.server_metrics import ServerMetrics
+from startup.result_cache import ResultCache, getRequestCacheKey
+
+# Longest time in seconds that a sample request may wait for new samples:
+MAX_LONG_POLL_WAIT = 60
+
+# Headers added to every response, matching flask_cors defaults used by the Flask server:
+CORS_HEADERS = [
+    (b'access-control-allow-origin', b'*'),
+    (b'access-control-allow-methods', b'GET, POST, OPTIONS'),
+    (b'access-control-allow-headers', b'Content-Type'),
+]
+
+class HttpError(Exception):
+    """Raised by request handlers to send an error response with a JSON body."""
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+class _InpaintJob:
+    """Everything the GPU thread needs to run one inpainting request."""
+    def __init__(self, json, edit, mask, profiler, started, cacheKey):
+        self.json = json
+        self.edit = edit
+        self.mask = mask
+        self.profiler = profiler
+        self.cacheKey = cacheKey
+        self.failedSaves = 0
+        # Resolved once the sample function has been created, or rejected if that failed:
+        self.started = started
+
+    def requestedOrDefault(self, key, defaultValue):
+        if key in self.json:
+            return self.json[key]
+        return defaultValue
+
+class AsyncInpaintServer:
+    """
+    ASGI application implementing the same HTTP interface as the Flask server in colabFiles/server.py.
+
+    All request handling happens on a single asyncio event loop, so slow clients only hold on to an idle coroutine
+    instead of a thread. Jobs are passed through an asyncio.Queue to a single GPU executor thread, which is the only
+    thread that ever runs the models. Use startAsyncServer to create an instance.
+    """
+
+    def __init__(self, device, model_params, model, diffusion, ldm_model, bert_model, clip_model, clip_preprocess,
+            normalize, tile_size=256, mask_crop_margin=64, trace_path=None, cache_dir=None, cache_max_bytes=1024**3):
+        self._device = device
+        self._model_params = model_params
+        self._model = model
+        self._diffusion = diffusion
+        self._ldm_model = ldm_model
+        self._bert_model = bert_model
+        self._clip_model = clip_model
+        self._clip_preprocess = clip_preprocess
+        self._normalize = normalize
+        self._tile_size = tile_size
+        self._mask_crop_margin = mask_crop_margin
+        self._trace_path = trace_path
+        self.metrics = ServerMetrics()
+        self._resultCache = ResultCache(cache_dir, cache_max_bytes) if cache_dir else None
+
+        self._gpuExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='gpu')
+        self._loop = None
+        self._queue = None
+        self._worker = None
+        self._updated = None
+
+        self.lastError = None
+        self.inProgress = False
+        self.samples = {}
+        self.profiler = None
+
+    # ASGI interface:
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._handleLifespan(receive, send)
+        elif scope['type'] == 'http':
+            self._startWorker()
+            await self._handleHttp(scope, receive, send)
+
+    async def _handleLifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self._startWorker()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self._worker is not None:
+                    self._worker.cancel()
+                self._gpuExecutor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def _startWorker(self):
+        if self._worker is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._updated = asyncio.Event()
+        self._worker = self._loop.create_task(self._runWorker())
+
+    async def _handleHttp(self, scope, receive, send):
+        start = time.perf_counter()
+        method = scope['method']
+        path = scope['path']
+        routes = {
+            ('GET', '/'): self._healthCheck,
+            ('POST', '/'): self._startInpainting,
+            ('GET', '/sample'): self._listUpdated,
+            ('GET', '/metrics'): self._getMetrics,
+        }
+        route = path if any(routePath == path for _, routePath in routes) else 'unmatched'
+        try:
+            if method == 'OPTIONS':
+                status, contentType, body = 200, 'text/plain', b''
+            elif (method, path) in routes:
+                status, contentType, body = await routes[(method, path)](receive)
+            else:
+                raise HttpError(404 if route == 'unmatched' else 405, f'No handler for {method} {path}')
+        except HttpError as err:
+            status, contentType, body = err.status, 'application/json', json.dumps({"error": err.message}).encode()
+        except Exception as err:
+            print(f'{method} {path} failed: {err}')
+            status, contentType, body = 500, 'application/json', json.dumps({"error": str(err)}).encode()
+        headers = [(b'content-type', contentType.encode()), (b'content-length', str(len(body)).encode())]
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers + CORS_HEADERS})
+        await send({'type': 'http.response.body', 'body': body})
+
+        end = time.perf_counter()
+        self.metrics.httpRequests.inc(method=method, path=route, status=status)
+        self.metrics.httpRequestSeconds.observe(end - start, method=method, path=route)
+        if self.profiler is not None:
+            self.profiler.record(f"http {method} {path}", start, end)
+
+    async def _readJson(self, receive):
+        body = b''
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                raise HttpError(400, 'client disconnected')
+            body += message.get('body', b'')
+            if not message.get('more_body', False):
+                break
+        try:
+            return json.loads(body) if len(body) > 0 else {}
+        except ValueError as err:
+            raise HttpError(400, f'invalid JSON body, {err}')
+
+    def _jsonResponse(self, data, status=200):
+        return status, 'application/json', json.dumps(data).encode()
+
+    # Request handlers, each returning (status, contentType, body):
+
+    async def _healthCheck(self, receive):
+        return self._jsonResponse({"success": True})
+
+    async def _getMetrics(self, receive):
+        return 200, 'text/plain; version=0.0.4; charset=utf-8', self.metrics.render().encode()
+
+    async def _startInpainting(self, receive):
+        json = await self._readJson(receive)
+        profiler = Profiler()
+        def decode(key):
+            with profiler.span("decode_image"):
+                return loadImageFromBase64(json[key])
+        images = {}
+        for key in ["edit", "mask"]:
+            try:
+                # Decode in the default executor so that large uploads don't block the event loop:
+                images[key] = await self._loop.run_in_executor(None, decode, key)
+            except Exception as err:
+                self.metrics.errorsTotal.inc(stage="decode_image")
+                print(f"loading {key} image failed, {err}")
+                raise HttpError(400, f"loading {key} image failed, {err}")
+
+        def checkIfBusy():
+            if self.inProgress:
+                self.metrics.errorsTotal.inc(stage="busy")
+                raise HttpError(409, "Cannot start a new operation, an existing operation is still running")
+
+        # Return cached results immediately if this exact request was already handled:
+        cacheKey = None
+        if self._resultCache is not None:
+            cacheKey = getRequestCacheKey(json, images["edit"], images["mask"], self._diffusion.num_timesteps,
+                    "plms", self._tile_size, self._mask_crop_margin)
+        if cacheKey is not None:
+            def lookup():
+                with profiler.span("cache_lookup"):
+                    return self._resultCache.get(cacheKey)
+            cached = await self._loop.run_in_executor(None, lookup)
+            self.metrics.cacheRequests.inc(result="miss" if cached is None else "hit")
+            if cached is not None:
+                checkIfBusy()
+                timestamp = datetime.timestamp(datetime.now())
+                self.samples = { name: { **sample, "timestamp": timestamp } for name, sample in cached.items() }
+                self.profiler = profiler
+                self._notifyUpdate()
+                return self._jsonResponse({"success": True})
+
+        checkIfBusy()
+        self.inProgress = True
+        self.samples = {}
+        self.profiler = profiler
+        job = _InpaintJob(json, images["edit"], images["mask"], profiler, self._loop.create_future(), cacheKey)
+        await self._queue.put(job)
+        self.metrics.queueDepth.set(self._queue.qsize())
+        self._notifyUpdate()
+        try:
+            await job.started
+        except Exception as err:
+            raise HttpError(500, f"creating sample function failed, {err}")
+        return self._jsonResponse({"success": True})
+
+    async def _listUpdated(self, receive):
+        json = await self._readJson(receive)
+        # Parse (sampleName, timestamp) pairs from request.samples, and return all samples that are missing from the
+        # request or have a newer timestamp.
+        def updatedSampleNames():
+            return [key for key in self.samples
+                    if key not in json["samples"] or json["samples"][key] < self.samples[key]["timestamp"]]
+        # If request.wait is set, wait up to that many seconds for new samples or for the operation to finish before
+        # responding:
+        wait = min(float(json.get("wait", 0)), MAX_LONG_POLL_WAIT)
+        deadline = self._loop.time() + wait
+        while len(updatedSampleNames()) == 0 and self.inProgress:
+            remaining = deadline - self._loop.time()
+            if remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(self._updated.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+        response = { "samples": { key: self.samples[key] for key in updatedSampleNames() } }
+        if self.lastError != "":
+            response["error"] = self.lastError
+        response["in_progress"] = self.inProgress
+        if self.profiler is not None:
+            response["timing"] = self.profiler.summary()
+        return self._jsonResponse(response)
+
+    # Job handling:
+
+    def _notifyUpdate(self):
+        """Wakes all waiting sample requests. Must be called on the event loop thread."""
+        self._updated.set()
+        self._updated = asyncio.Event()
+
+    def _callOnLoop(self, fn, *args):
+        self._loop.call_soon_threadsafe(fn, *args)
+
+    async def _runWorker(self):
+        while True:
+            job = await self._queue.get()
+            self.metrics.queueDepth.set(self._queue.qsize())
+            self.metrics.jobsInFlight.inc()
+            try:
+                result = await self._loop.run_in_executor(self._gpuExecutor, self._runJob, job)
+            except Exception as err:
+                result = "error"
+                self.lastError = f"sample generation error: {err}"
+            if job.cacheKey is not None and result == "success" and job.failedSaves == 0:
+                results = { name: { "image": sample["image"], "seed": sample["seed"] }
+                        for name, sample in self.samples.items() }
+                try:
+                    await self._loop.run_in_executor(None, self._resultCache.put, job.cacheKey, results)
+                except Exception as err:
+                    self.metrics.errorsTotal.inc(stage="cache_store")
+                    print(f"caching results failed, {err}")
+            self.inProgress = False
+            self.metrics.jobsInFlight.dec()
+            self.metrics.jobsTotal.inc(result=result)
+            self.metrics.observeProfiler(job.profiler)
+            self._notifyUpdate()
+
+    def _runJob(self, job):
+        """Creates the sample function and generates all samples for a job. Only runs on the GPU executor thread."""
+        def resolveStarted(err=None):
+            # The request may have been cancelled if the client disconnected:
+            if job.started.done():
+                return
+            if err is None:
+                job.started.set_result(None)
+            else:
+                job.started.set_exception(err)
+        batch_size = job.requestedOrDefault('batch_size', 1)
+        num_batches = job.requestedOrDefault('num_batches', 1)
+        width = job.requestedOrDefault('width', 256)
+        height = job.requestedOrDefault('height', 256)
+        with use_profiler(job.profiler):
+            try:
+                with job.profiler.span("create_sample_function"):
+                    sample_fn, clip_score_fn = createSampleFunction(
+                            self._device,
+                            self._model,
+                            self._model_params,
+                            self._bert_model,
+                            self._clip_model,
+                            self._clip_preprocess,
+                            self._ldm_model,
+                            self._diffusion,
+                            self._normalize,
+                            edit=job.edit,
+                            mask=job.mask,
+                            prompt = job.requestedOrDefault("prompt", ""),
+                            negative = job.requestedOrDefault("negative", ""),
+                            guidance_scale = job.requestedOrDefault("guidanceScale", 5.0),
+                            batch_size = batch_size,
+                            width = width,
+                            height = height,
+                            cutn = job.requestedOrDefault("cutn", 16),
+                            skip_timesteps = job.requestedOrDefault("skipSteps", False),
+                            tile_size = self._tile_size,
+                            mask_crop_margin = self._mask_crop_margin)
+            except Exception as err:
+                self.metrics.errorsTotal.inc(stage="create_sample_function")
+                self._callOnLoop(resolveStarted, err)
+                return "error"
+            self._callOnLoop(resolveStarted)
+
+            def addSamples(newSamples):
+                self.samples.update(newSamples)
+                self._notifyUpdate()
+            def setError(error):
+                self.lastError = error
+            def save_sample(i, sample, clip_score=False):
+                timestamp = datetime.timestamp(datetime.now())
+                newSamples = {}
+                try:
+                    def addImageToResponse(k, image):
+                        name = f'{i * batch_size + k:05}'
+                        newSamples[name] = { "image": imageToBase64(image), "timestamp": timestamp,
+                                "seed": sample["seeds"][k] }
+                    foreachImageInSample(sample, batch_size, self._ldm_model, addImageToResponse)
+                except Exception as err:
+                    self.metrics.errorsTotal.inc(stage="save_sample")
+                    job.failedSaves += 1
+                    print(f"sample save error: {err}")
+                    self._callOnLoop(setError, f"sample save error: {err}")
+                self._callOnLoop(addSamples, newSamples)
+
+            start = time.perf_counter()
+            result = "success"
+            try:
+                generateSamples(self._device,
+                        self._ldm_model,
+                        self._diffusion,
+                        sample_fn,
+                        save_sample,
+                        batch_size,
+                        num_batches,
+                        width,
+                        height,
+                        seed=job.requestedOrDefault("seed", None))
+                self.metrics.samplesTotal.inc(batch_size * num_batches)
+                self.metrics.samplesPerSecond.set(batch_size * num_batches / (time.perf_counter() - start))
+            except Exception as err:
+                result = "error"
+                self.metrics.errorsTotal.inc(stage="generate_samples")
+                print(f"sample generation error: {err}")
+                self._callOnLoop(setError, f"sample generation error: {err}")
+        if self._trace_path:
+            try:
+                job.profiler.export_chrome_trace(self._trace_path)
+            except Exception as err:
+                print(f"writing trace to {self._trace_path} failed, {err}")
+        return result
+
+def startAsyncServer(device, model_params, model, diffusion, ldm_model, bert_model, clip_model, clip_preprocess,
+        normalize, tile_size=256, mask_crop_margin=64, trace_path=None, cache_dir=None, cache_max_bytes=1024**3):
+    """
+    Creates an ASGI application that handles inpainting requests from a remote UI.
+
+    The application accepts the same requests and parameters as the Flask server created by
+    colabFiles.server.startServer, but handles them asynchronously, so it should be run with an ASGI server such as
+    uvicorn. Like the Flask server, it only runs a single inpainting operation at a time.
+    """
+    print("Starting async server...")
+    return AsyncInpaintServer(device, model_params, model, diffusion, ldm_model, bert_model, clip_model,
+            clip_preprocess, normalize, tile_size=tile_size, mask_crop_margin=mask_crop_margin, trace_path=trace_path,
+            cache_dir=cache_dir, cache_max_bytes=cache_max_bytes)
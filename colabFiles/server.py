@@ -1,7 +1,7 @@
-from flask import Flask, request, jsonify, make_response, abort, current_app, send_file
+from flask import Flask, request, jsonify, make_response, abort, current_app, send_file, g
 from flask_cors import CORS, cross_origin
 from PIL import Image
-from threading import Thread, Lock
+from threading import Thread, Lock, Condition
 import torch
 from torchvision.transforms import functional as TF
 import numpy as np
@@ -10,14 +10,34 @@ from startup.ml_utils import *
 from startup.load_models import loadModels
 from startup.create_sample_function import createSampleFunction
 from startup.generate_samples import generateSamples
+from guided_diffusion.profiler import Profiler, use_profiler
+from colabFiles.server_metrics import ServerMetrics
+from startup.result_cache import ResultCache, getRequestCacheKey
 import io
 import base64
+import time
 from datetime import datetime
 
-def startServer(device, model_params, model, diffusion, ldm_model, bert_model, clip_model, clip_preprocess, normalize):
+def startServer(device, model_params, model, diffusion, ldm_model, bert_model, clip_model, clip_preprocess, normalize,
+        tile_size=256, mask_crop_margin=64, trace_path=None, cache_dir=None, cache_max_bytes=1024**3):
     """
     Starts a Flask server to handle inpainting requests from a remote UI.
 
+    Requests larger than tile_size pixels are inpainted as overlapping tiles, set tile_size to None to disable tiling.
+    Only the masked area plus mask_crop_margin pixels of context is diffused, set mask_crop_margin to None to diffuse
+    the entire image.
+
+    Each request's timing is reported in the 'timing' field of /sample responses. If trace_path is set, a Chrome trace
+    of the most recent request is also written there whenever a request finishes. Server-wide metrics are available in
+    the Prometheus text format at /metrics.
+
+    Requests that include a 'seed' value always produce the same samples for the same inputs. If cache_dir is set,
+    the results of these requests are cached there, using at most cache_max_bytes of disk space, and repeated requests
+    are answered from the cache without generating anything.
+
+    Each sample in /sample responses includes the 'seed' used to create it. Sending that seed in a request with
+    batch_size and num_batches set to 1 reproduces just that sample, e.g. to refine it with more steps.
+
     Note that this server can only handle a single client. In the future, using a direct connection would probably
     be superior, but it's not worth the extra effort right now.
     """
@@ -28,6 +48,10 @@ def startServer(device, model_params, model, diffusion, ldm_model, bert_model, c
     CORS(app)
     context = app.app_context()
     context.push()
+    metrics = ServerMetrics()
+    result_cache = ResultCache(cache_dir, cache_max_bytes) if cache_dir else None
+    # The server always uses the default PLMS sampler:
+    sampler = "plms"
 
     with context:
         current_app.lastRequest = None
@@ -35,7 +59,28 @@ def startServer(device, model_params, model, diffusion, ldm_model, bert_model, c
         current_app.in_progress = False
         current_app.thread = None
         current_app.samples = {}
+        current_app.profiler = None
         current_app.lock = Lock()
+        # Notified whenever samples are added or an operation finishes, used to handle long-polling sample requests:
+        current_app.sampleUpdate = Condition(current_app.lock)
+
+    # Time all HTTP requests, recording them with the active request's other timing data:
+    @app.before_request
+    def startRequestTimer():
+        g.requestStart = time.perf_counter()
+
+    @app.after_request
+    def recordRequestTime(response):
+        # Group metrics by route instead of by path, so that unexpected paths can't create unlimited label values:
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        metrics.httpRequests.inc(method=request.method, path=route, status=response.status_code)
+        if 'requestStart' in g:
+            end = time.perf_counter()
+            metrics.httpRequestSeconds.observe(end - g.requestStart, method=request.method, path=route)
+            profiler = current_app.profiler
+            if profiler is not None:
+                profiler.record(f"http {request.method} {request.path}", g.requestStart, end)
+        return response
 
     # Check if the server's up:
     @app.route("/", methods=["GET"])
@@ -43,6 +88,11 @@ def startServer(device, model_params, model, diffusion, ldm_model, bert_model, c
     def health_check():
         return jsonify(success=True)
 
+    # Report server metrics for Prometheus:
+    @app.route("/metrics", methods=["GET"])
+    def get_metrics():
+        return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
     # Start an inpainting request:
     @app.route("/", methods=["POST"])
     @cross_origin()
@@ -57,82 +107,155 @@ def startServer(device, model_params, model, diffusion, ldm_model, bert_model, c
         num_batches = requestedOrDefault('num_batches', 1)
         width = requestedOrDefault('width', 256)
         height = requestedOrDefault('height', 256)
+        seed = requestedOrDefault('seed', None)
+        profiler = Profiler()
 
         edit = None
         mask = None
         try:
-            edit = loadImageFromBase64(json["edit"])
+            with profiler.span("decode_image"):
+                edit = loadImageFromBase64(json["edit"])
         except Exception as err:
+            metrics.errorsTotal.inc(stage="decode_image")
             print(f"loading edit image failed, {err}")
             abort(make_response({"error": f"loading edit image failed, {err}"}, 400))
         try:
-            mask = loadImageFromBase64(json["mask"])
+            with profiler.span("decode_image"):
+                mask = loadImageFromBase64(json["mask"])
         except Exception as err:
+            metrics.errorsTotal.inc(stage="decode_image")
             print(f"loading mask image failed, {err}")
             abort(make_response({"error": f"loading mask image failed, {err}"}, 400))
 
+        def abortIfBusy():
+            if current_app.in_progress or current_app.thread and current_app.thread.is_alive():
+                metrics.errorsTotal.inc(stage="busy")
+                abort(make_response({"error": "Cannot start a new operation, an existing operation is still running"}, 409))
+
+        # Return cached results immediately if this exact request was already handled:
+        cache_key = None
+        if result_cache is not None:
+            cache_key = getRequestCacheKey(json, edit, mask, diffusion.num_timesteps, sampler, tile_size,
+                    mask_crop_margin)
+        if cache_key is not None:
+            with profiler.span("cache_lookup"):
+                cached = result_cache.get(cache_key)
+            metrics.cacheRequests.inc(result="miss" if cached is None else "hit")
+            if cached is not None:
+                with current_app.lock:
+                    abortIfBusy()
+                    timestamp = datetime.timestamp(datetime.now())
+                    current_app.samples = { name: { **sample, "timestamp": timestamp }
+                            for name, sample in cached.items() }
+                    current_app.profiler = profiler
+                    current_app.sampleUpdate.notify_all()
+                return jsonify(success=True)
+
         sample_fn = None
         try:
-            sample_fn, clip_score_fn = createSampleFunction(
-                    device,
-                    model,
-                    model_params,
-                    bert_model,
-                    clip_model,
-                    clip_preprocess,
-                    ldm_model,
-                    diffusion,
-                    normalize,
-                    edit=edit,
-                    mask=mask,
-                    prompt = requestedOrDefault("prompt", ""),
-                    negative = requestedOrDefault("negative", ""),
-                    guidance_scale = requestedOrDefault("guidanceScale", 5.0),
-                    batch_size = batch_size,
-                    width = width,
-                    height = height,
-                    cutn = requestedOrDefault("cutn", 16),
-                    skip_timesteps = requestedOrDefault("skipSteps", False))
+            with use_profiler(profiler), profiler.span("create_sample_function"):
+                sample_fn, clip_score_fn = createSampleFunction(
+                        device,
+                        model,
+                        model_params,
+                        bert_model,
+                        clip_model,
+                        clip_preprocess,
+                        ldm_model,
+                        diffusion,
+                        normalize,
+                        edit=edit,
+                        mask=mask,
+                        prompt = requestedOrDefault("prompt", ""),
+                        negative = requestedOrDefault("negative", ""),
+                        guidance_scale = requestedOrDefault("guidanceScale", 5.0),
+                        batch_size = batch_size,
+                        width = width,
+                        height = height,
+                        cutn = requestedOrDefault("cutn", 16),
+                        skip_timesteps = requestedOrDefault("skipSteps", False),
+                        tile_size = tile_size,
+                        mask_crop_margin = mask_crop_margin)
         except Exception as err:
+            metrics.errorsTotal.inc(stage="create_sample_function")
             abort(make_response({"error": f"creating sample function failed, {err}"}, 500))
 
+        failed_saves = []
         def save_sample(i, sample, clip_score=False):
             with current_app.lock:
                 timestamp = datetime.timestamp(datetime.now())
                 try:
                     def addImageToResponse(k, image):
                         name = f'{i * batch_size + k:05}'
-                        current_app.samples[name] = { "image": imageToBase64(image), "timestamp": timestamp }
+                        current_app.samples[name] = { "image": imageToBase64(image), "timestamp": timestamp,
+                                "seed": sample["seeds"][k] }
                     foreachImageInSample(sample, batch_size, ldm_model, addImageToResponse)
                 except Exception as err:
+                    metrics.errorsTotal.inc(stage="save_sample")
+                    failed_saves.append(err)
                     current_app.lastError = f"sample save error: {err}"
                     print(current_app.lastError)
+                current_app.sampleUpdate.notify_all()
 
         def run_thread():
-            with context:
-                generateSamples(device,
-                        ldm_model,
-                        diffusion,
-                        sample_fn,
-                        save_sample,
-                        batch_size,
-                        num_batches,
-                        width,
-                        height)
+            with context, use_profiler(profiler):
+                start = time.perf_counter()
+                result = "success"
+                try:
+                    generateSamples(device,
+                            ldm_model,
+                            diffusion,
+                            sample_fn,
+                            save_sample,
+                            batch_size,
+                            num_batches,
+                            width,
+                            height,
+                            seed=seed)
+                    metrics.samplesTotal.inc(batch_size * num_batches)
+                    metrics.samplesPerSecond.set(batch_size * num_batches / (time.perf_counter() - start))
+                except Exception as err:
+                    result = "error"
+                    metrics.errorsTotal.inc(stage="generate_samples")
+                    with current_app.lock:
+                        current_app.lastError = f"sample generation error: {err}"
+                    print(current_app.lastError)
+                if cache_key is not None and result == "success" and len(failed_saves) == 0:
+                    with current_app.lock:
+                        results = { name: { "image": sample["image"], "seed": sample["seed"] }
+                                for name, sample in current_app.samples.items() }
+                    try:
+                        result_cache.put(cache_key, results)
+                    except Exception as err:
+                        metrics.errorsTotal.inc(stage="cache_store")
+                        print(f"caching results failed, {err}")
                 with current_app.lock:
                     current_app.in_progress = False
+                    current_app.sampleUpdate.notify_all()
+                metrics.jobsInFlight.dec()
+                metrics.jobsTotal.inc(result=result)
+                metrics.observeProfiler(profiler)
+                if trace_path:
+                    try:
+                        profiler.export_chrome_trace(trace_path)
+                    except Exception as err:
+                        print(f"writing trace to {trace_path} failed, {err}")
                 
         # Start image generation thread:
         with current_app.lock:
-            if current_app.in_progress or current_app.thread and current_app.thread.is_alive():
-                abort(make_response({error: "Cannot start a new operation, an existing operation is still running"}, 409))
+            abortIfBusy()
             current_app.samples = {}
+            current_app.profiler = profiler
             current_app.in_progress = True
+            metrics.jobsInFlight.inc()
             current_app.thread = Thread(target = run_thread)
             current_app.thread.start()
 
         return jsonify(success=True)
 
+    # Longest time in seconds that a sample request may wait for new samples:
+    maxLongPollWait = 60
+
     # Request updated images:
     @app.route("/sample", methods=["GET"])
     @cross_origin()
@@ -140,18 +263,28 @@ def startServer(device, model_params, model, diffusion, ldm_model, bert_model, c
         json = request.get_json(force=True)
         # Parse (sampleName, timestamp) pairs from request.samples
         # Check (sampleName, timestamp) pairs from the most recent request. If any missing from the request or have a
-        # newer timestamp, set response.samples[sampleName] = { timestamp, base64Image }
+        # newer timestamp, set response.samples[sampleName] = { timestamp, base64Image, seed }
+        def updatedSampleNames():
+            return [key for key in current_app.samples
+                    if key not in json["samples"] or json["samples"][key] < current_app.samples[key]["timestamp"]]
+        # If request.wait is set, wait up to that many seconds for new samples or for the operation to finish before
+        # responding:
+        wait = min(float(json.get("wait", 0)), maxLongPollWait)
         response = { "samples": {} }
         with current_app.lock:
-            for key in current_app.samples:
-                if key not in json["samples"] or json["samples"][key] < current_app.samples[key]["timestamp"]:
-                    response["samples"][key] = current_app.samples[key]
+            if wait > 0:
+                current_app.sampleUpdate.wait_for(lambda: len(updatedSampleNames()) > 0 or not current_app.in_progress,
+                        timeout=wait)
+            for key in updatedSampleNames():
+                response["samples"][key] = current_app.samples[key]
             # If any errors were saved for the most recent request, use those to set response.errors
             if current_app.lastError != "":
                 response["error"] = current_app.lastError
 
             # Check if the most recent request is finished, use this to set response.in_progress.
             response["in_progress"] = current_app.in_progress
+            if current_app.profiler is not None:
+                response["timing"] = current_app.profiler.summary()
         return response
 
     return app
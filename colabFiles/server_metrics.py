@@ -0,0 +1,166 @@
+# Server metrics, reported in the Prometheus text exposition format
+import math
+import threading
+import torch
+
+# Default histogram buckets in seconds, covering everything from single model steps to long inpainting jobs:
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250)
+
+def _formatLabels(labelNames, labelValues, extra=None):
+    pairs = list(zip(labelNames, labelValues))
+    if extra is not None:
+        pairs.append(extra)
+    if len(pairs) == 0:
+        return ''
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in pairs) + '}'
+
+def _formatValue(value):
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+class _Metric:
+    """Base class for metrics that hold one value per unique set of label values."""
+    metricType = None
+
+    def __init__(self, name, description, labelNames=()):
+        self.name = name
+        self.description = description
+        self.labelNames = tuple(labelNames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        assert set(labels.keys()) == set(self.labelNames), f'{self.name} expects labels {self.labelNames}'
+        return tuple(str(labels[name]) for name in self.labelNames)
+
+    def _sampleLines(self):
+        with self._lock:
+            return [f'{self.name}{_formatLabels(self.labelNames, key)} {_formatValue(value)}'
+                    for key, value in self._values.items()]
+
+    def render(self):
+        """Returns this metric's HELP, TYPE and sample lines."""
+        return [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.metricType}'] \
+                + self._sampleLines()
+
+class Counter(_Metric):
+    """A value that only increases, e.g. the number of requests handled."""
+    metricType = 'counter'
+
+    def inc(self, amount=1, **labels):
+        assert amount >= 0
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    """A value that can go up or down, e.g. the number of running jobs."""
+    metricType = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram(_Metric):
+    """Counts observed values in cumulative buckets, e.g. request latencies."""
+    metricType = 'histogram'
+
+    def __init__(self, name, description, labelNames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, description, labelNames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = { "buckets": [0] * len(self.buckets), "count": 0, "sum": 0.0 }
+            data = self._values[key]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data["buckets"][i] += 1
+            data["count"] += 1
+            data["sum"] += value
+
+    def _sampleLines(self):
+        lines = []
+        with self._lock:
+            for key, data in self._values.items():
+                for bound, count in zip(self.buckets, data["buckets"]):
+                    labels = _formatLabels(self.labelNames, key, ('le', _formatValue(bound)))
+                    lines.append(f'{self.name}_bucket{labels} {count}')
+                labels = _formatLabels(self.labelNames, key, ('le', '+Inf'))
+                lines.append(f'{self.name}_bucket{labels} {data["count"]}')
+                lines.append(f'{self.name}_count{_formatLabels(self.labelNames, key)} {data["count"]}')
+                lines.append(f'{self.name}_sum{_formatLabels(self.labelNames, key)} {_formatValue(data["sum"])}')
+        return lines
+
+class ServerMetrics:
+    """
+    Tracks operational metrics for the inpainting server.
+
+    All metrics are thread-safe, and render() returns them in the Prometheus text format served by /metrics.
+    """
+
+    def __init__(self):
+        self.queueDepth = Gauge('intrapaint_queue_depth', 'Inpainting jobs waiting to start.')
+        self.jobsInFlight = Gauge('intrapaint_jobs_in_flight', 'Inpainting jobs currently running.')
+        self.jobsTotal = Counter('intrapaint_jobs_total', 'Inpainting jobs finished, by result.', ('result',))
+        self.stageSeconds = Histogram('intrapaint_stage_seconds',
+                'Duration of each timed processing stage, taken from request profiling spans.', ('stage',))
+        self.samplesTotal = Counter('intrapaint_samples_total', 'Final sample images generated.')
+        self.samplesPerSecond = Gauge('intrapaint_samples_per_second',
+                'Final sample images generated per second by the most recent job.')
+        self.cacheRequests = Counter('intrapaint_cache_requests_total', 'Result cache lookups, by result.',
+                ('result',))
+        self.errorsTotal = Counter('intrapaint_errors_total', 'Errors encountered, by processing stage.', ('stage',))
+        self.httpRequests = Counter('intrapaint_http_requests_total', 'HTTP requests handled.',
+                ('method', 'path', 'status'))
+        self.httpRequestSeconds = Histogram('intrapaint_http_request_seconds', 'Time spent handling HTTP requests.',
+                ('method', 'path'))
+        self.gpuMemoryAllocatedPeak = Gauge('intrapaint_gpu_memory_allocated_peak_bytes',
+                'Highest GPU memory allocated by tensors since the server started.', ('device',))
+        self.gpuMemoryReservedPeak = Gauge('intrapaint_gpu_memory_reserved_peak_bytes',
+                'Highest GPU memory reserved by the caching allocator since the server started.', ('device',))
+        self._metrics = [self.queueDepth, self.jobsInFlight, self.jobsTotal, self.stageSeconds, self.samplesTotal,
+                self.samplesPerSecond, self.cacheRequests, self.errorsTotal, self.httpRequests,
+                self.httpRequestSeconds, self.gpuMemoryAllocatedPeak, self.gpuMemoryReservedPeak]
+        self.queueDepth.set(0)
+        self.jobsInFlight.set(0)
+
+    def observeProfiler(self, profiler):
+        """
+        Adds all spans recorded by a request's Profiler to the per-stage latency histograms. HTTP request spans are
+        skipped, those are tracked separately by httpRequestSeconds.
+        """
+        for name, durations in profiler.durations().items():
+            if name.startswith('http '):
+                continue
+            for duration in durations:
+                self.stageSeconds.observe(duration / 1000.0, stage=name)
+
+    def _updateGpuMemory(self):
+        if not torch.cuda.is_available():
+            return
+        for i in range(torch.cuda.device_count()):
+            self.gpuMemoryAllocatedPeak.set(torch.cuda.max_memory_allocated(i), device=i)
+            self.gpuMemoryReservedPeak.set(torch.cuda.max_memory_reserved(i), device=i)
+
+    def render(self):
+        """Returns all metrics in the Prometheus text exposition format."""
+        self._updateGpuMemory()
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
@@ -35,7 +35,8 @@ class ImagePanel(QWidget):
             An initial pillow Image object to load.
         selectionSize : QSize, default QSize(256, 256)
             Size in pixels of selected image sections used for inpainting.
-            Dimensions should be positive multiples of 64, no greater than 256.
+            Dimensions should be positive multiples of 64. Sizes over 256 are inpainted as tiles unless scaling is
+            enabled.
         """
         super().__init__()
         assert pilImage is None or isinstance(pilImage, Image.Image)
@@ -223,9 +224,10 @@ class ImagePanel(QWidget):
                 spinBox.setMaximum(dim)
                 spinBox.setSingleStep(8)
             else:
+                # Without scaling, areas larger than 256x256 are inpainted at full resolution as overlapping tiles:
                 spinBox.setSingleStep(64)
-                if imageSize:
-                    spinBox.setMaximum(min(256, dim - (dim % 64)))
+                if dim >= 64:
+                    spinBox.setMaximum(dim - (dim % 64))
                 else:
                     spinBox.setMaximum(256)
                 if (spinBox.value() % 64) != 0:
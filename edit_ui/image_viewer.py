@@ -119,12 +119,18 @@ class ImageViewer(QtWidgets.QWidget):
             self.onSelection.emit(self._selected, self._selectionSize)
             self.update()
 
-    def insertIntoSelection(self, inserted_image):
-        """Pastes a pillow image object onto the image at the selected coordinates."""
+    def insertIntoSelection(self, inserted_image, pt=None):
+        """
+        Pastes a pillow image object onto the image at the selected coordinates, or at the coordinates given by the
+        optional QPoint pt.
+        """
         assert isinstance(inserted_image, Image.Image)
+        assert pt is None or isinstance(pt, QPoint)
         if hasattr(self, '_selected') and hasattr(self, '_qimage'):
+            if pt is None:
+                pt = self._selected
             pilImage = qImageToImage(self._qimage)
-            pilImage.paste(inserted_image, (self._selected.x(), self._selected.y()))
+            pilImage.paste(inserted_image, (pt.x(), pt.y()))
             self.setImage(pilImage)
 
     def getSelectedSection(self):
@@ -0,0 +1,139 @@
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+from PIL import Image
+
+class InpaintJobSignals(QObject):
+    """Signals used to report progress from an InpaintJob running within a QThreadPool."""
+    imageReady = pyqtSignal(int, Image.Image, int, int)
+    errorSignal = pyqtSignal(int, str)
+    finished = pyqtSignal(int)
+
+class InpaintJob(QRunnable):
+    """Runs a single inpainting request on one inpainting backend, reporting each sample through Qt signals."""
+
+    def __init__(self, jobId, selectionKey, inpaintArgs, compositor):
+        """
+        Parameters:
+        -----------
+        jobId : int
+            Unique ID used to identify this job's results.
+        selectionKey : tuple
+            Identifies the image region being inpainted. Jobs with the same key never run at the same time.
+        inpaintArgs : tuple
+            (image, mask, prompt, batchSize, batchCount, negative, guidanceScale, skipSteps) parameters passed to the
+            inpainting backend.
+        compositor : SampleCompositor
+            Combines each sample with the unedited image before it is sent to the UI.
+        """
+        super().__init__()
+        self.jobId = jobId
+        self.selectionKey = selectionKey
+        self.signals = InpaintJobSignals()
+        self.backend = None
+        self._inpaintArgs = inpaintArgs
+        self._compositor = compositor
+
+    def run(self):
+        image, mask, prompt, batchSize, batchCount, negative, guidanceScale, skipSteps = self._inpaintArgs
+        def sendImage(img, y, x):
+            self.signals.imageReady.emit(self.jobId, self._compositor.composite(img), y, x)
+        try:
+            self.backend(image, mask, prompt, batchSize, batchCount, sendImage, negative, guidanceScale, skipSteps)
+        except Exception as err:
+            print(f'Inpainting failure: {err}')
+            self.signals.errorSignal.emit(self.jobId, str(err))
+        self.signals.finished.emit(self.jobId)
+
+class InpaintJobQueue(QObject):
+    """
+    Queues inpainting jobs, running them concurrently across one or more inpainting backends.
+
+    Each backend handles a single job at a time, and jobs that target the same image region run in the order they
+    were added. Jobs for different regions may run at the same time whenever more than one backend is idle.
+    All signals are emitted on the thread that owns the queue.
+    ...
+    Attributes:
+    -----------
+    jobStarted : pyqtSignal(int)
+        Emitted with the job ID when a queued job is assigned to a backend.
+    imageReady : pyqtSignal(int, Image, int, int)
+        Emitted with (job ID, sample image, sample index, batch index) whenever a job loads a sample.
+    jobFailed : pyqtSignal(int, str)
+        Emitted with the job ID and an error message if a job fails.
+    jobFinished : pyqtSignal(int)
+        Emitted with the job ID when a job stops running, whether or not it succeeded.
+    """
+    jobStarted = pyqtSignal(int)
+    imageReady = pyqtSignal(int, Image.Image, int, int)
+    jobFailed = pyqtSignal(int, str)
+    jobFinished = pyqtSignal(int)
+
+    def __init__(self, backends, maxConcurrentJobs=None):
+        """
+        Parameters:
+        -----------
+        backends : list of function(Image selection, Image mask, string prompt, int batchSize, int batchCount,
+                function showSample, string negative, number guidanceScale, int skipSteps)
+            Inpainting functions, each of which may be running one job at any given time.
+        maxConcurrentJobs : int, optional
+            Maximum number of jobs that may run at once. By default, all backends may be used at once.
+        """
+        super().__init__()
+        assert len(backends) > 0
+        assert all(callable(backend) for backend in backends)
+        self._idleBackends = list(backends)
+        self._threadPool = QThreadPool(self)
+        self._threadPool.setMaxThreadCount(max(1, maxConcurrentJobs or len(backends)))
+        self._pendingJobs = []
+        self._activeJobs = {}
+        self._nextJobId = 0
+
+    def addJob(self, selectionKey, inpaintArgs, compositor):
+        """
+        Adds a new inpainting job to the queue, starting it immediately if possible.
+
+        See InpaintJob for parameter details. Returns the new job's ID.
+        """
+        job = InpaintJob(self._nextJobId, selectionKey, inpaintArgs, compositor)
+        self._nextJobId += 1
+        job.signals.imageReady.connect(self.imageReady)
+        job.signals.errorSignal.connect(self.jobFailed)
+        job.signals.finished.connect(self._onJobFinished)
+        self._pendingJobs.append(job)
+        self._startJobs()
+        return job.jobId
+
+    def pendingCount(self):
+        """Returns the number of jobs waiting for an idle backend."""
+        return len(self._pendingJobs)
+
+    def activeCount(self):
+        """Returns the number of jobs currently running."""
+        return len(self._activeJobs)
+
+    def isActive(self, jobId):
+        """Checks if a job is still queued or running."""
+        return jobId in self._activeJobs or any(job.jobId == jobId for job in self._pendingJobs)
+
+    def _startJobs(self):
+        activeSelections = set(job.selectionKey for job in self._activeJobs.values())
+        for job in list(self._pendingJobs):
+            if len(self._idleBackends) == 0 or len(self._activeJobs) >= self._threadPool.maxThreadCount():
+                return
+            if job.selectionKey in activeSelections:
+                continue
+            self._pendingJobs.remove(job)
+            job.backend = self._idleBackends.pop(0)
+            # The queue keeps its own reference to the job, so don't let the thread pool delete it:
+            job.setAutoDelete(False)
+            self._activeJobs[job.jobId] = job
+            activeSelections.add(job.selectionKey)
+            self.jobStarted.emit(job.jobId)
+            self._threadPool.start(job)
+
+    def _onJobFinished(self, jobId):
+        job = self._activeJobs.pop(jobId, None)
+        if job is None:
+            return
+        self._idleBackends.append(job.backend)
+        self.jobFinished.emit(jobId)
+        self._startJobs()
@@ -7,6 +7,7 @@ import io
 
 class InpaintingPanel(QWidget):
     enableScaleToggled = pyqtSignal(bool)
+    reviewSamplesRequested = pyqtSignal()
 
     def __init__(self, doInpaint, getImage, getSelection, getMask):
         super().__init__()
@@ -38,6 +39,12 @@ class InpaintingPanel(QWidget):
                     self.guidanceScaleBox.value(),
                     self.skipStepsBox.value()))
 
+        self.reviewButton = QPushButton();
+        self.reviewButton.setText("Review samples")
+        self.reviewButton.setToolTip("Show samples from inpainting operations that are still waiting for review.")
+        self.reviewButton.clicked.connect(lambda: self.reviewSamplesRequested.emit())
+        self.reviewButton.hide()
+
         self.moreOptionsBar = QHBoxLayout()
         self.guidanceScaleBox = QSpinBox(self)
         self.guidanceScaleBox.setValue(5)
@@ -50,7 +57,7 @@ class InpaintingPanel(QWidget):
 
         self.enableScaleCheckbox = QCheckBox(self)
         self.enableScaleCheckbox.setText("Scale edited areas")
-        self.enableScaleCheckbox.setToolTip("Enabling scaling allows for larger sample areas and better results at small scales, but increases the time required to generate images for small areas.")
+        self.enableScaleCheckbox.setToolTip("Enabling scaling allows for better results at small scales, but increases the time required to generate images for small areas. Large areas are downscaled, disable scaling to inpaint them at full resolution using overlapping tiles.")
         self.enableScaleCheckbox.setChecked(True)
         self.enableScaleCheckbox.stateChanged.connect(lambda isChecked: self.enableScaleToggled.emit(isChecked))
         
@@ -73,6 +80,7 @@ class InpaintingPanel(QWidget):
         self.layout.addWidget(QLabel(self, text="Batch count:"), 2, 3, 1, 1)
         self.layout.addWidget(self.batchCountBox, 2, 4, 1, 1)
         self.layout.addWidget(self.inpaintButton, 2, 5, 1, 1)
+        self.layout.addWidget(self.reviewButton, 1, 5, 1, 1)
         self.layout.setColumnStretch(2, 255) # Maximize prompt input
 
         self.layout.addLayout(self.moreOptionsBar, 3, 1, 1, 4)
@@ -80,3 +88,8 @@ class InpaintingPanel(QWidget):
 
     def scalingEnabled(self):
         return self.enableScaleCheckbox.isChecked()
+
+    def setReviewCount(self, count):
+        """Shows the number of inpainting operations with samples waiting for review, hiding the button if zero."""
+        self.reviewButton.setText(f"Review samples ({count})")
+        self.reviewButton.setVisible(count > 0)
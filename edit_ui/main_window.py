@@ -1,19 +1,21 @@
 from PyQt5.QtWidgets import *
 from PyQt5.QtGui import QPainter, QPen
-from PyQt5.QtCore import Qt, QObject, QThread, QRect, QPoint, QSize, pyqtSignal
+from PyQt5.QtCore import Qt, QRect, QPoint, QSize
 from edit_ui.mask_panel import MaskPanel
 from edit_ui.image_panel import ImagePanel
 from edit_ui.inpainting_panel import InpaintingPanel
 from edit_ui.sample_selector import SampleSelector
+from edit_ui.sample_compositor import SampleCompositor
+from edit_ui.inpaint_job_queue import InpaintJobQueue
 from edit_ui.ui_utils import showErrorDialog
 import PyQt5.QtGui as QtGui
-from PIL import Image, ImageFilter
+from PIL import Image
 import sys
 
 class MainWindow(QMainWindow):
     """Creates a user interface to simplify repeated inpainting operations on image sections."""
 
-    def __init__(self, width, height, im, doInpaint):
+    def __init__(self, width, height, im, doInpaint, maxConcurrentJobs=None):
         """
         Parameters:
         -----------
@@ -23,8 +25,11 @@ class MainWindow(QMainWindow):
             Initial window height in pixels
         im : Image (optional)
             Optional initial image to edit.
-        doInpaint : function(Image selection, Image mask, string prompt, int batchSize int, batchCount)
-            Function used to trigger inpainting on a selected area of the edited image.
+        doInpaint : function(Image selection, Image mask, string prompt, int batchSize int, batchCount), or list
+            Function used to trigger inpainting on a selected area of the edited image. If a list of functions is
+            provided, each one is treated as a separate backend, and inpainting jobs will run on them concurrently.
+        maxConcurrentJobs : int (optional)
+            Maximum number of inpainting jobs that may run at once, by default one job per backend.
         """
         super().__init__()
         self.imagePanel = ImagePanel(im)
@@ -32,17 +37,32 @@ class MainWindow(QMainWindow):
                 lambda: self.imagePanel.imageViewer.getSelectedSection(),
                 self.imagePanel.imageViewer.onSelection)
         self._draggingDivider = False
-        self.thread = None
+
+        # Inpainting jobs are queued, and may run while the user keeps editing. Each job gets its own sample
+        # selector, stored here in the order jobs were added until samples are selected or discarded:
+        self._jobQueue = InpaintJobQueue(doInpaint if isinstance(doInpaint, list) else [doInpaint], maxConcurrentJobs)
+        self._sampleSelectors = {}
+        def loadSamplePreview(jobId, img, y, x):
+            if jobId in self._sampleSelectors:
+                self._sampleSelectors[jobId].loadSampleImage(img, y, x)
+        self._jobQueue.imageReady.connect(loadSamplePreview)
+        def handleError(jobId, err):
+            self._closeSampleSelector(jobId)
+            showErrorDialog(self, "Inpainting failure", err)
+        self._jobQueue.jobFailed.connect(handleError)
+        def finishLoading(jobId):
+            if jobId in self._sampleSelectors:
+                self._sampleSelectors[jobId].setIsLoading(False)
+        self._jobQueue.jobFinished.connect(finishLoading)
 
         def inpaintAndShowSamples(selection, mask, prompt, batchSize, batchCount, negative, guidanceScale, skipSteps):
             if selection is None:
                 showErrorDialog(self, "Failed", "Load an image for editing before trying to start inpainting.")
                 return
-            if self.thread is not None:
-                showErrorDialog(self, "Failed", "Existing inpainting operation not yet finished, wait a little longer.")
-                return
-            self.thread = QThread()
 
+            # Samples are inserted where the selection was when the job started, even if it moves while loading:
+            selectionPos = QPoint(self.imagePanel.imageViewer.getSelection())
+            selectionKey = (selectionPos.x(), selectionPos.y(), selection.width, selection.height)
 
             # If sketch mode was used, write the sketch onto the image selection:
             inpaintImage = selection
@@ -72,89 +92,42 @@ class MainWindow(QMainWindow):
             elif inpaintMask.width != inpaintImage.width or inpaintMask.height != inpaintImage.height:
                 inpaintMask = mask.resize((inpaintImage.width, inpaintImage.height))
 
+            # Samples are scaled back to the selection size and combined with the unedited image on the worker thread,
+            # so the UI thread only needs to display them:
+            compositor = SampleCompositor(unscaledInpaintImage if keepSketch else selection, mask)
 
-
-            class InpaintThreadWorker(QObject):
-                finished = pyqtSignal()
-                imageReady = pyqtSignal(Image.Image, int, int)
-                errorSignal = pyqtSignal(str)
-                def run(self):
-                    def sendImage(img, y, x):
-                        if img.width != selection.width or img.height != selection.height:
-                            img = img.resize((selection.width, selection.height))
-                        self.imageReady.emit(img, y, x)
-                    try:
-                        doInpaint(inpaintImage,
-                                    inpaintMask,
-                                    prompt,
-                                    batchSize,
-                                    batchCount,
-                                    sendImage,
-                                    negative,
-                                    guidanceScale,
-                                    skipSteps)
-                    except Exception as err:
-                        print(f'Inpainting failure: {err}')
-                        self.errorSignal.emit(str(err))
-                    self.finished.emit()
-            self.worker = InpaintThreadWorker()
-            self.worker.moveToThread(self.thread)
-
-            def closeSampleSelector():
-                selector = self.centralWidget.currentWidget()
-                if selector is not self.mainWidget:
-                    self.centralWidget.setCurrentWidget(self.mainWidget)
-                    self.centralWidget.removeWidget(selector)
-                    self.update()
-
+            jobId = None
             def selectSample(pilImage):
-                self.imagePanel.imageViewer.insertIntoSelection(pilImage)
-                closeSampleSelector()
-
-            def loadSamplePreview(img, y, x):
-                # Inpainting can create subtle changes outside the mask area, which can gradually impact image quality
-                # and create annoying lines in larger images. To fix this, apply the mask to the resulting sample, and
-                # re-combine it with the original image. In addition, blur the mask slightly to improve image composite
-                # quality.
-                maskAlpha = mask.convert('L').point( lambda p: 255 if p < 1 else 0 ).filter(ImageFilter.GaussianBlur())
-                cleanImage = Image.composite(unscaledInpaintImage if keepSketch else selection,
-                        img,
-                        maskAlpha)
-                sampleSelector.loadSampleImage(cleanImage, y, x)
-                sampleSelector.repaint()
+                self.imagePanel.imageViewer.insertIntoSelection(pilImage, selectionPos)
+                self._closeSampleSelector(jobId)
 
             sampleSelector = SampleSelector(batchSize,
                     batchCount,
                     (unscaledInpaintImage if keepSketch else selection).convert('RGB'),
                     mask,
                     selectSample,
-                    closeSampleSelector)
-            self.centralWidget.addWidget(sampleSelector)
-            self.centralWidget.setCurrentWidget(sampleSelector)
+                    lambda: self._closeSampleSelector(jobId),
+                    self._showMainView)
             sampleSelector.setIsLoading(True)
+            jobId = self._jobQueue.addJob(selectionKey,
+                    (inpaintImage, inpaintMask, prompt, batchSize, batchCount, negative, guidanceScale, skipSteps),
+                    compositor)
+            # Only jump straight to the new samples if no earlier samples are waiting for review:
+            showImmediately = len(self._sampleSelectors) == 0
+            self._sampleSelectors[jobId] = sampleSelector
+            self.centralWidget.addWidget(sampleSelector)
+            if showImmediately:
+                self.centralWidget.setCurrentWidget(sampleSelector)
+            self.inpaintPanel.setReviewCount(len(self._sampleSelectors))
             self.update()
 
-            def handleError(err):
-                closeSampleSelector()
-                showErrorDialog(self, "Inpainting failure", err)
-            self.worker.errorSignal.connect(handleError)
-            self.worker.imageReady.connect(loadSamplePreview)
-            self.worker.finished.connect(lambda: sampleSelector.setIsLoading(False))
-            self.thread.started.connect(self.worker.run)
-            self.thread.finished.connect(self.thread.deleteLater)
-            def clearOldThread():
-                self.thread = None
-            self.thread.finished.connect(clearOldThread)
-            self.worker.finished.connect(self.thread.quit)
-            self.worker.finished.connect(self.worker.deleteLater)
-            self.thread.start()
-
         self.inpaintPanel = InpaintingPanel(
                 inpaintAndShowSamples,
                 lambda: self.imagePanel.imageViewer.getImage(),
                 lambda: self.imagePanel.imageViewer.getSelectedSection(),
                 lambda: self.maskPanel.getMask())
         self.inpaintPanel.enableScaleToggled.connect(lambda v: self.imagePanel.setScaleEnabled(v))
+        self.inpaintPanel.reviewSamplesRequested.connect(lambda: self._showNextSampleSelector())
 
         self.layout = QVBoxLayout()
 
@@ -188,6 +161,30 @@ class MainWindow(QMainWindow):
     def getMask(self):
         return self.maskPanel.getMask()
 
+    def _showMainView(self):
+        """Returns to the main editing view, leaving any unreviewed samples available through the review button."""
+        self.centralWidget.setCurrentWidget(self.mainWidget)
+        self.inpaintPanel.setReviewCount(len(self._sampleSelectors))
+        self.update()
+
+    def _showNextSampleSelector(self):
+        """Shows samples from the oldest inpainting job that hasn't been reviewed."""
+        if len(self._sampleSelectors) > 0:
+            self.centralWidget.setCurrentWidget(next(iter(self._sampleSelectors.values())))
+            self.update()
+
+    def _closeSampleSelector(self, jobId):
+        """Discards the sample selector for an inpainting job, returning to the main view if it was shown."""
+        selector = self._sampleSelectors.pop(jobId, None)
+        if selector is None:
+            return
+        if self.centralWidget.currentWidget() is selector:
+            self.centralWidget.setCurrentWidget(self.mainWidget)
+        self.centralWidget.removeWidget(selector)
+        selector.deleteLater()
+        self.inpaintPanel.setReviewCount(len(self._sampleSelectors))
+        self.update()
+
     def paintEvent(self, event):
         super().paintEvent(event)
         if self.centralWidget.currentWidget() is self.mainWidget:
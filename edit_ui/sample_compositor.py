@@ -0,0 +1,42 @@
+from PIL import Image, ImageFilter
+
+class SampleCompositor:
+    """
+    Combines inpainting samples with the unedited source image, restricting changes to the masked area.
+
+    Inpainting can create subtle changes outside the mask area, which can gradually impact image quality and create
+    annoying lines in larger images. To fix this, each sample is re-combined with the original image using a slightly
+    blurred copy of the mask. The blurred mask only depends on the mask itself, so it is created once per inpainting
+    operation instead of once per sample.
+    """
+
+    def __init__(self, sourceImage, maskImage, blurRadius=2):
+        """
+        Parameters:
+        -----------
+        sourceImage : Image
+            Unedited image section that samples will be combined with.
+        maskImage : Image
+            Mask marking the edited area. Pixels with a value of zero in 'L' mode are kept from the source image.
+        blurRadius : number, default 2
+            Gaussian blur radius applied to the mask edges, used to improve image composite quality.
+        """
+        assert isinstance(sourceImage, Image.Image)
+        assert isinstance(maskImage, Image.Image)
+        self._source = sourceImage.convert('RGB')
+        alpha = maskImage.convert('L')
+        if alpha.size != self._source.size:
+            alpha = alpha.resize(self._source.size)
+        self._alpha = alpha.point(lambda p: 255 if p < 1 else 0).filter(ImageFilter.GaussianBlur(blurRadius))
+
+    def size(self):
+        """Returns the (width, height) of composited images."""
+        return self._source.size
+
+    def composite(self, sample):
+        """Scales a sample to the source image size if necessary, and returns it combined with the source image."""
+        if sample.size != self._source.size:
+            sample = sample.resize(self._source.size)
+        if sample.mode != 'RGB':
+            sample = sample.convert('RGB')
+        return Image.composite(self._source, sample, self._alpha)
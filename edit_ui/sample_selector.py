@@ -2,15 +2,45 @@ from PyQt5.QtWidgets import *
 from PyQt5.QtCore import Qt, QMargins
 import PyQt5.QtGui as QtGui
 from PyQt5.QtGui import QPainter, QPen, QColor, QImage, QPixmap
-from PyQt5.QtCore import Qt, QPoint, QRect, QBuffer, QSize
+from PyQt5.QtCore import Qt, QPoint, QRect, QBuffer, QSize, QObject, QRunnable, QThreadPool, pyqtSignal
 from edit_ui.loading_widget import LoadingWidget
 from edit_ui.ui_utils import getScaledPlacement, QEqualMargins, imageToQImage
 from PIL import Image
 
+class ThumbnailSignals(QObject):
+    """Signals used to return thumbnails from a ThumbnailTask running within a QThreadPool."""
+    thumbnailReady = pyqtSignal(object, Image.Image)
+
+class ThumbnailTask(QRunnable):
+    """Scales a PIL image down to thumbnail size off of the UI thread."""
+
+    def __init__(self, key, image, size):
+        """
+        Parameters:
+        -----------
+        key : object
+            Identifies the thumbnail when it is returned through signals.thumbnailReady.
+        image : Image
+            Full-resolution image to scale.
+        size : QSize
+            Thumbnail width and height, in pixels.
+        """
+        super().__init__()
+        self.key = key
+        self.signals = ThumbnailSignals()
+        self._image = image
+        self._size = (size.width(), size.height())
+
+    def run(self):
+        thumbnail = self._image.resize(self._size, Image.LANCZOS)
+        if thumbnail.mode != 'RGB':
+            thumbnail = thumbnail.convert('RGB')
+        self.signals.thumbnailReady.emit(self.key, thumbnail)
+
 class SampleSelector(QWidget):
     """Shows all inpainting samples as they load, allows the user to select one or discard all of them."""
 
-    def __init__(self, batch_size, num_batches, sourceImage, maskImage, selectImage, closeSelector):
+    def __init__(self, batch_size, num_batches, sourceImage, maskImage, selectImage, closeSelector, hideSelector=None):
         """
         batch_size : int
             Number of image samples that will be generated per batch.
@@ -26,6 +56,9 @@ class SampleSelector(QWidget):
             Function that will apply a selected sample image to the edited image, then close the SampleSelector.
         closeSelector : function()
             Function that will close the SampleSelector without selecting an image.
+        hideSelector : function(), optional
+            Function that will return to the main editing view while samples continue loading. If provided, a
+            'keep editing' button is shown.
         """
         super().__init__()
         assert isinstance(batch_size, int) and batch_size > 0
@@ -34,11 +67,17 @@ class SampleSelector(QWidget):
         assert isinstance(maskImage, Image.Image)
         assert callable(selectImage)
         assert callable(closeSelector)
+        assert hideSelector is None or callable(hideSelector)
 
-        self._sourcePixmap = QPixmap.fromImage(imageToQImage(sourceImage))
-        self._maskPixmap = QPixmap.fromImage(imageToQImage(maskImage))
+        self._sourceImage = sourceImage
+        self._maskImage = maskImage
+        self._sourcePixmap = None
+        self._maskPixmap = None
         self._sourceImageBounds = QRect(0, 0, 0, 0)
         self._maskImageBounds = QRect(0, 0, 0, 0)
+        # Thumbnails are scaled on a thread pool, so full-resolution images are never converted on the UI thread:
+        self._thumbnailPool = QThreadPool(self)
+        self._pendingThumbnailSizes = {}
         
         self._selectImage = selectImage
         self._nRows = num_batches
@@ -48,7 +87,7 @@ class SampleSelector(QWidget):
         for row in range(self._nRows):
             columns = []
             for col in range(self._nColumns):
-                columns.append({"image": None, "pixmap": None, "bounds": None})
+                columns.append({"image": None, "thumbnail": None, "bounds": None})
             self._options.append(columns)
 
         self._instructions = QLabel(self, text="Click a sample to apply it to the source image, or click 'cancel' to discard all samples.")
@@ -57,6 +96,13 @@ class SampleSelector(QWidget):
         self._cancelButton.clicked.connect(closeSelector)
         self._instructions.show()
         self._cancelButton.show()
+        self._hideButton = None
+        if hideSelector is not None:
+            self._hideButton = QPushButton(self)
+            self._hideButton.setText("keep editing")
+            self._hideButton.setToolTip("Return to the image while samples load, then review them later.")
+            self._hideButton.clicked.connect(hideSelector)
+            self._hideButton.show()
 
         self._isLoading = False
         self._loadingWidget = LoadingWidget()
@@ -78,6 +124,9 @@ class SampleSelector(QWidget):
     def loadSampleImage(self, imageSample, idx, batch):
         """
         Loads an inpainting sample image into the appropriate SampleWidget.
+
+        The sample is scaled to its display bounds on a background thread, and only that thumbnail is converted for
+        drawing. The full-resolution image is kept as a PIL image until the sample is selected.
         Parameters:
         -----------
         imageSample : Image
@@ -87,11 +136,50 @@ class SampleSelector(QWidget):
         batch : int
             Batch index of the image sample.
         """
-        pixmap = QPixmap.fromImage(imageToQImage(imageSample))
-        assert pixmap is not None
-        self._options[batch][idx]["pixmap"] = pixmap
-        self._options[batch][idx]["image"] = imageSample
-        self.update()
+        option = self._options[batch][idx]
+        option["image"] = imageSample
+        self._requestThumbnail((batch, idx), imageSample, option["bounds"])
+
+    def _requestThumbnail(self, key, image, bounds):
+        """Starts scaling an image to the given bounds size, unless a matching thumbnail exists or is loading."""
+        if image is None or bounds is None or bounds.isEmpty():
+            return
+        thumbnail = self._getThumbnail(key)
+        if thumbnail is not None and thumbnail.size() == bounds.size():
+            # Any thumbnail still loading for an earlier size is no longer needed:
+            self._pendingThumbnailSizes.pop(key, None)
+            return
+        if self._pendingThumbnailSizes.get(key) == bounds.size():
+            return
+        self._pendingThumbnailSizes[key] = bounds.size()
+        task = ThumbnailTask(key, image, bounds.size())
+        task.signals.thumbnailReady.connect(self._thumbnailLoaded)
+        self._thumbnailPool.start(task)
+
+    def _thumbnailLoaded(self, key, thumbnail):
+        """Converts a scaled thumbnail for drawing, discarding it if the bounds changed while it was loading."""
+        size = QSize(thumbnail.width, thumbnail.height)
+        if self._pendingThumbnailSizes.get(key) != size:
+            return
+        del self._pendingThumbnailSizes[key]
+        pixmap = QPixmap.fromImage(imageToQImage(thumbnail))
+        if key == "source":
+            self._sourcePixmap = pixmap
+            self.update(self._sourceImageBounds)
+        elif key == "mask":
+            self._maskPixmap = pixmap
+            self.update(self._maskImageBounds)
+        else:
+            option = self._options[key[0]][key[1]]
+            option["thumbnail"] = pixmap
+            self.update(option["bounds"].marginsAdded(QEqualMargins(4)))
+
+    def _getThumbnail(self, key):
+        if key == "source":
+            return self._sourcePixmap
+        if key == "mask":
+            return self._maskPixmap
+        return self._options[key[0]][key[1]]["thumbnail"]
 
     def resizeEvent(self, event):
         statusArea = QRect(0, 0, self.width(), self.height() // 8)
@@ -115,6 +203,12 @@ class SampleSelector(QWidget):
         cancelArea = QRect(textArea.width(), statusArea.y(),
             statusArea.width() - textArea.width(),
             statusArea.height()).marginsRemoved(QEqualMargins(statusArea.height() // 3))
+        # Stack the cancel and "keep editing" buttons when both are shown:
+        if self._hideButton is not None:
+            buttonHeight = cancelArea.height()
+            cancelArea = QRect(cancelArea.x(), statusArea.y() + statusArea.height() // 2 - buttonHeight - 2,
+                    cancelArea.width(), buttonHeight)
+            self._hideButton.setGeometry(cancelArea.translated(0, buttonHeight + 4))
         self._cancelButton.setGeometry(cancelArea)
         
         optionArea = QRect(0, statusArea.height(), self.width(), self.height() - statusArea.height())
@@ -125,21 +219,30 @@ class SampleSelector(QWidget):
             for col in range(self._nColumns):
                 x = columnSize * col
                 containerRect = QRect(x, y, columnSize, rowSize)
-                self._options[row][col]["bounds"] = getScaledPlacement(containerRect,
-                    self._imageSize, 10)
+                option = self._options[row][col]
+                option["bounds"] = getScaledPlacement(containerRect, self._imageSize, 10)
+                self._requestThumbnail((row, col), option["image"], option["bounds"])
+        self._requestThumbnail("source", self._sourceImage, self._sourceImageBounds)
+        self._requestThumbnail("mask", self._maskImage, self._maskImageBounds)
 
     def paintEvent(self, event):
         super().paintEvent(event)
         painter = QPainter(self)
-        painter.drawPixmap(self._sourceImageBounds, self._sourcePixmap)
-        painter.drawPixmap(self._maskImageBounds, self._maskPixmap)
+        # Only redraw areas that changed, e.g. the bounds of a single newly loaded sample:
+        paintArea = event.rect()
+        for bounds, pixmap in [(self._sourceImageBounds, self._sourcePixmap), (self._maskImageBounds, self._maskPixmap)]:
+            if pixmap is not None and bounds.intersects(paintArea):
+                # Thumbnails from before a resize are stretched to fit until their replacements finish loading:
+                painter.drawPixmap(bounds, pixmap)
         painter.setPen(QPen(Qt.black, 2, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin))
         for row in self._options:
             for option in row:
+                if not option['bounds'].marginsAdded(QEqualMargins(4)).intersects(paintArea):
+                    continue
                 painter.setPen(QPen(Qt.black, 4, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin))
                 painter.drawRect(option['bounds'].marginsAdded(QEqualMargins(2)))
-                if ('pixmap' in option) and (option['pixmap'] is not None):
-                    painter.drawPixmap(option['bounds'], option['pixmap'])
+                if option['thumbnail'] is not None:
+                    painter.drawPixmap(option['bounds'], option['thumbnail'])
                 else:
                     painter.fillRect(option['bounds'], Qt.black)
                     painter.setPen(QPen(Qt.white, 4, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin))
@@ -1,6 +1,7 @@
 import torch
 import torch.nn as nn
 from torch.nn import functional as F
+from torchvision.ops import roi_align
 from functools import partial
 
 from encoders.x_transformer import Encoder, TransformerWrapper  # TODO: can we directly rely on lucidrains code and simply add this as a reuirement? --> test
@@ -133,6 +134,13 @@ class SpatialRescaler(nn.Module):
 
 
 class MakeCutouts(nn.Module):
+    """
+    Takes cutn random square cutouts of each input image, resized to cut_size x cut_size.
+
+    All cutouts are created together in a single roi_align call instead of one slice and pooling operation per cutout.
+    The output is ordered like torch.cat([cutout_0, cutout_1, ...]), where each cutout_i holds one cutout of every
+    image in the input batch.
+    """
     def __init__(self, cut_size, cutn, cut_pow=1.):
         super().__init__()
 
@@ -141,15 +149,19 @@ class MakeCutouts(nn.Module):
         self.cut_pow = cut_pow
 
     def forward(self, input):
+        batch_size = input.shape[0]
         sideY, sideX = input.shape[2:4]
         max_size = min(sideX, sideY)
         min_size = min(sideX, sideY, self.cut_size)
-        cutouts = []
-        for _ in range(self.cutn):
-            size = int(torch.rand([])**self.cut_pow * (max_size - min_size) + min_size)
-            offsetx = torch.randint(0, sideX - size + 1, ())
-            offsety = torch.randint(0, sideY - size + 1, ())
-            cutout = input[:, :, offsety:offsety + size, offsetx:offsetx + size]
-            cutouts.append(F.adaptive_avg_pool2d(cutout, self.cut_size))
-        return torch.cat(cutouts)
+        sizes = (torch.rand([self.cutn])**self.cut_pow * (max_size - min_size) + min_size).floor()
+        offsetx = (torch.rand([self.cutn]) * (sideX - sizes + 1)).floor()
+        offsety = (torch.rand([self.cutn]) * (sideY - sizes + 1)).floor()
+        # One (batch index, x1, y1, x2, y2) box for each image within each cutout:
+        boxes = torch.stack([offsetx, offsety, offsetx + sizes, offsety + sizes], dim=1)
+        boxes = boxes.repeat_interleave(batch_size, dim=0)
+        indices = torch.arange(batch_size, dtype=boxes.dtype).repeat(self.cutn).unsqueeze(1)
+        boxes = torch.cat([indices, boxes], dim=1).to(device=input.device, dtype=input.dtype)
+        # With aligned=True, a box from x1 to x2 covers exactly pixels x1 through x2 - 1. Adaptive sampling averages
+        # over all pixels within each output pixel, matching adaptive_avg_pool2d when downscaling.
+        return roi_align(input, boxes, self.cut_size, spatial_scale=1.0, sampling_ratio=-1, aligned=True)
 
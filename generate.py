@@ -62,6 +62,8 @@ sample_fn, clip_score_fn = createSampleFunction(
         cutn=args.cutn,
         clip_guidance=args.clip_guidance,
         clip_guidance_scale=args.clip_guidance_scale,
+        clip_guidance_interval=args.clip_guidance_interval,
+        fused_clip_guidance=args.fused_clip_guidance,
         skip_timesteps=args.skip_timesteps,
         ddpm=args.ddpm,
         ddim=args.ddim)
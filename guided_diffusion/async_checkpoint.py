@@ -0,0 +1,79 @@
+"""
+Save checkpoints in the background, so training doesn't wait for writes.
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import blobfile as bf
+import torch as th
+
+
+def snapshot_to_host(obj):
+    """
+    Copy every tensor within a (possibly nested) state dict to host memory.
+
+    On CUDA, copies are queued asynchronously into pinned memory, so the
+    returned tensors must not be read until the current stream reaches them;
+    see AsyncCheckpointWriter.
+    """
+    if isinstance(obj, th.Tensor):
+        if obj.device.type != "cuda":
+            return obj.detach().clone()
+        host = th.empty(obj.shape, dtype=obj.dtype, device="cpu", pin_memory=True)
+        return host.copy_(obj.detach(), non_blocking=True)
+    if isinstance(obj, dict):
+        return type(obj)((k, snapshot_to_host(v)) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot_to_host(v) for v in obj)
+    return obj
+
+
+class AsyncCheckpointWriter:
+    """
+    Writes groups of state dicts to blobfile paths on a background thread.
+
+    State is snapshotted to host memory when a save is submitted, so training
+    can keep updating parameters while the previous snapshot is written. At
+    most max_pending saves are in flight at once; submitting another one
+    waits for the oldest to finish, which bounds the host memory used by
+    snapshots.
+
+    :param max_pending: the maximum number of saves written concurrently.
+    """
+
+    def __init__(self, max_pending=1):
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint")
+        self._pending = deque()
+
+    def submit(self, files):
+        """
+        Start saving checkpoint files.
+
+        :param files: a dict mapping blobfile paths to the objects that will be
+                      saved to them with th.save.
+        """
+        while len(self._pending) >= self.max_pending:
+            self._pending.popleft().result()
+        snapshots = {path: snapshot_to_host(obj) for path, obj in files.items()}
+        copied = None
+        if th.cuda.is_available():
+            copied = th.cuda.Event()
+            copied.record()
+        self._pending.append(self._executor.submit(self._write, snapshots, copied))
+
+    def wait(self):
+        """
+        Wait for all submitted saves to finish, raising any error they hit.
+        """
+        while self._pending:
+            self._pending.popleft().result()
+
+    @staticmethod
+    def _write(snapshots, copied):
+        if copied is not None:
+            copied.synchronize()
+        for path, obj in snapshots.items():
+            with bf.BlobFile(path, "wb") as f:
+                th.save(obj, f)
@@ -0,0 +1,123 @@
+"""
+Prebuilt indexes of dataset files.
+
+Listing a large dataset directory with blobfile takes a long time, and every
+process used to repeat it at startup. A manifest stores the result of that
+listing in a single file, which loaders memory-map so that opening it takes
+constant time no matter how many files the dataset holds.
+
+Manifest file layout, with all integers little-endian uint64:
+
+    MAGIC
+    number of entries N
+    N + 1 byte offsets of each entry, relative to the start of the entry data
+    entry data: UTF-8 encoded entries, each holding one or more tab-separated
+                paths (an image path, followed by a caption path for
+                image/text datasets)
+
+Use scripts/build_manifest.py to create a manifest.
+"""
+
+import mmap
+import struct
+
+import blobfile as bf
+import numpy as np
+
+MAGIC = b"GDMANIF1"
+IMAGE_EXTENSIONS = ["jpg", "jpeg", "png", "gif", "webp"]
+
+_HEADER_SIZE = len(MAGIC) + 8
+
+
+def list_dataset_files(data_dir, with_text=True):
+    """
+    Recursively list the images in a directory, in the same order as the
+    dataset modules' _list_image_files_recursively.
+
+    Each directory is listed once, and caption files are matched against that
+    listing instead of being checked for individually.
+
+    :param with_text: if True, return (image path, caption path) pairs and
+                      skip images without a caption file.
+    """
+    results = []
+    entries = sorted(bf.listdir(data_dir))
+    entry_set = set(entries)
+    for entry in entries:
+        full_path = bf.join(data_dir, entry)
+        parts = entry.split(".")
+        ext = parts[-1].strip()
+        if ext and ext.lower() in IMAGE_EXTENSIONS:
+            if not with_text:
+                results.append(full_path)
+            elif parts[0] + ".txt" in entry_set:
+                results.append((full_path, bf.join(data_dir, parts[0] + ".txt")))
+        elif bf.isdir(full_path):
+            results.extend(list_dataset_files(full_path, with_text))
+    return results
+
+
+def write_manifest(path, files):
+    """
+    Write a manifest file.
+
+    :param path: the local path of the new manifest.
+    :param files: a sequence of paths, or of tuples of paths.
+    """
+    encoded = [
+        ("\t".join(entry) if isinstance(entry, tuple) else entry).encode("utf-8")
+        for entry in files
+    ]
+    offsets = np.zeros(len(encoded) + 1, dtype="<u8")
+    offsets[1:] = np.cumsum([len(entry) for entry in encoded])
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(encoded)))
+        f.write(offsets.tobytes())
+        for entry in encoded:
+            f.write(entry)
+
+
+class Manifest:
+    """
+    A read-only, memory-mapped sequence of the entries in a manifest file.
+
+    Entries are decoded when they are accessed. Slicing returns another
+    Manifest sharing the same mapping, so selecting a shard with
+    manifest[shard:][::num_shards] doesn't read the file.
+    """
+
+    def __init__(self, path, _mapping=None, _indices=None):
+        self.path = path
+        if _mapping is None:
+            with open(path, "rb") as f:
+                _mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if _mapping[: len(MAGIC)] != MAGIC:
+                raise ValueError(f"{path} is not a dataset manifest")
+        self._mapping = _mapping
+        (count,) = struct.unpack_from("<Q", _mapping, len(MAGIC))
+        self._offsets = np.frombuffer(_mapping, dtype="<u8", count=count + 1, offset=_HEADER_SIZE)
+        self._data_start = _HEADER_SIZE + self._offsets.nbytes
+        self._indices = range(count) if _indices is None else _indices
+
+    def __len__(self):
+        return len(self._indices)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return Manifest(self.path, self._mapping, self._indices[idx])
+        i = self._indices[idx]
+        start = self._data_start + int(self._offsets[i])
+        end = self._data_start + int(self._offsets[i + 1])
+        fields = self._mapping[start:end].decode("utf-8").split("\t")
+        return fields[0] if len(fields) == 1 else tuple(fields)
+
+    def __getstate__(self):
+        # Mappings can't be pickled, so DataLoader workers reopen the file:
+        return {"path": self.path, "indices": self._indices}
+
+    def __setstate__(self, state):
+        other = Manifest(state["path"])
+        self.__dict__.update(other.__dict__)
+        self._indices = state["indices"]
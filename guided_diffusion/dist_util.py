@@ -7,48 +7,91 @@ import os
 import socket
 
 import blobfile as bf
-from mpi4py import MPI
 import torch as th
 import torch.distributed as dist
 
-# Change this to reflect your cluster layout.
-# The GPU for a given rank is (rank % GPUS_PER_NODE).
-GPUS_PER_NODE = 8
-
 SETUP_RETRY_COUNT = 3
 
 
 def setup_dist():
     """
     Setup a distributed process group.
+
+    Processes started by torchrun (or anything else that sets RANK,
+    WORLD_SIZE, MASTER_ADDR and MASTER_PORT) are configured from those
+    environment variables, using LOCAL_RANK to pick each process's GPU.
+    Otherwise, processes started with mpiexec are configured through MPI if
+    mpi4py is installed, and a single process is set up if it isn't.
+
+    NCCL is used when CUDA is available, and gloo otherwise, so multi-process
+    runs can also be tested on CPU.
     """
     if dist.is_initialized():
         return
-    os.environ["CUDA_VISIBLE_DEVICES"] = f"{MPI.COMM_WORLD.Get_rank() % GPUS_PER_NODE}"
-#    th.cuda.set_device(MPI.COMM_WORLD.Get_rank())
-
-    comm = MPI.COMM_WORLD
     backend = "gloo" if not th.cuda.is_available() else "nccl"
 
-    if backend == "gloo":
-        hostname = "localhost"
+    if all(name in os.environ for name in ["RANK", "WORLD_SIZE", "MASTER_ADDR", "MASTER_PORT"]):
+        local_rank = int(os.environ.get("LOCAL_RANK", 0))
     else:
-        hostname = socket.gethostbyname(socket.getfqdn())
-    os.environ["MASTER_ADDR"] = comm.bcast(hostname, root=0)
-    os.environ["RANK"] = str(comm.rank)
-    os.environ["WORLD_SIZE"] = str(comm.size)
+        MPI = _import_mpi()
+        if MPI is not None:
+            comm = MPI.COMM_WORLD
+            # Ranks sharing a node are numbered separately, so nodes may have
+            # different numbers of GPUs:
+            local_rank = comm.Split_type(MPI.COMM_TYPE_SHARED).Get_rank()
+            if backend == "gloo":
+                hostname = "localhost"
+            else:
+                hostname = socket.gethostbyname(socket.getfqdn())
+            os.environ["MASTER_ADDR"] = comm.bcast(hostname, root=0)
+            os.environ["RANK"] = str(comm.rank)
+            os.environ["WORLD_SIZE"] = str(comm.size)
+            os.environ["MASTER_PORT"] = str(comm.bcast(_find_free_port(), root=0))
+        else:
+            local_rank = 0
+            os.environ["MASTER_ADDR"] = "localhost"
+            os.environ["RANK"] = "0"
+            os.environ["WORLD_SIZE"] = "1"
+            os.environ["MASTER_PORT"] = str(_find_free_port())
 
-    port = comm.bcast(_find_free_port(), root=0)
-    os.environ["MASTER_PORT"] = str(port)
+    if th.cuda.is_available():
+        th.cuda.set_device(local_rank % th.cuda.device_count())
     dist.init_process_group(backend=backend, init_method="env://")
 
 
+def _import_mpi():
+    # Importing mpi4py initializes MPI, so only do it when it's needed.
+    try:
+        from mpi4py import MPI
+    except ImportError:
+        return None
+    return MPI
+
+
+def get_rank():
+    """
+    Get the rank of this process, even before setup_dist() is called.
+    """
+    if dist.is_initialized():
+        return dist.get_rank()
+    return int(os.environ.get("RANK", 0))
+
+
+def get_world_size():
+    """
+    Get the number of processes, even before setup_dist() is called.
+    """
+    if dist.is_initialized():
+        return dist.get_world_size()
+    return int(os.environ.get("WORLD_SIZE", 1))
+
+
 def dev():
     """
     Get the device to use for torch.distributed.
     """
     if th.cuda.is_available():
-        return th.device(f"cuda")
+        return th.device("cuda", th.cuda.current_device())
     return th.device("cpu")
 
 
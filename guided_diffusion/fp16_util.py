@@ -2,6 +2,8 @@
 Helpers to train with 16-bit precision.
 """
 
+from contextlib import nullcontext
+
 import numpy as np
 import torch as th
 import torch.nn as nn
@@ -11,6 +13,8 @@ from . import logger
 
 INITIAL_LOG_LOSS_SCALE = 20.0
 
+AMP_DTYPES = {"fp16": th.float16, "bf16": th.bfloat16}
+
 
 def convert_module_to_f16(l):
     """
@@ -153,10 +157,29 @@ class MixedPrecisionTrainer:
         use_fp16=False,
         fp16_scale_growth=1e-3,
         initial_lg_loss_scale=INITIAL_LOG_LOSS_SCALE,
+        amp_dtype="",
     ):
+        """
+        :param use_fp16: if True, train a float16 copy of the model against
+                         flattened float32 master parameters, with a manually
+                         adjusted loss scale.
+        :param amp_dtype: if "fp16" or "bf16", keep the model in float32 and
+                          run forward passes under torch.autocast with that
+                          dtype instead. fp16 gradients are scaled with a
+                          GradScaler. Can't be combined with use_fp16.
+        """
+        if use_fp16 and amp_dtype:
+            raise ValueError("use_fp16 and amp_dtype can't be used together")
+        if amp_dtype and amp_dtype not in AMP_DTYPES:
+            raise ValueError(f"unknown amp_dtype {amp_dtype}, expected one of {', '.join(AMP_DTYPES)}")
         self.model = model
         self.use_fp16 = use_fp16
         self.fp16_scale_growth = fp16_scale_growth
+        self.amp_dtype = AMP_DTYPES[amp_dtype] if amp_dtype else None
+        # bf16 has the same range as float32, so its gradients don't need scaling:
+        self.grad_scaler = th.amp.GradScaler(
+            "cuda", enabled=self.amp_dtype == th.float16 and th.cuda.is_available()
+        )
 
         self.model_params = list(self.model.parameters())
         self.master_params = self.model_params
@@ -173,16 +196,30 @@ class MixedPrecisionTrainer:
     def zero_grad(self):
         zero_grad(self.model_params)
 
+    def autocast(self):
+        """
+        Get a context manager for forward passes, which enables autocast in
+        amp_dtype mode.
+        """
+        if self.amp_dtype is None:
+            return nullcontext()
+        device_type = self.model_params[0].device.type
+        return th.autocast(device_type=device_type, dtype=self.amp_dtype)
+
     def backward(self, loss: th.Tensor):
         if self.use_fp16:
             loss_scale = 2 ** self.lg_loss_scale
             (loss * loss_scale).backward()
+        elif self.amp_dtype is not None:
+            self.grad_scaler.scale(loss).backward()
         else:
             loss.backward()
 
     def optimize(self, opt: th.optim.Optimizer):
         if self.use_fp16:
             return self._optimize_fp16(opt)
+        elif self.amp_dtype is not None:
+            return self._optimize_amp(opt)
         else:
             return self._optimize_normal(opt)
 
@@ -206,6 +243,28 @@ class MixedPrecisionTrainer:
         self.lg_loss_scale += self.fp16_scale_growth
         return True
 
+    def _optimize_amp(self, opt: th.optim.Optimizer):
+        if self.grad_scaler.is_enabled():
+            logger.logkv_mean("grad_scale", self.grad_scaler.get_scale())
+        self.grad_scaler.unscale_(opt)
+        grad_norm, param_norm = self._compute_norms()
+        overflow = check_overflow(grad_norm)
+        if self.grad_scaler.is_enabled():
+            # GradScaler skips the step itself when gradients overflowed, and
+            # lowers its scale:
+            self.grad_scaler.step(opt)
+            self.grad_scaler.update()
+        elif not overflow:
+            # A disabled GradScaler (bf16, or no CUDA) would always step.
+            opt.step()
+        if overflow:
+            logger.log("Found NaN, skipped step")
+            return False
+
+        logger.logkv_mean("grad_norm", grad_norm)
+        logger.logkv_mean("param_norm", param_norm)
+        return True
+
     def _optimize_normal(self, opt: th.optim.Optimizer):
         grad_norm, param_norm = self._compute_norms()
         logger.logkv_mean("grad_norm", grad_norm)
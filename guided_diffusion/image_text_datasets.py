@@ -3,10 +3,13 @@ import random
 
 from PIL import Image
 import blobfile as bf
-from mpi4py import MPI
 import numpy as np
 from torch.utils.data import DataLoader, Dataset
 
+from . import dist_util
+from .dataset_manifest import Manifest
+from .prefetch import prefetch_to_device
+
 def load_data(
     *,
     data_dir,
@@ -16,6 +19,12 @@ def load_data(
     deterministic=False,
     random_crop=False,
     random_flip=True,
+    num_workers=1,
+    pin_memory=False,
+    persistent_workers=False,
+    device_prefetch=False,
+    fast_decode=False,
+    manifest_path="",
 ):
     """
     For a dataset, create a generator over (images, kwargs) pairs.
@@ -34,10 +43,26 @@ def load_data(
     :param deterministic: if True, yield results in a deterministic order.
     :param random_crop: if True, randomly crop the images for augmentation.
     :param random_flip: if True, randomly flip the images for augmentation.
+    :param num_workers: the number of data loading worker processes.
+    :param pin_memory: if True, collate batches into pinned host memory, which
+                       speeds up copies to the GPU.
+    :param persistent_workers: if True, keep worker processes alive between
+                               passes over the dataset instead of restarting
+                               them every epoch.
+    :param device_prefetch: if True, copy each batch to the training device
+                            while the previous batch is in use.
+    :param fast_decode: if True, decode JPEGs at a reduced scale close to the
+                        target size and resize them in a single step.
+    :param manifest_path: if set, read the dataset's files from a manifest
+                          written by scripts/build_manifest.py (with
+                          --with_text True) instead of listing data_dir.
     """
-    if not data_dir:
+    if manifest_path:
+        all_files = Manifest(manifest_path)
+    elif not data_dir:
         raise ValueError("unspecified data directory")
-    all_files = _list_image_files_recursively(data_dir)
+    else:
+        all_files = _list_image_files_recursively(data_dir)
     classes = None
     #if class_cond:
         # Assume classes are the first part of the filename,
@@ -49,19 +74,28 @@ def load_data(
         image_size,
         all_files,
         classes=classes,
-        shard=MPI.COMM_WORLD.Get_rank(),
-        num_shards=MPI.COMM_WORLD.Get_size(),
+        shard=dist_util.get_rank(),
+        num_shards=dist_util.get_world_size(),
         random_crop=random_crop,
         random_flip=random_flip,
+        fast_decode=fast_decode,
     )
-    if deterministic:
-        loader = DataLoader(
-            dataset, batch_size=batch_size, shuffle=False, num_workers=1, drop_last=True
-        )
-    else:
-        loader = DataLoader(
-            dataset, batch_size=batch_size, shuffle=True, num_workers=1, drop_last=True
-        )
+    loader = DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=not deterministic,
+        num_workers=num_workers,
+        drop_last=True,
+        pin_memory=pin_memory,
+        persistent_workers=persistent_workers and num_workers > 0,
+    )
+    data = _loop(loader)
+    if device_prefetch:
+        data = prefetch_to_device(data, dist_util.dev())
+    return data
+
+
+def _loop(loader):
     while True:
         yield from loader
 
@@ -92,6 +126,7 @@ class ImageDataset(Dataset):
         num_shards=1,
         random_crop=False,
         random_flip=True,
+        fast_decode=False,
     ):
         super().__init__()
         self.resolution = resolution
@@ -99,21 +134,25 @@ class ImageDataset(Dataset):
         self.local_classes = None if classes is None else classes[shard:][::num_shards]
         self.random_crop = random_crop
         self.random_flip = random_flip
+        self.fast_decode = fast_decode
 
     def __len__(self):
         return len(self.local_files)
 
     def __getitem__(self, idx):
         path = self.local_files[idx]
+        if self.fast_decode:
+            # Random crops may upscale the smaller side by up to 1 / min_crop_frac:
+            min_size = math.ceil(self.resolution / 0.8) if self.random_crop else self.resolution
+        else:
+            min_size = None
         with bf.BlobFile(path[0], "rb") as f:
-            pil_image = Image.open(f)
-            pil_image.load()
-        pil_image = pil_image.convert("RGB")
+            pil_image = load_image(f, min_size)
 
         if self.random_crop:
-            arr = random_crop_arr(pil_image, self.resolution)
+            arr = random_crop_arr(pil_image, self.resolution, single_resample=self.fast_decode)
         else:
-            arr = center_crop_arr(pil_image, self.resolution)
+            arr = center_crop_arr(pil_image, self.resolution, single_resample=self.fast_decode)
 
         if self.random_flip and random.random() < 0.5:
             arr = arr[:, ::-1]
@@ -130,11 +169,29 @@ class ImageDataset(Dataset):
         return np.transpose(arr, [2, 0, 1]), out_dict, text
 
 
-def center_crop_arr(pil_image, image_size):
+def load_image(file, min_size=None):
+    """
+    Load an RGB image from an open file.
+
+    :param min_size: if not None, JPEGs are decoded at the smallest reduced
+                     scale (1/2, 1/4 or 1/8) that keeps their smaller side at
+                     least this large, which is much faster than a full
+                     decode. Other formats are always decoded in full.
+    """
+    pil_image = Image.open(file)
+    if min_size is not None and min(*pil_image.size) > min_size:
+        scale = min_size / min(*pil_image.size)
+        pil_image.draft("RGB", tuple(math.ceil(x * scale) for x in pil_image.size))
+    pil_image.load()
+    return pil_image.convert("RGB")
+
+
+def center_crop_arr(pil_image, image_size, single_resample=False):
     # We are not on a new enough PIL to support the `reducing_gap`
     # argument, which uses BOX downsampling at powers of two first.
-    # Thus, we do it by hand to improve downsample quality.
-    while min(*pil_image.size) >= 2 * image_size:
+    # Thus, we do it by hand to improve downsample quality, unless a single
+    # resample was requested.
+    while not single_resample and min(*pil_image.size) >= 2 * image_size:
         pil_image = pil_image.resize(
             tuple(x // 2 for x in pil_image.size), resample=Image.BOX
         )
@@ -150,15 +207,16 @@ def center_crop_arr(pil_image, image_size):
     return arr[crop_y : crop_y + image_size, crop_x : crop_x + image_size]
 
 
-def random_crop_arr(pil_image, image_size, min_crop_frac=0.8, max_crop_frac=1.0):
+def random_crop_arr(pil_image, image_size, min_crop_frac=0.8, max_crop_frac=1.0, single_resample=False):
     min_smaller_dim_size = math.ceil(image_size / max_crop_frac)
     max_smaller_dim_size = math.ceil(image_size / min_crop_frac)
     smaller_dim_size = random.randrange(min_smaller_dim_size, max_smaller_dim_size + 1)
 
     # We are not on a new enough PIL to support the `reducing_gap`
     # argument, which uses BOX downsampling at powers of two first.
-    # Thus, we do it by hand to improve downsample quality.
-    while min(*pil_image.size) >= 2 * smaller_dim_size:
+    # Thus, we do it by hand to improve downsample quality, unless a single
+    # resample was requested.
+    while not single_resample and min(*pil_image.size) >= 2 * smaller_dim_size:
         pil_image = pil_image.resize(
             tuple(x // 2 for x in pil_image.size), resample=Image.BOX
         )
@@ -0,0 +1,108 @@
+"""
+Random inpainting masks for training, generated for a whole batch at once.
+
+Each sample is independently either:
+
+- unconditional (20/101 of samples): the whole image condition is masked out.
+- a blob mask (50/101 of the rest): Gaussian noise is blurred with a 15x15
+  kernel and a random sigma in [0.1, 5), and only positive values are kept.
+- a rectangle mask (the remainder): 1 to 4 random rectangles, each covering
+  at most half of the image, are masked out.
+"""
+
+import torch as th
+import torch.nn.functional as F
+
+BLUR_KERNEL_SIZE = 15
+BLUR_SIGMA_RANGE = (0.1, 5.0)
+MAX_RECTANGLES = 4
+
+
+class InpaintMaskGenerator:
+    """
+    Generates batches of random inpainting masks on a single device.
+
+    :param device: the device masks are created on.
+    :param seed: if not None, the seed used for all random values, so that the
+                 sequence of generated masks is reproducible.
+    """
+
+    def __init__(self, device, seed=None):
+        self.device = th.device(device)
+        self.generator = th.Generator(device=self.device)
+        if seed is None:
+            self.generator.seed()
+        else:
+            self.generator.manual_seed(seed)
+
+    def _rand(self, *shape):
+        return th.rand(*shape, generator=self.generator, device=self.device)
+
+    def _randint(self, low, high, shape):
+        """Random integers in [low, high], where high may be a tensor."""
+        return (low + self._rand(*shape) * (high - low + 1)).long()
+
+    def __call__(self, batch_size, height, width):
+        """
+        Create a batch of masks.
+
+        :return: an [N x 1 x H x W] float tensor, 1 where the image condition
+                 is kept and 0 where it is masked out.
+        """
+        choice = self._randint(0, 100, (batch_size,))
+        unconditional = choice < 20
+        blob = (~unconditional) & (self._randint(0, 100, (batch_size,)) < 50)
+        keep = th.where(
+            blob.view(-1, 1, 1, 1),
+            self._blob_masks(batch_size, height, width),
+            self._rectangle_masks(batch_size, height, width),
+        )
+        keep = keep & ~unconditional.view(-1, 1, 1, 1)
+        return keep.float()
+
+    def mask_latents(self, emb):
+        """
+        Randomly mask out parts of a batch of NCHW latents, to use as
+        inpainting conditions.
+        """
+        keep = self(emb.shape[0], emb.shape[-2], emb.shape[-1])
+        return emb.detach() * keep.to(emb.dtype)
+
+    def _blob_masks(self, batch_size, height, width):
+        noise = th.randn(
+            1, batch_size, height, width, generator=self.generator, device=self.device
+        )
+        low, high = BLUR_SIGMA_RANGE
+        sigma = low + self._rand(batch_size, 1) * (high - low)
+        radius = BLUR_KERNEL_SIZE // 2
+        x = th.arange(-radius, radius + 1, device=self.device, dtype=th.float32)
+        kernel = th.exp(-(x ** 2) / (2 * sigma ** 2))
+        kernel = kernel / kernel.sum(dim=1, keepdim=True)
+        # Separable blur, with one kernel per sample applied as a grouped convolution:
+        blurred = F.pad(noise, (radius, radius, radius, radius), mode="reflect")
+        blurred = F.conv2d(blurred, kernel.view(batch_size, 1, 1, -1), groups=batch_size)
+        blurred = F.conv2d(blurred, kernel.view(batch_size, 1, -1, 1), groups=batch_size)
+        return (blurred > 0).view(batch_size, 1, height, width)
+
+    def _rectangle_masks(self, batch_size, height, width):
+        shape = (batch_size, MAX_RECTANGLES)
+        count = self._randint(1, MAX_RECTANGLES, (batch_size, 1))
+        active = th.arange(MAX_RECTANGLES, device=self.device) < count
+        max_area = (height * width) // 2
+        w = self._randint(1, width, shape)
+        h = self._randint(1, height, shape)
+        too_large = w * h > max_area
+        shrink_width = self._rand(*shape) < 0.5
+        w, h = (
+            th.where(too_large & shrink_width, max_area // h, w),
+            th.where(too_large & ~shrink_width, max_area // w, h),
+        )
+        x0 = self._randint(0, width - w, shape)
+        y0 = self._randint(0, height - h, shape)
+
+        ys = th.arange(height, device=self.device).view(1, 1, -1, 1)
+        xs = th.arange(width, device=self.device).view(1, 1, 1, -1)
+        y0, x0, h, w = (v.view(batch_size, MAX_RECTANGLES, 1, 1) for v in (y0, x0, h, w))
+        inside = (ys >= y0) & (ys < y0 + h) & (xs >= x0) & (xs < x0 + w)
+        inside = inside & active.view(batch_size, MAX_RECTANGLES, 1, 1)
+        return ~inside.any(dim=1, keepdim=True)
@@ -0,0 +1,151 @@
+"""
+Datasets of precomputed VAE latents and text embeddings.
+
+Shards are written by scripts/preprocess_latents.py. Each shard is a set of
+.npy files sharing a common prefix:
+
+    <prefix>.latents.npy: [N x 4 x H x W] VAE latents, already scaled by 0.18215.
+    <prefix>.context.npy: [N x 77 x D] BERT text embeddings.
+    <prefix>.clip.npy:    [N x E] CLIP text embeddings.
+
+The data directory also holds blank.context.npy and blank.clip.npy, the
+embeddings of an empty caption, which replace captions that are dropped for
+classifier-free guidance training. All arrays are memory-mapped, so loading
+them costs almost nothing until rows are read.
+"""
+
+import random
+
+import blobfile as bf
+import numpy as np
+from torch.utils.data import DataLoader, Dataset
+
+from . import dist_util
+from .prefetch import prefetch_to_device
+
+LATENT_SCALE = 0.18215
+ARRAY_NAMES = ("latents", "context", "clip")
+
+
+def load_latent_data(
+    *,
+    data_dir,
+    batch_size,
+    deterministic=False,
+    text_drop_prob=0.0,
+    num_workers=1,
+    pin_memory=False,
+    persistent_workers=False,
+    device_prefetch=False,
+):
+    """
+    For a directory of latent shards, create a generator over (latents, kwargs)
+    pairs.
+
+    Each latents value is an NCHW float16 tensor of scaled VAE latents, and the
+    kwargs dict contains "context" and "clip_embed" float16 tensors holding the
+    BERT and CLIP text embeddings.
+
+    :param data_dir: a directory written by scripts/preprocess_latents.py.
+    :param batch_size: the batch size of each returned pair.
+    :param deterministic: if True, yield results in a deterministic order.
+    :param text_drop_prob: the probability of replacing each caption's
+                           embeddings with those of an empty caption.
+    :param num_workers: the number of data loading worker processes.
+    :param pin_memory: if True, collate batches into pinned host memory.
+    :param persistent_workers: if True, keep worker processes alive between
+                               passes over the dataset.
+    :param device_prefetch: if True, copy each batch to the training device
+                            while the previous batch is in use.
+    """
+    if not data_dir:
+        raise ValueError("unspecified data directory")
+    dataset = LatentShardDataset(
+        list_latent_shards(data_dir),
+        blank_context=np.load(bf.join(data_dir, "blank.context.npy")),
+        blank_clip=np.load(bf.join(data_dir, "blank.clip.npy")),
+        shard=dist_util.get_rank(),
+        num_shards=dist_util.get_world_size(),
+        text_drop_prob=text_drop_prob,
+    )
+    loader = DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=not deterministic,
+        num_workers=num_workers,
+        drop_last=True,
+        pin_memory=pin_memory,
+        persistent_workers=persistent_workers and num_workers > 0,
+    )
+    data = _loop(loader)
+    if device_prefetch:
+        data = prefetch_to_device(data, dist_util.dev())
+    return data
+
+
+def _loop(loader):
+    while True:
+        yield from loader
+
+
+def list_latent_shards(data_dir):
+    """
+    Get the sorted prefixes of all latent shards within a directory.
+    """
+    suffix = ".latents.npy"
+    prefixes = [
+        bf.join(data_dir, entry[: -len(suffix)])
+        for entry in sorted(bf.listdir(data_dir))
+        if entry.endswith(suffix)
+    ]
+    if len(prefixes) == 0:
+        raise ValueError(f"no latent shards found in {data_dir}")
+    return prefixes
+
+
+class LatentShardDataset(Dataset):
+    def __init__(
+        self,
+        shard_prefixes,
+        blank_context,
+        blank_clip,
+        shard=0,
+        num_shards=1,
+        text_drop_prob=0.0,
+    ):
+        super().__init__()
+        self.shard_prefixes = shard_prefixes
+        self.blank_context = blank_context
+        self.blank_clip = blank_clip
+        self.text_drop_prob = text_drop_prob
+        rows = []
+        for i, prefix in enumerate(shard_prefixes):
+            count = np.load(f"{prefix}.latents.npy", mmap_mode="r").shape[0]
+            rows.extend((i, row) for row in range(count))
+        self.local_rows = rows[shard:][::num_shards]
+        # Opened lazily, so that each DataLoader worker maps its own copy:
+        self._arrays = {}
+
+    def __len__(self):
+        return len(self.local_rows)
+
+    def _shard_arrays(self, shard_idx):
+        if shard_idx not in self._arrays:
+            prefix = self.shard_prefixes[shard_idx]
+            self._arrays[shard_idx] = {
+                name: np.load(f"{prefix}.{name}.npy", mmap_mode="r")
+                for name in ARRAY_NAMES
+            }
+        return self._arrays[shard_idx]
+
+    def __getitem__(self, idx):
+        shard_idx, row = self.local_rows[idx]
+        arrays = self._shard_arrays(shard_idx)
+        latents = np.array(arrays["latents"][row])
+        if random.random() < self.text_drop_prob:
+            context = self.blank_context
+            clip_embed = self.blank_clip
+        else:
+            context = np.array(arrays["context"][row])
+            clip_embed = np.array(arrays["clip"][row])
+        return latents, {"context": context, "clip_embed": clip_embed}
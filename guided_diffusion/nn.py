@@ -54,7 +54,7 @@ def avg_pool_nd(dims, *args, **kwargs):
     raise ValueError(f"unsupported dimensions: {dims}")
 
 
-def update_ema(target_params, source_params, rate=0.99):
+def update_ema(target_params, source_params, rate=0.99, fused=False):
     """
     Update target parameters to be closer to those of source parameters using
     an exponential moving average.
@@ -62,7 +62,15 @@ def update_ema(target_params, source_params, rate=0.99):
     :param target_params: the target parameter sequence.
     :param source_params: the source parameter sequence.
     :param rate: the EMA rate (closer to 1 means slower).
-    """
+    :param fused: if True, update all parameters with a few multi-tensor
+                  kernels instead of two kernels per parameter.
+    """
+    if fused and hasattr(th, "_foreach_mul_"):
+        targets = [targ.detach() for targ in target_params]
+        sources = [src.detach() for src in source_params]
+        th._foreach_mul_(targets, rate)
+        th._foreach_add_(targets, sources, alpha=1 - rate)
+        return
     for targ, src in zip(target_params, source_params):
         targ.detach().mul_(rate).add_(src, alpha=1 - rate)
 
@@ -0,0 +1,71 @@
+"""
+Overlap host-to-device copies of training batches with compute.
+"""
+
+import torch as th
+
+
+def prefetch_to_device(data, device):
+    """
+    Wrap a batch generator so that batches are moved to a device one step
+    ahead of when they're needed.
+
+    On CUDA devices, each batch is copied on a separate stream while the
+    previous batch is in use, so pinned host memory transfers overlap with
+    compute. Tensors may be nested within tuples, lists and dicts; all other
+    values are passed through unchanged.
+
+    :param data: an iterator over batches.
+    :param device: the device to move batches to.
+    """
+    device = th.device(device)
+    if device.type != "cuda":
+        for batch in data:
+            yield _to_device(batch, device)
+        return
+
+    stream = th.cuda.Stream(device)
+
+    def load(batch):
+        with th.cuda.stream(stream):
+            return _to_device(batch, device, non_blocking=True)
+
+    data = iter(data)
+    try:
+        next_batch = load(next(data))
+    except StopIteration:
+        return
+    while True:
+        current_stream = th.cuda.current_stream(device)
+        current_stream.wait_stream(stream)
+        batch = next_batch
+        # The batch was allocated on the copy stream, so make sure its memory
+        # isn't reused until the compute stream is done with it:
+        _record_stream(batch, current_stream)
+        try:
+            next_batch = load(next(data))
+        except StopIteration:
+            yield batch
+            return
+        yield batch
+
+
+def _to_device(value, device, non_blocking=False):
+    if isinstance(value, th.Tensor):
+        return value.to(device, non_blocking=non_blocking)
+    if isinstance(value, dict):
+        return {k: _to_device(v, device, non_blocking) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(_to_device(v, device, non_blocking) for v in value)
+    return value
+
+
+def _record_stream(value, stream):
+    if isinstance(value, th.Tensor):
+        value.record_stream(stream)
+    elif isinstance(value, dict):
+        for v in value.values():
+            _record_stream(v, stream)
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            _record_stream(v, stream)
@@ -0,0 +1,177 @@
+"""
+Lightweight timing instrumentation using named spans.
+
+Code that may be worth timing wraps itself in span(name). Spans do nothing
+unless a Profiler has been activated on the current thread with
+use_profiler(), so instrumented code costs almost nothing when nobody is
+measuring it. Recorded spans can be summarized per name, or exported in the
+Chrome trace event format for viewing in chrome://tracing or Perfetto.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+try:
+    import torch as th
+except ImportError:
+    # Allow span() in code shared with clients that don't install torch.
+    th = None
+
+_current = threading.local()
+
+
+class Profiler:
+    """
+    Records named timing spans from any number of threads.
+
+    :param sync_cuda: if True, spans created with sync=True call
+                      torch.cuda.synchronize() at their start and end, so
+                      that they measure GPU work instead of kernel launches.
+    """
+
+    def __init__(self, sync_cuda=True):
+        self.sync_cuda = sync_cuda
+        self._lock = threading.Lock()
+        self._events = []
+        self._origin = time.perf_counter()
+
+    def _synchronize(self):
+        if self.sync_cuda and th is not None and th.cuda.is_available():
+            th.cuda.synchronize()
+
+    @contextmanager
+    def span(self, name, sync=False, **args):
+        """
+        Time the enclosed block as a span with the given name.
+
+        :param name: the span name, used to group timings in summaries.
+        :param sync: if True, synchronize CUDA before and after the block.
+        :param args: extra values attached to the span in trace exports.
+        """
+        if sync:
+            self._synchronize()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if sync:
+                self._synchronize()
+            self.record(name, start, time.perf_counter(), **args)
+
+    def record(self, name, start, end, **args):
+        """
+        Record a span that was timed elsewhere.
+
+        :param start: the span's start time, from time.perf_counter().
+        :param end: the span's end time, from time.perf_counter().
+        """
+        with self._lock:
+            self._events.append((name, start, end, threading.get_ident(), args))
+
+    def reset(self):
+        """Discard all recorded spans."""
+        with self._lock:
+            self._events = []
+            self._origin = time.perf_counter()
+
+    def durations(self):
+        """
+        Get the duration of every recorded span, grouped by name.
+
+        :return: a dict mapping each span name to a list of durations in ms.
+        """
+        durations = defaultdict(list)
+        with self._lock:
+            for name, start, end, _, _ in self._events:
+                durations[name].append((end - start) * 1000.0)
+        return dict(durations)
+
+    def summary(self):
+        """
+        Summarize recorded spans by name.
+
+        :return: a dict mapping each span name to a dict with 'count', and
+                 'total_ms', 'mean_ms' and 'max_ms' durations.
+        """
+        return {
+            name: {
+                "count": len(values),
+                "total_ms": sum(values),
+                "mean_ms": sum(values) / len(values),
+                "max_ms": max(values),
+            }
+            for name, values in self.durations().items()
+        }
+
+    def chrome_trace(self):
+        """
+        Get all recorded spans as a Chrome trace event dict.
+        """
+        pid = os.getpid()
+        with self._lock:
+            events = [
+                {
+                    "name": name,
+                    "ph": "X",
+                    "ts": (start - self._origin) * 1e6,
+                    "dur": (end - start) * 1e6,
+                    "pid": pid,
+                    "tid": tid,
+                    "args": {key: _json_safe(value) for key, value in args.items()},
+                }
+                for name, start, end, tid, args in self._events
+            ]
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export_chrome_trace(self, path):
+        """
+        Write all recorded spans to a JSON file in the Chrome trace format.
+        """
+        with open(path, "wt") as f:
+            json.dump(self.chrome_trace(), f)
+
+
+def _json_safe(value):
+    if isinstance(value, (int, float, str, bool)) or value is None:
+        return value
+    return str(value)
+
+
+def get_profiler():
+    """
+    Get the Profiler active on the current thread, or None.
+    """
+    return getattr(_current, "profiler", None)
+
+
+@contextmanager
+def use_profiler(profiler):
+    """
+    Activate a Profiler on the current thread for the enclosed block, so that
+    span() calls made from this thread are recorded to it.
+    """
+    previous = get_profiler()
+    _current.profiler = profiler
+    try:
+        yield profiler
+    finally:
+        _current.profiler = previous
+
+
+@contextmanager
+def span(name, sync=False, **args):
+    """
+    Time the enclosed block with the current thread's Profiler, if any.
+
+    See Profiler.span() for parameter details.
+    """
+    profiler = get_profiler()
+    if profiler is None:
+        yield
+        return
+    with profiler.span(name, sync=sync, **args):
+        yield
@@ -71,6 +71,20 @@ def model_and_diffusion_defaults():
     return res
 
 
+def data_loader_defaults():
+    """
+    Defaults for training data loaders.
+    """
+    return dict(
+        num_workers=1,
+        pin_memory=False,
+        persistent_workers=False,
+        device_prefetch=False,
+        fast_decode=False,
+        manifest_path="",
+    )
+
+
 def classifier_and_diffusion_defaults():
     res = classifier_defaults()
     res.update(diffusion_defaults())
@@ -0,0 +1,208 @@
+"""
+Image/caption datasets streamed from tar shards.
+
+Each shard is a tar archive holding pairs of files that share a key, such as
+00001.jpg and 00001.txt, stored next to each other. Compressed archives are
+supported too, but only found when shards are given as a glob pattern.
+Shards are read front to back, so storage only sees large sequential reads
+instead of one small random read per file.
+"""
+
+import io
+import math
+import random
+import tarfile
+
+import blobfile as bf
+import numpy as np
+from torch.utils.data import DataLoader, IterableDataset, get_worker_info
+
+from . import dist_util
+from .dataset_manifest import IMAGE_EXTENSIONS
+from .image_text_datasets import center_crop_arr, load_image, random_crop_arr
+from .prefetch import prefetch_to_device
+
+
+def load_tar_data(
+    *,
+    shards,
+    batch_size,
+    image_size,
+    deterministic=False,
+    random_crop=False,
+    random_flip=True,
+    shuffle_buffer=1000,
+    num_workers=1,
+    pin_memory=False,
+    persistent_workers=False,
+    device_prefetch=False,
+    fast_decode=False,
+):
+    """
+    For a set of tar shards, create a generator over (images, kwargs, text)
+    triples, matching guided_diffusion.image_text_datasets.load_data.
+
+    Shards are split between processes, and then between each process's data
+    loading workers, so each worker streams its own subset of shards.
+
+    :param shards: a directory containing .tar shards, or a glob pattern
+                   matching them.
+    :param batch_size: the batch size of each returned triple.
+    :param image_size: the size to which images are resized.
+    :param deterministic: if True, read shards and samples in a fixed order.
+    :param random_crop: if True, randomly crop the images for augmentation.
+    :param random_flip: if True, randomly flip the images for augmentation.
+    :param shuffle_buffer: the number of samples each worker holds and draws
+                           from at random, to shuffle samples across shards.
+    :param num_workers: the number of data loading worker processes.
+    :param pin_memory: if True, collate batches into pinned host memory.
+    :param persistent_workers: if True, keep worker processes alive between
+                               passes over the dataset.
+    :param device_prefetch: if True, copy each batch to the training device
+                            while the previous batch is in use.
+    :param fast_decode: if True, decode JPEGs at a reduced scale close to the
+                        target size and resize them in a single step.
+    """
+    all_shards = list_tar_shards(shards)
+    world_size = dist_util.get_world_size()
+    rank_shards = all_shards[dist_util.get_rank() :][::world_size]
+    if len(rank_shards) == 0:
+        raise ValueError(f"{len(all_shards)} shards can't be split between {world_size} processes")
+    dataset = TarShardDataset(
+        image_size,
+        rank_shards,
+        deterministic=deterministic,
+        random_crop=random_crop,
+        random_flip=random_flip,
+        shuffle_buffer=shuffle_buffer,
+        fast_decode=fast_decode,
+    )
+    loader = DataLoader(
+        dataset,
+        batch_size=batch_size,
+        num_workers=num_workers,
+        drop_last=True,
+        pin_memory=pin_memory,
+        persistent_workers=persistent_workers and num_workers > 0,
+    )
+    data = _loop(loader)
+    if device_prefetch:
+        data = prefetch_to_device(data, dist_util.dev())
+    return data
+
+
+def _loop(loader):
+    while True:
+        yield from loader
+
+
+def list_tar_shards(shards):
+    """
+    Get the sorted paths of all shards in a directory or matching a glob.
+    """
+    if bf.isdir(shards):
+        paths = [bf.join(shards, entry) for entry in bf.listdir(shards) if entry.endswith(".tar")]
+    else:
+        paths = list(bf.glob(shards))
+    if len(paths) == 0:
+        raise ValueError(f"no tar shards found at {shards}")
+    return sorted(paths)
+
+
+class TarShardDataset(IterableDataset):
+    def __init__(
+        self,
+        resolution,
+        shard_paths,
+        deterministic=False,
+        random_crop=False,
+        random_flip=True,
+        shuffle_buffer=1000,
+        fast_decode=False,
+    ):
+        super().__init__()
+        self.resolution = resolution
+        self.shard_paths = shard_paths
+        self.deterministic = deterministic
+        self.random_crop = random_crop
+        self.random_flip = random_flip
+        self.shuffle_buffer = shuffle_buffer
+        self.fast_decode = fast_decode
+
+    def __iter__(self):
+        worker_info = get_worker_info()
+        shard_paths = self.shard_paths
+        if worker_info is not None:
+            shard_paths = shard_paths[worker_info.id :][:: worker_info.num_workers]
+        # Workers are forked with identical random states, so each creates its own:
+        rng = random.Random(0 if self.deterministic else None)
+        if not self.deterministic:
+            shard_paths = list(shard_paths)
+            rng.shuffle(shard_paths)
+
+        samples = (sample for path in shard_paths for sample in iterate_tar_samples(path))
+        if not self.deterministic and self.shuffle_buffer > 1:
+            # Shuffle encoded samples, which take far less memory than decoded ones:
+            samples = _shuffle(samples, self.shuffle_buffer, rng)
+        for image_data, caption in samples:
+            yield self._process(image_data, caption, rng)
+
+    def _process(self, image_data, caption, rng):
+        if self.fast_decode:
+            # Random crops may upscale the smaller side by up to 1 / min_crop_frac:
+            min_size = math.ceil(self.resolution / 0.8) if self.random_crop else self.resolution
+        else:
+            min_size = None
+        pil_image = load_image(io.BytesIO(image_data), min_size)
+
+        if self.random_crop:
+            arr = random_crop_arr(pil_image, self.resolution, single_resample=self.fast_decode)
+        else:
+            arr = center_crop_arr(pil_image, self.resolution, single_resample=self.fast_decode)
+
+        if self.random_flip and rng.random() < 0.5:
+            arr = arr[:, ::-1]
+
+        arr = arr.astype(np.float32) / 127.5 - 1
+        return np.transpose(arr, [2, 0, 1]), {}, caption
+
+
+def iterate_tar_samples(path):
+    """
+    Stream (image bytes, caption) pairs from a tar shard, reading it once
+    from start to end.
+
+    Files are grouped by key, the part of their name before the first ".".
+    Groups without both an image and a .txt caption are skipped.
+    """
+    with bf.BlobFile(path, "rb") as f, tarfile.open(fileobj=f, mode="r|*") as tar:
+        key, image_data, caption = None, None, None
+        for member in tar:
+            if not member.isfile():
+                continue
+            directory, _, name = member.name.rpartition("/")
+            member_key = f"{directory}/{name.split('.')[0]}"
+            ext = name.split(".")[-1].strip().lower()
+            if member_key != key:
+                if image_data is not None and caption is not None:
+                    yield image_data, caption
+                key, image_data, caption = member_key, None, None
+            if ext in IMAGE_EXTENSIONS:
+                image_data = tar.extractfile(member).read()
+            elif ext == "txt":
+                caption = tar.extractfile(member).read().decode("utf-8").strip()
+        if image_data is not None and caption is not None:
+            yield image_data, caption
+
+
+def _shuffle(samples, buffer_size, rng):
+    buffer = []
+    for sample in samples:
+        if len(buffer) < buffer_size:
+            buffer.append(sample)
+            continue
+        idx = rng.randrange(buffer_size)
+        yield buffer[idx]
+        buffer[idx] = sample
+    rng.shuffle(buffer)
+    yield from buffer
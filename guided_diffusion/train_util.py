@@ -9,6 +9,7 @@ from torch.nn.parallel.distributed import DistributedDataParallel as DDP
 from torch.optim import AdamW
 
 from . import dist_util, logger
+from .async_checkpoint import AsyncCheckpointWriter
 from .fp16_util import MixedPrecisionTrainer
 from .nn import update_ema
 from .resample import LossAwareSampler, UniformSampler
@@ -38,7 +39,11 @@ class TrainLoop:
         schedule_sampler=None,
         weight_decay=0.0,
         lr_anneal_steps=0,
-        lr_warmup_steps=0
+        lr_warmup_steps=0,
+        ema_interval=1,
+        fused_ema=True,
+        async_save=False,
+        amp_dtype="",
     ):
         self.model = model
         self.diffusion = diffusion
@@ -60,6 +65,15 @@ class TrainLoop:
         self.weight_decay = weight_decay
         self.lr_anneal_steps = lr_anneal_steps
         self.lr_warmup_steps = lr_warmup_steps
+        self.ema_interval = ema_interval
+        self.fused_ema = fused_ema
+        # Optimizer steps taken since the EMA parameters were last updated:
+        self.pending_ema_steps = 0
+        self.async_save = async_save
+        # Only rank 0 writes checkpoints:
+        self.checkpoint_writer = (
+            AsyncCheckpointWriter() if async_save and dist.get_rank() == 0 else None
+        )
 
         self.step = 0
         self.resume_step = 0
@@ -72,6 +86,7 @@ class TrainLoop:
             model=self.model,
             use_fp16=self.use_fp16,
             fp16_scale_growth=fp16_scale_growth,
+            amp_dtype=amp_dtype,
         )
 
         self.opt = AdamW(
@@ -100,12 +115,15 @@ class TrainLoop:
                 bucket_cap_mb=128,
                 find_unused_parameters=False,
             )
+        elif dist.get_world_size() > 1:
+            # CPU processes synchronize gradients through gloo:
+            self.use_ddp = True
+            self.ddp_model = DDP(
+                self.model,
+                broadcast_buffers=False,
+                find_unused_parameters=False,
+            )
         else:
-            if dist.get_world_size() > 1:
-                logger.warn(
-                    "Distributed training requires CUDA. "
-                    "Gradients will not be synchronized properly!"
-                )
             self.use_ddp = False
             self.ddp_model = self.model
 
@@ -198,17 +216,21 @@ class TrainLoop:
                 self.save()
                 # Run for a finite amount of time in integration tests.
                 if os.environ.get("DIFFUSION_TRAINING_TEST", "") and self.step > 0:
+                    self.wait_for_saves()
                     return
             self.step += 1
         # Save the last checkpoint if it wasn't already saved.
         if (self.step - 1) % self.save_interval != 0:
             self.save()
+        self.wait_for_saves()
 
     def run_step(self, batch, cond):
         self.forward_backward(batch, cond)
         took_step = self.mp_trainer.optimize(self.opt)
         if took_step:
-            self._update_ema()
+            self.pending_ema_steps += 1
+            if self.pending_ema_steps >= self.ema_interval:
+                self._update_ema()
         self._warmup_lr()
         self._anneal_lr()
         self.log_step()
@@ -232,11 +254,12 @@ class TrainLoop:
                 model_kwargs=micro_cond,
             )
 
-            if last_batch or not self.use_ddp:
-                losses = compute_losses()
-            else:
-                with self.ddp_model.no_sync():
+            with self.mp_trainer.autocast():
+                if last_batch or not self.use_ddp:
                     losses = compute_losses()
+                else:
+                    with self.ddp_model.no_sync():
+                        losses = compute_losses()
 
             if isinstance(self.schedule_sampler, LossAwareSampler):
                 self.schedule_sampler.update_with_local_losses(
@@ -250,8 +273,18 @@ class TrainLoop:
             self.mp_trainer.backward(loss)
 
     def _update_ema(self):
+        if self.pending_ema_steps == 0:
+            return
+        # Skipped updates are made up for by decaying as if each of them had
+        # used the current parameters:
         for rate, params in zip(self.ema_rate, self.ema_params):
-            update_ema(params, self.mp_trainer.master_params, rate=rate)
+            update_ema(
+                params,
+                self.mp_trainer.master_params,
+                rate=rate ** self.pending_ema_steps,
+                fused=self.fused_ema,
+            )
+        self.pending_ema_steps = 0
 
     def _anneal_lr(self):
         if not self.lr_anneal_steps:
@@ -279,29 +312,42 @@ class TrainLoop:
         logger.logkv("samples", (self.step + self.resume_step + 1) * self.global_batch)
 
     def save(self):
-        def save_checkpoint(rate, params):
-            state_dict = self.mp_trainer.master_params_to_state_dict(params)
-            if dist.get_rank() == 0:
+        self._update_ema()
+
+        if dist.get_rank() == 0:
+            step = self.step + self.resume_step
+            files = {}
+            for rate, params in [(0, self.mp_trainer.master_params)] + list(
+                zip(self.ema_rate, self.ema_params)
+            ):
                 logger.log(f"saving model {rate}...")
                 if not rate:
-                    filename = f"model{(self.step+self.resume_step):06d}.pt"
+                    filename = f"model{step:06d}.pt"
                 else:
-                    filename = f"ema_{rate}_{(self.step+self.resume_step):06d}.pt"
-                with bf.BlobFile(bf.join(get_blob_logdir(), filename), "wb") as f:
-                    th.save(state_dict, f)
-
-        save_checkpoint(0, self.mp_trainer.master_params)
-        for rate, params in zip(self.ema_rate, self.ema_params):
-            save_checkpoint(rate, params)
-
-        if dist.get_rank() == 0:
-            with bf.BlobFile(
-                bf.join(get_blob_logdir(), f"opt{(self.step+self.resume_step):06d}.pt"),
-                "wb",
-            ) as f:
-                th.save(self.opt.state_dict(), f)
+                    filename = f"ema_{rate}_{step:06d}.pt"
+                files[bf.join(get_blob_logdir(), filename)] = (
+                    self.mp_trainer.master_params_to_state_dict(params)
+                )
+            files[bf.join(get_blob_logdir(), f"opt{step:06d}.pt")] = self.opt.state_dict()
 
-        dist.barrier()
+            if self.checkpoint_writer is not None:
+                # Tensors are copied to host memory now and written in the
+                # background, so training continues during the write:
+                self.checkpoint_writer.submit(files)
+            else:
+                for path, state_dict in files.items():
+                    with bf.BlobFile(path, "wb") as f:
+                        th.save(state_dict, f)
+
+        if not self.async_save:
+            dist.barrier()
+
+    def wait_for_saves(self):
+        """
+        Wait for any checkpoints still being written in the background.
+        """
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.wait()
 
 
 def parse_resume_step_from_filename(filename):
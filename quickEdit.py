@@ -63,9 +63,13 @@ sample_fn, clip_score_fn = createSampleFunction(
         edit_y=args.edit_y,
         clip_guidance=args.clip_guidance,
         clip_guidance_scale=args.clip_guidance_scale,
+        clip_guidance_interval=args.clip_guidance_interval,
+        fused_clip_guidance=args.fused_clip_guidance,
         skip_timesteps=args.skip_timesteps,
         ddpm=args.ddpm,
-        ddim=args.ddim)
+        ddim=args.ddim,
+        tile_size=args.tile_size,
+        mask_crop_margin=args.mask_crop_margin)
 
 gc.collect()
 generateSamples(device,
@@ -0,0 +1,37 @@
+"""
+List a dataset directory once and save the result as a manifest, so that
+training can start without listing the directory again. Pass the manifest to
+training scripts with --manifest_path.
+"""
+
+import argparse
+
+import blobfile as bf
+
+from guided_diffusion.dataset_manifest import list_dataset_files, write_manifest
+from guided_diffusion.script_util import add_dict_to_argparser
+
+
+def main():
+    args = create_argparser().parse_args()
+    output = args.output or bf.join(args.data_dir, "manifest.bin")
+
+    print(f"listing {args.data_dir}...")
+    files = list_dataset_files(args.data_dir, with_text=args.with_text)
+    write_manifest(output, files)
+    print(f"wrote {len(files)} entries to {output}")
+
+
+def create_argparser():
+    defaults = dict(
+        data_dir="",
+        output="",  # defaults to manifest.bin within data_dir
+        with_text=True,  # False for datasets without captions, used by image_datasets.py
+    )
+    parser = argparse.ArgumentParser()
+    add_dict_to_argparser(parser, defaults)
+    return parser
+
+
+if __name__ == "__main__":
+    main()
@@ -21,6 +21,7 @@ from guided_diffusion.script_util import (
     args_to_dict,
     classifier_and_diffusion_defaults,
     create_classifier_and_diffusion,
+    data_loader_defaults,
 )
 from guided_diffusion.train_util import parse_resume_step_from_filename, log_loss_dict
 
@@ -77,6 +78,7 @@ def main():
         image_size=args.image_size,
         class_cond=True,
         random_crop=True,
+        **args_to_dict(args, data_loader_defaults().keys()),
     )
     if args.val_data_dir:
         val_data = load_data(
@@ -84,6 +86,7 @@ def main():
             batch_size=args.batch_size,
             image_size=args.image_size,
             class_cond=True,
+            **args_to_dict(args, data_loader_defaults().keys()),
         )
     else:
         val_data = None
@@ -217,6 +220,7 @@ def create_argparser():
         save_interval=10000,
     )
     defaults.update(classifier_and_diffusion_defaults())
+    defaults.update(data_loader_defaults())
     parser = argparse.ArgumentParser()
     add_dict_to_argparser(parser, defaults)
     return parser
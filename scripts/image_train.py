@@ -12,6 +12,7 @@ from guided_diffusion.script_util import (
     create_model_and_diffusion,
     args_to_dict,
     add_dict_to_argparser,
+    data_loader_defaults,
 )
 from guided_diffusion.train_util import TrainLoop
 
@@ -35,6 +36,7 @@ def main():
         batch_size=args.batch_size,
         image_size=args.image_size,
         class_cond=args.class_cond,
+        **args_to_dict(args, data_loader_defaults().keys()),
     )
     logger.log("training...")
     TrainLoop(
@@ -45,11 +47,14 @@ def main():
         microbatch=args.microbatch,
         lr=args.lr,
         ema_rate=args.ema_rate,
+        ema_interval=args.ema_interval,
+        async_save=args.async_save,
         log_interval=args.log_interval,
         save_interval=args.save_interval,
         resume_checkpoint=args.resume_checkpoint,
         use_fp16=args.use_fp16,
         fp16_scale_growth=args.fp16_scale_growth,
+        amp_dtype=args.amp_dtype,
         schedule_sampler=schedule_sampler,
         weight_decay=args.weight_decay,
         lr_anneal_steps=args.lr_anneal_steps,
@@ -66,13 +71,17 @@ def create_argparser():
         batch_size=1,
         microbatch=-1,  # -1 disables microbatches
         ema_rate="0.9999",  # comma-separated list of EMA values
+        ema_interval=1,  # update EMA parameters every N optimizer steps
+        async_save=False,  # write checkpoints in the background while training continues
         log_interval=10,
         save_interval=10000,
         resume_checkpoint="",
         use_fp16=False,
         fp16_scale_growth=1e-3,
+        amp_dtype="",  # "fp16" or "bf16" to train with torch.autocast instead of use_fp16
     )
     defaults.update(model_and_diffusion_defaults())
+    defaults.update(data_loader_defaults())
     parser = argparse.ArgumentParser()
     add_dict_to_argparser(parser, defaults)
     return parser
@@ -6,15 +6,20 @@ import argparse
 
 from guided_diffusion import dist_util, logger
 from guided_diffusion.image_text_datasets import load_data
+from guided_diffusion.tar_datasets import load_tar_data
+from guided_diffusion import latent_datasets
+from guided_diffusion.inpaint_masks import InpaintMaskGenerator
 from guided_diffusion.resample import create_named_schedule_sampler
 from guided_diffusion.script_util import (
     model_and_diffusion_defaults,
     create_model_and_diffusion,
     args_to_dict,
     add_dict_to_argparser,
+    data_loader_defaults,
 )
 from guided_diffusion.train_util import TrainLoop
 import torch
+import torch.distributed as dist
 import random
 
 from encoders.modules import BERTEmbedder
@@ -29,35 +34,12 @@ def main():
     dist_util.setup_dist()
     logger.configure()
 
-    from clip_custom import clip # make clip end up on the right device
-
-    logger.log("loading clip...")
-    clip_model, _ = clip.load('ViT-L/14', device=dist_util.dev(), jit=False)
-    clip_model.eval().requires_grad_(False)
-    set_requires_grad(clip_model, False)
-
-    del clip_model.visual
-
-    logger.log("loading vae...")
-
-    encoder = torch.load(args.kl_model, map_location="cpu")
-    encoder.half().to(dist_util.dev())
-    encoder.eval()
-    set_requires_grad(encoder, False)
-
-    del encoder.decoder
-    del encoder.loss
-
-    logger.log("loading text encoder...")
-
-    
-    bert = BERTEmbedder(1280, 32)
-    sd = torch.load(args.bert_model, map_location="cpu")
-    bert.load_state_dict(sd)
-
-    bert.half().to(dist_util.dev())
-    bert.eval()
-    set_requires_grad(bert, False)
+    if args.latent_dir:
+        # Latents and text embeddings were already computed by scripts/preprocess_latents.py, so the encoders aren't
+        # needed:
+        encoder = bert = clip_model = clip = None
+    else:
+        encoder, bert, clip_model, clip = load_encoders(args)
 
     logger.log("creating model and diffusion...")
     model, diffusion = create_model_and_diffusion(
@@ -71,15 +53,32 @@ def main():
     schedule_sampler = create_named_schedule_sampler(args.schedule_sampler, diffusion)
 
     logger.log("creating data loader...")
-    data = load_latent_data(
-        encoder,
-        bert,
-        clip_model,
-        clip,
-        data_dir=args.data_dir,
-        batch_size=args.batch_size,
-        image_size=args.image_size,
+    # Offset the seed by rank, so that each process masks its batches differently:
+    mask_generator = InpaintMaskGenerator(
+        dist_util.dev(),
+        seed=None if args.mask_seed < 0 else args.mask_seed + dist.get_rank(),
     )
+    if args.latent_dir:
+        data = load_precomputed_latent_data(
+            data_dir=args.latent_dir,
+            batch_size=args.batch_size,
+            mask_generator=mask_generator,
+            # Latent shards are already decoded and indexed, so fast_decode and manifest_path don't apply:
+            **args_to_dict(args, ["num_workers", "pin_memory", "persistent_workers", "device_prefetch"]),
+        )
+    else:
+        data = load_latent_data(
+            encoder,
+            bert,
+            clip_model,
+            clip,
+            data_dir=args.data_dir,
+            tar_shards=args.tar_shards,
+            batch_size=args.batch_size,
+            image_size=args.image_size,
+            mask_generator=mask_generator,
+            **args_to_dict(args, data_loader_defaults().keys()),
+        )
     logger.log("training...")
     TrainLoop(
         model=model,
@@ -89,25 +88,71 @@ def main():
         microbatch=args.microbatch,
         lr=args.lr,
         ema_rate=args.ema_rate,
+        ema_interval=args.ema_interval,
+        async_save=args.async_save,
         log_interval=args.log_interval,
         save_interval=args.save_interval,
         resume_checkpoint=args.resume_checkpoint,
         use_fp16=args.use_fp16,
         fp16_scale_growth=args.fp16_scale_growth,
+        amp_dtype=args.amp_dtype,
         schedule_sampler=schedule_sampler,
         weight_decay=args.weight_decay,
         lr_anneal_steps=args.lr_anneal_steps,
     ).run_loop()
 
-def load_latent_data(encoder, bert, clip_model, clip, data_dir, batch_size, image_size):
-    data = load_data(
-        data_dir=data_dir,
-        batch_size=batch_size,
-        image_size=256,
-        class_cond=False,
-    )
+def load_encoders(args):
+    from clip_custom import clip # make clip end up on the right device
 
-    blur = transforms.GaussianBlur(kernel_size=(15, 15), sigma=(0.1, 5))
+    logger.log("loading clip...")
+    clip_model, _ = clip.load('ViT-L/14', device=dist_util.dev(), jit=False)
+    clip_model.eval().requires_grad_(False)
+    set_requires_grad(clip_model, False)
+
+    del clip_model.visual
+
+    logger.log("loading vae...")
+
+    encoder = torch.load(args.kl_model, map_location="cpu")
+    encoder.half().to(dist_util.dev())
+    encoder.eval()
+    set_requires_grad(encoder, False)
+
+    del encoder.decoder
+    del encoder.loss
+
+    logger.log("loading text encoder...")
+
+    
+    bert = BERTEmbedder(1280, 32)
+    sd = torch.load(args.bert_model, map_location="cpu")
+    bert.load_state_dict(sd)
+
+    bert.half().to(dist_util.dev())
+    bert.eval()
+    set_requires_grad(bert, False)
+    return encoder, bert, clip_model, clip
+
+def load_latent_data(
+    encoder, bert, clip_model, clip, data_dir, tar_shards, batch_size, image_size, mask_generator, manifest_path="",
+    **loader_kwargs
+):
+    if tar_shards:
+        data = load_tar_data(
+            shards=tar_shards,
+            batch_size=batch_size,
+            image_size=256,
+            **loader_kwargs,
+        )
+    else:
+        data = load_data(
+            data_dir=data_dir,
+            batch_size=batch_size,
+            image_size=256,
+            class_cond=False,
+            manifest_path=manifest_path,
+            **loader_kwargs,
+        )
 
     for batch, model_kwargs, text in data:
 
@@ -128,47 +173,29 @@ def load_latent_data(encoder, bert, clip_model, clip, data_dir, batch_size, imag
         emb = encoder.encode(batch.half()).sample().half()
         emb *= 0.18215
 
-        emb_cond = emb.detach().clone()
+        model_kwargs["image_embed"] = mask_generator.mask_latents(emb)
 
-        for i in range(batch.shape[0]):
-            if random.randint(0,100) < 20:
-                emb_cond[i,:,:,:] = 0 # unconditional
-            else:
-                if random.randint(0,100) < 50:
-                    mask = torch.randn(1, 32, 32)
-                    mask = blur(mask)
-                    mask = (mask > 0)
-                    mask = mask.repeat(4, 1, 1)
-                    mask = mask.float()
-                    emb_cond[i] *= mask
-                else:
-                    # mask out 4 random rectangles
-                    for j in range(random.randint(1,4)):
-                        max_area = 32*16
-                        w = random.randint(1,32)
-                        h = random.randint(1,32)
-                        if w*h > max_area:
-                            if random.randint(0,100) < 50:
-                                w = max_area//h
-                            else:
-                                h = max_area//w
-                        if w == 32:
-                            offsetx = 0
-                        else:
-                            offsetx = random.randint(0, 32-w)
-                        if h == 32:
-                            offsety = 0
-                        else:
-                            offsety = random.randint(0, 32-h)
-                        emb_cond[i,:, offsety:offsety+h, offsetx:offsetx+w] = 0
-
-        model_kwargs["image_embed"] = emb_cond
+        yield emb, model_kwargs
 
+def load_precomputed_latent_data(data_dir, batch_size, mask_generator, **loader_kwargs):
+    data = latent_datasets.load_latent_data(
+        data_dir=data_dir,
+        batch_size=batch_size,
+        text_drop_prob=0.2,
+        **loader_kwargs,
+    )
+    for emb, model_kwargs in data:
+        emb = emb.to(dist_util.dev())
+        model_kwargs = {key: value.to(dist_util.dev()) for key, value in model_kwargs.items()}
+        model_kwargs["image_embed"] = mask_generator.mask_latents(emb)
         yield emb, model_kwargs
 
 def create_argparser():
     defaults = dict(
         data_dir="",
+        tar_shards="",  # if set, stream images and captions from tar shards in this directory or glob instead
+        latent_dir="",  # if set, train on shards written by scripts/preprocess_latents.py instead of data_dir
+        mask_seed=-1,  # seed for random inpainting masks, or -1 for a random seed
         schedule_sampler="uniform",
         lr=1e-4,
         weight_decay=0.0,
@@ -176,15 +203,19 @@ def create_argparser():
         batch_size=1,
         microbatch=-1,  # -1 disables microbatches
         ema_rate="0.9999",  # comma-separated list of EMA values
+        ema_interval=1,  # update EMA parameters every N optimizer steps
+        async_save=False,  # write checkpoints in the background while training continues
         log_interval=10,
         save_interval=10000,
         resume_checkpoint="",
         use_fp16=False,
         fp16_scale_growth=1e-3,
+        amp_dtype="",  # "fp16" or "bf16" to train with torch.autocast instead of use_fp16
         kl_model=None,
         bert_model=None,
     )
     defaults.update(model_and_diffusion_defaults())
+    defaults.update(data_loader_defaults())
 
     defaults['clip_embed_dim'] = 768
     defaults['image_condition'] = True
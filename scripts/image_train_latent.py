@@ -6,12 +6,14 @@ import argparse
 
 from guided_diffusion import dist_util, logger
 from guided_diffusion.image_text_datasets import load_data
+from guided_diffusion.tar_datasets import load_tar_data
 from guided_diffusion.resample import create_named_schedule_sampler
 from guided_diffusion.script_util import (
     model_and_diffusion_defaults,
     create_model_and_diffusion,
     args_to_dict,
     add_dict_to_argparser,
+    data_loader_defaults,
 )
 from guided_diffusion.train_util import TrainLoop
 import torch
@@ -66,8 +68,10 @@ def main():
         encoder,
         bert,
         data_dir=args.data_dir,
+        tar_shards=args.tar_shards,
         batch_size=args.batch_size,
         image_size=args.image_size,
+        **args_to_dict(args, data_loader_defaults().keys()),
     )
     logger.log("training...")
     TrainLoop(
@@ -78,23 +82,36 @@ def main():
         microbatch=args.microbatch,
         lr=args.lr,
         ema_rate=args.ema_rate,
+        ema_interval=args.ema_interval,
+        async_save=args.async_save,
         log_interval=args.log_interval,
         save_interval=args.save_interval,
         resume_checkpoint=args.resume_checkpoint,
         use_fp16=args.use_fp16,
         fp16_scale_growth=args.fp16_scale_growth,
+        amp_dtype=args.amp_dtype,
         schedule_sampler=schedule_sampler,
         weight_decay=args.weight_decay,
         lr_anneal_steps=args.lr_anneal_steps,
     ).run_loop()
 
-def load_latent_data(encoder, bert, data_dir, batch_size, image_size):
-    data = load_data(
-        data_dir=data_dir,
-        batch_size=batch_size,
-        image_size=256,
-        class_cond=False,
-    )
+def load_latent_data(encoder, bert, data_dir, tar_shards, batch_size, image_size, manifest_path="", **loader_kwargs):
+    if tar_shards:
+        data = load_tar_data(
+            shards=tar_shards,
+            batch_size=batch_size,
+            image_size=256,
+            **loader_kwargs,
+        )
+    else:
+        data = load_data(
+            data_dir=data_dir,
+            batch_size=batch_size,
+            image_size=256,
+            class_cond=False,
+            manifest_path=manifest_path,
+            **loader_kwargs,
+        )
     for batch, model_kwargs, text in data:
 
         text = list(text)
@@ -115,6 +132,7 @@ def load_latent_data(encoder, bert, data_dir, batch_size, image_size):
 def create_argparser():
     defaults = dict(
         data_dir="",
+        tar_shards="",  # if set, stream images and captions from tar shards in this directory or glob instead
         schedule_sampler="uniform",
         lr=1e-4,
         weight_decay=0.0,
@@ -122,15 +140,19 @@ def create_argparser():
         batch_size=1,
         microbatch=-1,  # -1 disables microbatches
         ema_rate="0.9999",  # comma-separated list of EMA values
+        ema_interval=1,  # update EMA parameters every N optimizer steps
+        async_save=False,  # write checkpoints in the background while training continues
         log_interval=10,
         save_interval=10000,
         resume_checkpoint="",
         use_fp16=False,
         fp16_scale_growth=1e-3,
+        amp_dtype="",  # "fp16" or "bf16" to train with torch.autocast instead of use_fp16
         kl_model=None,
         bert_model=None,
     )
     defaults.update(model_and_diffusion_defaults())
+    defaults.update(data_loader_defaults())
     parser = argparse.ArgumentParser()
     add_dict_to_argparser(parser, defaults)
     return parser
@@ -0,0 +1,166 @@
+"""
+Encode an image/caption dataset into memory-mapped shards of VAE latents and
+BERT and CLIP text embeddings, so that training doesn't have to run the frozen
+encoders on every batch. See guided_diffusion/latent_datasets.py for the
+output format, and use the output directory as --latent_dir when training.
+"""
+
+import argparse
+import os
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+
+from guided_diffusion import dist_util, logger
+from guided_diffusion.dataset_manifest import Manifest
+from guided_diffusion.image_text_datasets import ImageDataset, _list_image_files_recursively
+from guided_diffusion.latent_datasets import LATENT_SCALE
+from guided_diffusion.script_util import add_dict_to_argparser
+
+from encoders.modules import BERTEmbedder
+
+
+def set_requires_grad(model, value):
+    for param in model.parameters():
+        param.requires_grad = value
+
+
+def main():
+    args = create_argparser().parse_args()
+
+    dist_util.setup_dist()
+    logger.configure()
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    from clip_custom import clip # make clip end up on the right device
+
+    logger.log("loading clip...")
+    clip_model, _ = clip.load('ViT-L/14', device=dist_util.dev(), jit=False)
+    clip_model.eval().requires_grad_(False)
+    set_requires_grad(clip_model, False)
+    del clip_model.visual
+
+    logger.log("loading vae...")
+    encoder = torch.load(args.kl_model, map_location="cpu")
+    encoder.half().to(dist_util.dev())
+    encoder.eval()
+    set_requires_grad(encoder, False)
+    del encoder.decoder
+    del encoder.loss
+
+    logger.log("loading text encoder...")
+    bert = BERTEmbedder(1280, 32)
+    sd = torch.load(args.bert_model, map_location="cpu")
+    bert.load_state_dict(sd)
+    bert.half().to(dist_util.dev())
+    bert.eval()
+    set_requires_grad(bert, False)
+
+    def encode_text(text):
+        context = bert.encode(text).to(dist_util.dev()).half()
+        clip_embed = clip_model.encode_text(clip.tokenize(text, truncate=True).to(dist_util.dev()))
+        return context.cpu().numpy(), clip_embed.half().cpu().numpy()
+
+    rank = dist_util.get_rank()
+    with torch.no_grad():
+        if rank == 0:
+            blank_context, blank_clip = encode_text([''])
+            np.save(os.path.join(args.output_dir, "blank.context.npy"), blank_context[0])
+            np.save(os.path.join(args.output_dir, "blank.clip.npy"), blank_clip[0])
+
+        if args.manifest_path:
+            files = Manifest(args.manifest_path)
+        else:
+            files = _list_image_files_recursively(args.data_dir)
+        dataset = ImageDataset(
+            args.image_size,
+            files,
+            shard=rank,
+            num_shards=dist_util.get_world_size(),
+            random_crop=False,
+            random_flip=False,
+        )
+        loader = DataLoader(
+            dataset, batch_size=args.batch_size, shuffle=False, num_workers=args.num_workers, drop_last=False
+        )
+        logger.log(f"encoding {len(dataset)} images...")
+
+        writer = ShardWriter(args.output_dir, f"rank{rank:03d}", len(dataset), args.shard_size)
+        for batch, _, text in loader:
+            latents = encoder.encode(batch.to(dist_util.dev()).half()).sample().half()
+            latents *= LATENT_SCALE
+            context, clip_embed = encode_text(list(text))
+            writer.write(latents.cpu().numpy(), context, clip_embed)
+            logger.log(f"encoded {writer.count}/{len(dataset)} images")
+        writer.close()
+    logger.log("done")
+
+
+class ShardWriter:
+    """
+    Writes rows into a sequence of memory-mapped shards, each holding up to
+    shard_size rows.
+    """
+
+    def __init__(self, output_dir, prefix, total, shard_size):
+        self.output_dir = output_dir
+        self.prefix = prefix
+        self.total = total
+        self.shard_size = shard_size
+        self.count = 0
+        self._shard_idx = -1
+        self._arrays = None
+        self._row = 0
+
+    def _open_shard(self, latents, context, clip_embed):
+        self.close()
+        self._shard_idx += 1
+        rows = min(self.shard_size, self.total - self.count)
+        prefix = os.path.join(self.output_dir, f"{self.prefix}_{self._shard_idx:05d}")
+        self._arrays = {
+            name: np.lib.format.open_memmap(
+                f"{prefix}.{name}.npy", mode="w+", dtype=np.float16, shape=(rows, *example.shape[1:])
+            )
+            for name, example in [("latents", latents), ("context", context), ("clip", clip_embed)]
+        }
+        self._row = 0
+
+    def write(self, latents, context, clip_embed):
+        start = 0
+        while start < latents.shape[0]:
+            if self._arrays is None or self._row == self._arrays["latents"].shape[0]:
+                self._open_shard(latents, context, clip_embed)
+            end = min(latents.shape[0], start + self._arrays["latents"].shape[0] - self._row)
+            for name, values in [("latents", latents), ("context", context), ("clip", clip_embed)]:
+                self._arrays[name][self._row : self._row + end - start] = values[start:end]
+            self._row += end - start
+            self.count += end - start
+            start = end
+
+    def close(self):
+        if self._arrays is not None:
+            for array in self._arrays.values():
+                array.flush()
+            self._arrays = None
+
+
+def create_argparser():
+    defaults = dict(
+        data_dir="",
+        output_dir="",
+        manifest_path="",  # if set, read image and caption paths from this manifest instead of listing data_dir
+        image_size=256,
+        batch_size=16,
+        num_workers=4,
+        shard_size=4096,
+        kl_model=None,
+        bert_model=None,
+    )
+    parser = argparse.ArgumentParser()
+    add_dict_to_argparser(parser, defaults)
+    return parser
+
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,7 @@ from guided_diffusion.script_util import (
     sr_create_model_and_diffusion,
     args_to_dict,
     add_dict_to_argparser,
+    data_loader_defaults,
 )
 from guided_diffusion.train_util import TrainLoop
 
@@ -38,6 +39,7 @@ def main():
         large_size=args.large_size,
         small_size=args.small_size,
         class_cond=args.class_cond,
+        **args_to_dict(args, data_loader_defaults().keys()),
     )
 
     logger.log("training...")
@@ -49,23 +51,27 @@ def main():
         microbatch=args.microbatch,
         lr=args.lr,
         ema_rate=args.ema_rate,
+        ema_interval=args.ema_interval,
+        async_save=args.async_save,
         log_interval=args.log_interval,
         save_interval=args.save_interval,
         resume_checkpoint=args.resume_checkpoint,
         use_fp16=args.use_fp16,
         fp16_scale_growth=args.fp16_scale_growth,
+        amp_dtype=args.amp_dtype,
         schedule_sampler=schedule_sampler,
         weight_decay=args.weight_decay,
         lr_anneal_steps=args.lr_anneal_steps,
     ).run_loop()
 
 
-def load_superres_data(data_dir, batch_size, large_size, small_size, class_cond=False):
+def load_superres_data(data_dir, batch_size, large_size, small_size, class_cond=False, **loader_kwargs):
     data = load_data(
         data_dir=data_dir,
         batch_size=batch_size,
         image_size=large_size,
         class_cond=class_cond,
+        **loader_kwargs,
     )
     for large_batch, model_kwargs in data:
         model_kwargs["low_res"] = F.interpolate(large_batch, small_size, mode="area")
@@ -82,13 +88,17 @@ def create_argparser():
         batch_size=1,
         microbatch=-1,
         ema_rate="0.9999",
+        ema_interval=1,  # update EMA parameters every N optimizer steps
+        async_save=False,  # write checkpoints in the background while training continues
         log_interval=10,
         save_interval=10000,
         resume_checkpoint="",
         use_fp16=False,
         fp16_scale_growth=1e-3,
+        amp_dtype="",  # "fp16" or "bf16" to train with torch.autocast instead of use_fp16
     )
     defaults.update(sr_model_and_diffusion_defaults())
+    defaults.update(data_loader_defaults())
     parser = argparse.ArgumentParser()
     add_dict_to_argparser(parser, defaults)
     return parser
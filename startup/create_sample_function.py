@@ -7,8 +7,26 @@ from torchvision.transforms import functional as TF
 from torch.nn import functional as F
 from encoders.modules import MakeCutouts
 from startup.utils import fetch
+from startup.tiled_model import createTiledModel
+from startup.ml_utils import getMaskCropBounds
+from guided_diffusion.profiler import span
+from guided_diffusion.respace import _WrappedModel
 import sys
 
+class _SpacedTimestepModel(_WrappedModel):
+    """
+    Wraps a model function for a SpacedDiffusion sampler, so that it receives timesteps from the spaced schedule.
+
+    Calls fn(x, t, model, **kwargs), where t is the spaced timestep and model(x, t, **kwargs) calls the wrapped model
+    with t mapped back to the original schedule, exactly as the sampler would have called it.
+    """
+    def __init__(self, diffusion, model, fn):
+        super().__init__(model, diffusion.timestep_map, diffusion.rescale_timesteps, diffusion.original_num_steps)
+        self._fn = fn
+
+    def __call__(self, x, t, **kwargs):
+        return self._fn(x, t, super().__call__, **kwargs)
+
 def createSampleFunction(
         device,
         model,
@@ -35,23 +53,50 @@ def createSampleFunction(
         edit_y=0,
         clip_guidance=False,
         clip_guidance_scale=None,
+        clip_guidance_interval=1,
+        fused_clip_guidance=False,
         skip_timesteps=False,
         ddpm=False,
-        ddim=False):
+        ddim=False,
+        tile_size=None,
+        tile_overlap=64,
+        mask_crop_margin=None):
     """
     Creates a function that will generate a set of sample images, along with an accompanying clip ranking function.
+
+    If mask_crop_margin is set and the mask only covers part of the edited image, only the masked area and
+    mask_crop_margin pixels of surrounding context are diffused. The results are pasted back into the rest of the
+    encoded image, so the 'pred_xstart' values provided by the sample function still cover the whole image.
+
+    If tile_size is set and the image is larger than tile_size pixels in either dimension, the image is diffused as
+    overlapping tiles that are blended together at each step, see startup.tiled_model.createTiledModel.
+
+    With clip_guidance enabled, CLIP guidance is only applied on every clip_guidance_interval-th step. By default,
+    CLIP guidance runs an extra model forward pass at the final timestep to compute its gradient. If
+    fused_clip_guidance is set, the gradient is instead computed through the same model prediction used for the step
+    itself, so each guided step only runs the model once. Fused guidance adjusts the predicted noise, which only matches
+    unfused guidance for the PLMS and DDIM samplers, so it can't be combined with ddpm.
+
+    The returned sample function takes an optional init tensor, and an optional noise_fn(shape) function that
+    provides the initial noise tensor for the given sample shape.
     """
+    if clip_guidance and fused_clip_guidance and ddpm:
+        # DDPM applies cond_fn to the step mean, scaled by the step variance, instead of to the predicted noise:
+        raise Exception('fused_clip_guidance is not supported with ddpm sampling')
+
     # bert context
-    text_emb = bert_model.encode([prompt]*batch_size).to(device).float()
-    text_blank = bert_model.encode([negative]*batch_size).to(device).float()
+    with span("bert_encode", sync=True):
+        text_emb = bert_model.encode([prompt]*batch_size).to(device).float()
+        text_blank = bert_model.encode([negative]*batch_size).to(device).float()
 
     text = clip.tokenize([prompt]*batch_size, truncate=True).to(device)
     text_clip_blank = clip.tokenize([negative]*batch_size, truncate=True).to(device)
 
 
     # clip context
-    text_emb_clip = clip_model.encode_text(text)
-    text_emb_clip_blank = clip_model.encode_text(text_clip_blank)
+    with span("clip_text_encode", sync=True):
+        text_emb_clip = clip_model.encode_text(text)
+        text_emb_clip_blank = clip_model.encode_text(text_clip_blank)
     if clip_guidance and not clip_guidance_scale:
         clip_guidance_scale = 150
 
@@ -60,6 +105,9 @@ def createSampleFunction(
     text_emb_norm = text_emb_clip[0] / text_emb_clip[0].norm(dim=-1, keepdim=True)
 
     image_embed = None
+    sample_width = width
+    sample_height = height
+    crop_bounds = None
 
     # image context
     if edit:
@@ -80,9 +128,11 @@ def createSampleFunction(
             input_image_pil = Image.open(fetch(edit)).convert('RGB')
             input_image_pil = ImageOps.fit(input_image_pil, (w, h))
         if input_image_pil is not None:
-            np_image = transforms.ToTensor()(input_image_pil).unsqueeze(0).to(device)
-            np_image = 2 * np_image - 1
-            np_image = ldm_model.encode(np_image).sample()
+            with span("vae_encode", sync=True):
+                np_image = transforms.ToTensor()(input_image_pil).unsqueeze(0).to(device)
+                np_image = 2 * np_image - 1
+                # Use the posterior mean instead of a random sample, so the same inputs always give the same results:
+                np_image = ldm_model.encode(np_image).mean
 
         y = edit_y//8
         x = edit_x//8
@@ -103,8 +153,9 @@ def createSampleFunction(
             0 if y > 0 else -y:np_image.shape[2]-ycrop,
             0 if x > 0 else -x:np_image.shape[3]-xcrop
         ]
-        input_image_pil = ldm_model.decode(input_image)
-        input_image_pil = TF.to_pil_image(input_image_pil.squeeze(0).add(1).div(2).clamp(0, 1))
+        with span("vae_decode", sync=True):
+            input_image_pil = ldm_model.decode(input_image)
+            input_image_pil = TF.to_pil_image(input_image_pil.squeeze(0).add(1).div(2).clamp(0, 1))
         input_image *= 0.18215
 
         if isinstance(mask, Image.Image):
@@ -120,8 +171,18 @@ def createSampleFunction(
             raise Exception(f"Expected PIL image or image path for mask, found {mask}")
         mask1 = (mask > 0.5)
         mask1 = mask1.float()
+        # Keep the complete encoded image, to fill in areas outside of the cropped sample area:
+        full_image = input_image.clone()
         input_image *= mask1
 
+        if mask_crop_margin is not None and mask_crop_margin >= 0:
+            crop_bounds = getMaskCropBounds(mask1, mask_crop_margin // 8)
+        if crop_bounds is not None:
+            top, bottom, left, right = crop_bounds
+            input_image = input_image[:, :, top:bottom, left:right]
+            sample_height = (bottom - top) * 8
+            sample_width = (right - left) * 8
+
         image_embed = torch.cat(batch_size*2*[input_image], dim=0).float()
     elif model_params['image_condition']:
         # using inpaint model but no image is provided
@@ -133,18 +194,46 @@ def createSampleFunction(
         "image_embed": image_embed
     }
 
+    diffusion_model = model
+    if tile_size and (sample_width > tile_size or sample_height > tile_size):
+        diffusion_model = createTiledModel(model, tile_size // 8, tile_overlap // 8)
+
     # Create a classifier-free guidance sampling function
     def model_fn(x_t, ts, **kwargs):
         half = x_t[: len(x_t) // 2]
         combined = torch.cat([half, half], dim=0)
-        model_out = model(combined, ts, **kwargs)
+        model_out = diffusion_model(combined, ts, **kwargs)
         eps, rest = model_out[:, :3], model_out[:, 3:]
         cond_eps, uncond_eps = torch.split(eps, len(eps) // 2, dim=0)
         half_eps = uncond_eps + guidance_scale * (cond_eps - uncond_eps)
         eps = torch.cat([half_eps, half_eps], dim=0)
         return torch.cat([eps, rest], dim=1)
 
+    def is_guidance_step(t):
+        return int(t.flatten()[0].floor()) % clip_guidance_interval == 0
+
+    def spherical_dist_loss(x, y):
+        x = F.normalize(x, dim=-1)
+        y = F.normalize(y, dim=-1)
+        return (x - y).norm(dim=-1).div(2).arcsin().pow(2).mul(2)
+
+    def clip_guidance_loss(x, pred_xstart, fac):
+        """Scores how closely the predicted output matches the prompt, using CLIP embeddings of random cutouts"""
+        n = x.shape[0]
+        x_in = pred_xstart * fac + x * (1 - fac)
+        x_in = x_in / 0.18215
+        x_img = ldm_model.decode(x_in)
+        clip_in = normalize(make_cutouts(x_img.add(1).div(2)))
+        clip_embeds = clip_model.encode_image(clip_in).float()
+        dists = spherical_dist_loss(clip_embeds.unsqueeze(1), text_emb_clip.unsqueeze(0))
+        dists = dists.view([cutn, n, -1])
+        losses = dists.sum(2).mean(0)
+        return losses.sum() * clip_guidance_scale
+
     def cond_fn(x, t, context=None, clip_embed=None, image_embed=None):
+        # Samplers apply the gradient to the whole classifier-free guidance batch, so both halves get the same gradient:
+        if not is_guidance_step(t):
+            return torch.zeros_like(x)
         with torch.enable_grad():
             cur_t = diffusion.num_timesteps - 1
             x = x[:batch_size].detach().requires_grad_()
@@ -159,29 +248,47 @@ def createSampleFunction(
                 'image_embed': image_embed[:batch_size] if image_embed is not None else None
             }
 
-            out = diffusion.p_mean_variance(model, x, my_t, clip_denoised=False, model_kwargs=kw)
+            out = diffusion.p_mean_variance(diffusion_model, x, my_t, clip_denoised=False, model_kwargs=kw)
 
             fac = diffusion.sqrt_one_minus_alphas_cumprod[cur_t]
-            x_in = out['pred_xstart'] * fac + x * (1 - fac)
-
-            x_in /= 0.18215
+            loss = clip_guidance_loss(x, out['pred_xstart'], fac)
 
-            x_img = ldm_model.decode(x_in)
+            grad = -torch.autograd.grad(loss, x)[0]
+            return torch.cat([grad, grad], dim=0)
 
-            clip_in = normalize(make_cutouts(x_img.add(1).div(2)))
-            clip_embeds = clip_model.encode_image(clip_in).float()
-            def spherical_dist_loss(x, y):
-                x = F.normalize(x, dim=-1)
-                y = F.normalize(y, dim=-1)
-                return (x - y).norm(dim=-1).div(2).arcsin().pow(2).mul(2)
-            dists = spherical_dist_loss(clip_embeds.unsqueeze(1), text_emb_clip.unsqueeze(0))
-            dists = dists.view([cutn, n, -1])
-
-            losses = dists.sum(2).mean(0)
+    alphas_cumprod = torch.tensor(diffusion.alphas_cumprod, device=device, dtype=torch.float32)
+    def fused_model_fn(x_t, t, guided_model, **kwargs):
+        """
+        Runs the classifier-free guidance model function with gradients enabled, using its prediction both for the
+        step itself and to compute the CLIP guidance gradient. The returned eps includes the CLIP guidance adjustment
+        that cond_fn would otherwise apply.
+        """
+        if not is_guidance_step(t):
+            return guided_model(x_t, t, **kwargs)
+        t = t.float()
+        alpha_bar = torch.lerp(alphas_cumprod[t.floor().long()], alphas_cumprod[t.ceil().long()], t.frac())
+        alpha_bar = alpha_bar[:batch_size, None, None, None]
+        with torch.enable_grad():
+            half = x_t[:batch_size].detach().requires_grad_()
+            model_out = guided_model(torch.cat([half, half], dim=0), t, **kwargs)
+            eps = model_out[:batch_size, :4]
+            pred_xstart = (half - (1 - alpha_bar).sqrt() * eps) / alpha_bar.sqrt()
+            loss = clip_guidance_loss(half, pred_xstart, (1 - alpha_bar).sqrt())
+            grad = torch.autograd.grad(loss, half)[0]
+        model_out = model_out.detach()
+        guided_eps = eps.detach() + (1 - alpha_bar).sqrt() * grad
+        return torch.cat([torch.cat([guided_eps, guided_eps], dim=0), model_out[:, 4:]], dim=1)
 
-            loss = losses.sum() * clip_guidance_scale
+    def spaced_cond_fn(x, t, _, **kwargs):
+        return cond_fn(x, t, **kwargs)
 
-            return -torch.autograd.grad(loss, x)[0]
+    sample_model = model_fn
+    # Without the wrapper, SpacedDiffusion would map t back to the original schedule before calling cond_fn for some
+    # samplers but not others, and clip_guidance_interval would count different steps:
+    sample_cond_fn = _SpacedTimestepModel(diffusion, cond_fn, spaced_cond_fn) if clip_guidance else None
+    if clip_guidance and fused_clip_guidance:
+        sample_model = _SpacedTimestepModel(diffusion, model_fn, fused_model_fn)
+        sample_cond_fn = None
  
     if ddpm:
         base_sample_fn = diffusion.ddpm_sample_loop_progressive
@@ -189,18 +296,34 @@ def createSampleFunction(
         base_sample_fn = diffusion.ddim_sample_loop_progressive
     else:
         base_sample_fn = diffusion.plms_sample_loop_progressive
-    def sample_fn(init):
+    def diffuse(init, noise_fn):
+        shape = (batch_size*2, 4, int(sample_height/8), int(sample_width/8))
         return base_sample_fn(
-            model_fn,
-            (batch_size*2, 4, int(height/8), int(width/8)),
+            sample_model,
+            shape,
+            noise=noise_fn(shape) if noise_fn is not None else None,
             clip_denoised=False,
             model_kwargs=model_kwargs,
-            cond_fn=cond_fn if clip_guidance else None,
+            cond_fn=sample_cond_fn,
             device=device,
             progress=True,
             init_image=init,
             skip_timesteps=skip_timesteps
         )
+    def paste_into_full_image(samples):
+        for sample in samples:
+            top, bottom, left, right = crop_bounds
+            pred_xstart = full_image.repeat(sample['pred_xstart'].shape[0], 1, 1, 1)
+            pred_xstart[:, :, top:bottom, left:right] = sample['pred_xstart']
+            sample['pred_xstart'] = pred_xstart
+            yield sample
+    def sample_fn(init, noise_fn=None):
+        if crop_bounds is not None:
+            if init is not None:
+                top, bottom, left, right = crop_bounds
+                init = init[:, :, top:bottom, left:right]
+            return paste_into_full_image(diffuse(init, noise_fn))
+        return diffuse(init, noise_fn)
     def clip_score_fn(image):
         """Provides a CLIP score ranking image closeness to text"""
         image_emb = clip_model.encode_image(clip_preprocess(image).unsqueeze(0).to(device))
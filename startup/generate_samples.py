@@ -1,6 +1,24 @@
 import torch
 from torchvision.transforms import functional as TF
 from PIL import Image
+from guided_diffusion.profiler import span
+
+# Seed for the global torch RNG while sampling, which provides sampler step noise and CLIP guidance cutouts. It is the
+# same for every batch, so that those random values don't depend on which seeds a batch holds.
+SAMPLING_RNG_SEED = 0
+
+def createSeededNoise(seeds, shape, device):
+    """
+    Creates random noise of the given shape, generating each row's noise from its own seed.
+
+    Row r uses seeds[r % len(seeds)], so a batch that is duplicated for classifier-free guidance gets the same noise in
+    both halves. Noise is generated on the CPU, so results don't depend on the device used.
+    """
+    rows = []
+    for row in range(shape[0]):
+        generator = torch.Generator().manual_seed(seeds[row % len(seeds)])
+        rows.append(torch.randn((1, *shape[1:]), generator=generator))
+    return torch.cat(rows, dim=0).to(device)
 
 def generateSamples(
         device,
@@ -13,19 +31,41 @@ def generateSamples(
         width=256,
         height=256,
         init_image=None,
-        clip_score_fn=None):
-    """Given a sample generation function and a sample save function, start generating image samples."""
+        clip_score_fn=None,
+        seed=None):
+    """
+    Given a sample generation function and a sample save function, start generating image samples.
+
+    The initial noise for the sample at index i within the set of all batches is generated using its own seed,
+    seed + i. Images are encoded using the VAE posterior mean, and all other random values used while sampling come
+    from the global torch RNG, reseeded with SAMPLING_RNG_SEED for each batch and restored afterwards. The same inputs
+    and seed therefore always produce the same samples, and any single sample can be reproduced by itself by using its
+    seed with a batch size of one. The exception is DDPM sampling, where step noise is drawn for the whole batch at
+    once, so only complete batches are reproducible. If seed is not set, a random seed is chosen using the global torch
+    RNG. Each sample dict passed to save_sample has a 'seeds' list holding the seed of each image in its batch.
+    """
+    if seed is None:
+        seed = int(torch.randint(0, 2**31, ()).item())
     if init_image:
         init = Image.open(init_image).convert('RGB')
         init = init.resize((int(width),  int(height)), Image.LANCZOS)
-        init = TF.to_tensor(init).to(device).unsqueeze(0).clamp(0,1)
-        h = ldm_model.encode(init * 2 - 1).sample() *  0.18215
+        with span("vae_encode", sync=True):
+            init = TF.to_tensor(init).to(device).unsqueeze(0).clamp(0,1)
+            h = ldm_model.encode(init * 2 - 1).mean *  0.18215
         init = torch.cat(batch_size*2*[h], dim=0)
     else:
         init = None
     for i in range(num_batches):
-        samples = sample_fn(init)
-        for j, sample in enumerate(samples):
-            if j % 5 == 0 and j != diffusion.num_timesteps - 1:
-                save_sample(i, sample)
-        save_sample(i, sample, clip_score_fn)
+        with span("batch", batch=i):
+            seeds = [seed + i * batch_size + k for k in range(batch_size)]
+            rngDevices = [device] if torch.device(device).type == 'cuda' else []
+            with torch.random.fork_rng(devices=rngDevices):
+                torch.manual_seed(SAMPLING_RNG_SEED)
+                samples = sample_fn(init, noise_fn=lambda shape: createSeededNoise(seeds, shape, device))
+                for j, sample in enumerate(samples):
+                    sample['seeds'] = seeds
+                    if j % 5 == 0 and j != diffusion.num_timesteps - 1:
+                        with span("save_sample", step=j):
+                            save_sample(i, sample)
+            with span("save_sample", step=j):
+                save_sample(i, sample, clip_score_fn)
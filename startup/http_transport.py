@@ -0,0 +1,89 @@
+# Pooled HTTP connection handling for communicating with a remote image generation server
+import random
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+class HttpTransport:
+    """
+    Sends HTTP requests through a single pooled, keep-alive requests.Session.
+
+    Reusing connections avoids a new TCP+TLS handshake for every request, which is especially slow when connecting
+    through ngrok, and also keeps the client well below ngrok's per-minute connection limit. Failed requests are
+    retried with jittered exponential backoff.
+    """
+
+    # Status codes indicating that the server did not handle the request, so it can always be safely retried:
+    RETRY_STATUS_CODES = (429, 502, 503, 504)
+    # Methods that can be retried after connection failures without risking duplicate side effects:
+    IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'DELETE')
+
+    def __init__(self, connectTimeout=10, readTimeout=30, maxRetries=3, backoffBase=0.5, backoffMax=30,
+            poolSize=4):
+        """
+        Parameters:
+        -----------
+        connectTimeout : number, default 10
+            Seconds to wait when opening a new connection.
+        readTimeout : number, default 30
+            Seconds to wait for the server to send a response.
+        maxRetries : int, default 3
+            Number of times a failed request will be retried before giving up.
+        backoffBase : number, default 0.5
+            Maximum delay in seconds before the first retry. This limit doubles with each retry.
+        backoffMax : number, default 30
+            Upper limit in seconds for any delay between retries.
+        poolSize : int, default 4
+            Number of connections kept open to each host.
+        """
+        self.timeout = (connectTimeout, readTimeout)
+        self.maxRetries = maxRetries
+        self._backoffBase = backoffBase
+        self._backoffMax = backoffMax
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=poolSize, pool_maxsize=poolSize)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def backoffDelay(self, attempt):
+        """Returns a randomized delay in seconds to wait before a retry, using "full jitter" exponential backoff."""
+        return random.uniform(0, min(self._backoffMax, self._backoffBase * pow(2, attempt)))
+
+    def request(self, method, url, **kwargs):
+        """
+        Sends a request through the pooled session, retrying on failure.
+
+        Accepts the same keyword arguments as requests.Session.request, using the configured timeouts unless a
+        timeout is provided. Responses with an error status that isn't retried are returned normally, the final
+        connection error is raised if all retries fail.
+        """
+        method = method.upper()
+        if 'timeout' not in kwargs:
+            kwargs['timeout'] = self.timeout
+        attempt = 0
+        while True:
+            try:
+                res = self._session.request(method, url, **kwargs)
+                if res.status_code not in HttpTransport.RETRY_STATUS_CODES or attempt >= self.maxRetries:
+                    return res
+                print(f'{method} {url}: status {res.status_code}, retrying')
+            except (requests.ConnectionError, requests.Timeout) as err:
+                # A non-idempotent request may have reached the server before failing, unless connecting failed:
+                canRetry = method in HttpTransport.IDEMPOTENT_METHODS or isinstance(err, requests.ConnectTimeout)
+                if attempt >= self.maxRetries or not canRetry:
+                    raise
+                print(f'{method} {url}: {err}, retrying')
+            time.sleep(self.backoffDelay(attempt))
+            attempt += 1
+
+    def get(self, url, **kwargs):
+        """Sends a GET request, see HttpTransport.request."""
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        """Sends a POST request, see HttpTransport.request."""
+        return self.request('POST', url, **kwargs)
+
+    def close(self):
+        """Closes all pooled connections."""
+        self._session.close()
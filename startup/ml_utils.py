@@ -3,6 +3,7 @@ import torch
 from torchvision.transforms import functional as TF
 import numpy as np
 import os
+from guided_diffusion.profiler import span
 
 def getDevice(useCPU=False):
     """Initializes the Torch device."""
@@ -13,10 +14,36 @@ def getDevice(useCPU=False):
 
 def imageFromNumpyData(numpyData, ldm_model):
     """Extracts a PIL image from numpy image data"""
-    imageData = numpyData / 0.18215
-    imageData = imageData.unsqueeze(0)
-    numpyData = ldm_model.decode(imageData)
-    return TF.to_pil_image(numpyData.squeeze(0).add(1).div(2).clamp(0, 1))
+    with span("vae_decode", sync=True):
+        imageData = numpyData / 0.18215
+        imageData = imageData.unsqueeze(0)
+        numpyData = ldm_model.decode(imageData)
+        return TF.to_pil_image(numpyData.squeeze(0).add(1).div(2).clamp(0, 1))
+
+def getMaskCropBounds(mask, margin, alignment=8):
+    """
+    Finds the area of a latent mask that needs to be diffused, returning (top, bottom, left, right) latent bounds, or
+    None if the entire image is needed.
+
+    The mask should be a [1 x 1 x H x W] tensor where values below 0.5 mark edited pixels. The returned bounds contain
+    all edited pixels plus margin latent pixels of surrounding context, expanded to multiples of alignment so that
+    the cropped area stays compatible with the diffusion model.
+    """
+    edited = (mask[0, 0] < 0.5).nonzero()
+    height, width = mask.shape[2:]
+    if edited.shape[0] == 0:
+        return None
+    def alignedRange(minIdx, maxIdx, size):
+        start = max(0, minIdx - margin)
+        end = min(size, maxIdx + 1 + margin)
+        start -= start % alignment
+        end = min(size, end + (-end % alignment))
+        return start, end
+    top, bottom = alignedRange(int(edited[:, 0].min()), int(edited[:, 0].max()), height)
+    left, right = alignedRange(int(edited[:, 1].min()), int(edited[:, 1].max()), width)
+    if (bottom - top) == height and (right - left) == width:
+        return None
+    return top, bottom, left, right
 
 def foreachInSample(sample, batch_size, action):
     """Runs a function for each numpy image data object in a sample"""
@@ -0,0 +1,152 @@
+# Content-addressed on-disk cache for inpainting results
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+def hashImage(image):
+    """Returns a hex digest identifying a PIL image's mode, size and pixel data."""
+    digest = hashlib.sha256()
+    digest.update(f'{image.mode}:{image.width}x{image.height}:'.encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+class ResultCache:
+    """
+    Stores JSON-compatible results on disk, under keys derived from the inputs that created them.
+
+    Only results of deterministic operations should be cached, i.e. inpainting requests with a fixed seed. Entries are
+    evicted least-recently-used first whenever the total size of all cached results exceeds the size limit. Recency is
+    tracked using file modification times, so it is preserved when the cache is reopened.
+    """
+
+    def __init__(self, cacheDir, maxBytes):
+        """
+        Parameters:
+        -----------
+        cacheDir : str
+            Directory where results are stored, created if it doesn't exist.
+        maxBytes : int
+            Maximum total size of all cached results.
+        """
+        self._cacheDir = cacheDir
+        self._maxBytes = maxBytes
+        self._lock = threading.Lock()
+        # Maps keys to file sizes, ordered from least to most recently used:
+        self._entries = OrderedDict()
+        self._totalBytes = 0
+        os.makedirs(cacheDir, exist_ok=True)
+        existing = []
+        for dirPath, _, fileNames in os.walk(cacheDir):
+            for fileName in fileNames:
+                if fileName.endswith('.json'):
+                    stat = os.stat(os.path.join(dirPath, fileName))
+                    existing.append((stat.st_mtime, fileName[:-len('.json')], stat.st_size))
+        for _, key, size in sorted(existing):
+            self._entries[key] = size
+            self._totalBytes += size
+        with self._lock:
+            self._evict()
+
+    @staticmethod
+    def createKey(**params):
+        """
+        Creates a cache key from all parameters that affect a result. Parameter values must be JSON-compatible, use
+        hashImage to include images.
+        """
+        return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self._cacheDir, key[:2], f'{key}.json')
+
+    def get(self, key):
+        """Returns the result stored under a key, or None if no result is cached."""
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+        path = self._path(key)
+        try:
+            with open(path, 'rt') as file:
+                result = json.load(file)
+            os.utime(path)
+            return result
+        except (OSError, ValueError) as err:
+            print(f'Failed to read cached result {key}: {err}')
+            with self._lock:
+                self._remove(key)
+            return None
+
+    def put(self, key, result):
+        """Stores a result under a key, evicting older results if necessary."""
+        data = json.dumps(result).encode()
+        if len(data) > self._maxBytes:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first, so that a partially written result is never read:
+        tempPath = f'{path}.{threading.get_ident()}.tmp'
+        with open(tempPath, 'wb') as file:
+            file.write(data)
+        os.replace(tempPath, path)
+        with self._lock:
+            self._totalBytes -= self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            self._totalBytes += len(data)
+            self._evict()
+
+    def totalBytes(self):
+        """Returns the total size of all cached results."""
+        return self._totalBytes
+
+    def _remove(self, key):
+        self._totalBytes -= self._entries.pop(key, 0)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _evict(self):
+        while self._totalBytes > self._maxBytes and len(self._entries) > 0:
+            self._remove(next(iter(self._entries)))
+
+def getRequestCacheKey(json, edit, mask, steps, sampler, tile_size, mask_crop_margin):
+    """
+    Creates a cache key for an inpainting server request, or returns None if the request can't be cached because it
+    doesn't include a seed.
+
+    Parameters:
+    -----------
+    json : dict
+        Request body. Missing values are filled in with the same defaults the server uses.
+    edit : Image
+        Decoded image being edited.
+    mask : Image
+        Decoded inpainting mask.
+    steps : int
+        Number of diffusion steps used by the server.
+    sampler : str
+        Name of the sampling method used by the server.
+    tile_size, mask_crop_margin : int or None
+        Server tiling and cropping options, which affect the generated images.
+    """
+    if json.get('seed') is None:
+        return None
+    return ResultCache.createKey(
+            edit=hashImage(edit),
+            mask=hashImage(mask),
+            prompt=json.get('prompt', ''),
+            negative=json.get('negative', ''),
+            guidanceScale=json.get('guidanceScale', 5.0),
+            skipSteps=json.get('skipSteps', False),
+            cutn=json.get('cutn', 16),
+            batch_size=json.get('batch_size', 1),
+            num_batches=json.get('num_batches', 1),
+            width=json.get('width', 256),
+            height=json.get('height', 256),
+            seed=json['seed'],
+            steps=steps,
+            sampler=sampler,
+            tile_size=tile_size,
+            mask_crop_margin=mask_crop_margin)
@@ -0,0 +1,92 @@
+# Splits large latent images into overlapping tiles so that they can be diffused at native resolution
+import torch
+
+def getTileStarts(size, tileSize, overlap):
+    """
+    Returns the starting offsets of evenly spaced tiles covering a dimension of the given size.
+
+    Tiles overlap by at least the given amount. If the dimension fits within one tile, a single tile starting at 0 is
+    used.
+    """
+    if size <= tileSize:
+        return [0]
+    stride = max(1, tileSize - overlap)
+    tileCount = -(-(size - tileSize) // stride) + 1
+    # Spread tiles evenly, so that the last tile ends exactly at the edge:
+    return [round(i * (size - tileSize) / (tileCount - 1)) for i in range(tileCount)]
+
+def getTileWeights(tileHeight, tileWidth, overlap, device):
+    """
+    Returns a [tileHeight x tileWidth] tensor of blending weights, ramping up linearly over the overlap area at each
+    edge so that overlapping tiles fade smoothly into each other.
+    """
+    def ramp(size):
+        steps = torch.arange(size, device=device, dtype=torch.float32)
+        distance = torch.minimum(steps, size - 1 - steps) + 1
+        return (distance / (overlap + 1)).clamp(max=1)
+    return ramp(tileHeight)[:, None] * ramp(tileWidth)[None, :]
+
+def createTiledModel(model, tileSize, overlap=8, maxTileBatch=None):
+    """
+    Wraps a diffusion model so that it processes large inputs as overlapping tiles.
+
+    Each time the model is called, the latent input is split into overlapping [tileSize x tileSize] tiles. All tiles
+    are run through the model together as one batch, and the outputs are blended back together using weights that
+    fade out across the overlapping areas. Because this blending happens on every model call, each diffusion step
+    sees a single seamless latent image, and tile boundaries don't create visible seams. The 'image_embed' keyword
+    argument is cropped to match each tile, and all other keyword arguments are repeated for each tile.
+
+    Parameters:
+    -----------
+    model : function(Tensor x, Tensor timesteps, **kwargs)
+        Diffusion model to wrap.
+    tileSize : int
+        Width and height of each tile, in latent pixels (1/8 of image pixels).
+    overlap : int, default 8
+        Minimum overlap between adjacent tiles, in latent pixels.
+    maxTileBatch : int, optional
+        Maximum number of tiles processed in a single model call, to limit memory use. By default, all tiles are
+        processed at once.
+    Returns:
+    --------
+    tiledModel : function(Tensor x, Tensor timesteps, **kwargs)
+        Function with the same signature as the model. Inputs no larger than tileSize are passed through unchanged.
+    """
+    assert tileSize > overlap >= 0
+
+    def tiledModel(x, ts, **kwargs):
+        height, width = x.shape[2:]
+        if height <= tileSize and width <= tileSize:
+            return model(x, ts, **kwargs)
+        tiles = [(y, x0) for y in getTileStarts(height, tileSize, overlap) for x0 in getTileStarts(width, tileSize,
+                overlap)]
+        tileHeight = min(tileSize, height)
+        tileWidth = min(tileSize, width)
+        weights = getTileWeights(tileHeight, tileWidth, overlap, x.device)
+        batchSize = x.shape[0]
+        tilesPerCall = maxTileBatch if maxTileBatch else len(tiles)
+
+        output = None
+        weightSum = torch.zeros((height, width), device=x.device)
+        for chunkStart in range(0, len(tiles), tilesPerCall):
+            chunk = tiles[chunkStart:chunkStart + tilesPerCall]
+            def cropTiles(tensor):
+                return torch.cat([tensor[:, :, y:y + tileHeight, x0:x0 + tileWidth] for y, x0 in chunk], dim=0)
+            tileKwargs = {}
+            for key, value in kwargs.items():
+                if key == 'image_embed' and value is not None:
+                    tileKwargs[key] = cropTiles(value)
+                elif isinstance(value, torch.Tensor):
+                    tileKwargs[key] = torch.cat([value] * len(chunk), dim=0)
+                else:
+                    tileKwargs[key] = value
+            tileOutput = model(cropTiles(x), torch.cat([ts] * len(chunk), dim=0), **tileKwargs)
+            if output is None:
+                output = torch.zeros((batchSize, tileOutput.shape[1], height, width), device=x.device,
+                        dtype=tileOutput.dtype)
+            for i, (y, x0) in enumerate(chunk):
+                output[:, :, y:y + tileHeight, x0:x0 + tileWidth] += \
+                        tileOutput[i * batchSize:(i + 1) * batchSize] * weights
+                weightSum[y:y + tileHeight, x0:x0 + tileWidth] += weights
+        return output / weightSum
+    return tiledModel
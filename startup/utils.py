@@ -4,6 +4,7 @@ import argparse
 import base64
 import requests
 import io
+from guided_diffusion.profiler import span
 
 def fetch(url_or_path):
     """Open a file from either a path or a URL."""
@@ -19,8 +20,10 @@ def fetch(url_or_path):
 def imageToBase64(pilImage):
     """Convert a PIL image to a base64 string."""
     buffer = io.BytesIO()
-    pilImage.save(buffer, format='PNG')
-    return str(base64.b64encode(buffer.getvalue()), 'utf-8')
+    with span("png_encode"):
+        pilImage.save(buffer, format='PNG')
+    with span("base64_encode"):
+        return str(base64.b64encode(buffer.getvalue()), 'utf-8')
 
 def loadImageFromBase64(imageStr):
     """Initialize a PIL image object from base64-encoded string data."""
@@ -95,10 +98,22 @@ def buildArgParser(defaultModel='inpaint.pt', includeEditParams=True, includeGen
     parser.add_argument('--clip_guidance_scale', type = float, default = 150, required = False,
                         help='Controls how much the image should look like the prompt') # may need to use lower value for ddim
 
+    parser.add_argument('--clip_guidance_interval', type = int, default = 1, required = False,
+                        help='Only apply CLIP guidance every n steps')
+
+    parser.add_argument('--fused_clip_guidance', dest='fused_clip_guidance', action='store_true',
+                        help='Compute CLIP guidance from the same model prediction used by each step, instead of running the model again. Not supported with --ddpm')
+
     parser.add_argument('--cutn', type = int, default = 16, required = False,
                         help='Number of cuts')
 
     parser.add_argument('--ddim', dest='ddim', action='store_true') # turn on to use 50 step ddim
 
     parser.add_argument('--ddpm', dest='ddpm', action='store_true') # turn on to use 50 step ddim
+
+    parser.add_argument('--tile_size', type = int, default = 256, required = False,
+                        help='Images larger than this size are inpainted as overlapping tiles (multiple of 64, 0 to disable)')
+
+    parser.add_argument('--mask_crop_margin', type = int, default = 64, required = False,
+                        help='Only diffuse the masked area plus this many pixels of context (multiple of 8, -1 to disable)')
     return parser